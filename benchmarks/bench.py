@@ -0,0 +1,234 @@
+"""
+Benchmarks the DOA ingestion and /cache serving hot paths against a synthetic Kraken environment.
+
+    python -m benchmarks.bench --output results.json
+
+Results are printed and saved as JSON, so runs from different releases or stations can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.synthetic import create_kraken_dir, doa_line, DoaWriter
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'count': len(values), 'mean': statistics.fmean(values), 'p50': pick(0.5), 'p95': pick(0.95),
+            'p99': pick(0.99), 'max': values[-1]}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return ''
+
+
+def bench_ingestion(app_data, logger, doa_file: str, batch_sizes: list[int], iterations: int,
+                    array_type: str) -> list[dict]:
+    results = []
+    for batch_size in batch_sizes:
+        app_data.doa_reader.reset()
+        open(doa_file, 'w').close()
+        app_data.update_cache(logger)
+        durations = []
+        for _ in range(iterations):
+            timestamp = int(time.time() * 1000)
+            with open(doa_file, 'a') as f:
+                f.write(''.join(doa_line(timestamp + i, array_type) + '\n' for i in range(batch_size)))
+            start = time.perf_counter()
+            app_data.update_cache(logger)
+            durations.append(time.perf_counter() - start)
+        total = sum(durations)
+        results.append({
+            'batch_size': batch_size,
+            'iterations': iterations,
+            'lines_per_s': batch_size * iterations / total if total else None,
+            'tick_us': percentiles([d * 1e6 for d in durations])
+        })
+    return results
+
+
+def fill_cache(app_data, size: int, array_type: str):
+    from src.doa_cache import DoaCache
+    app_data.cache = DoaCache(max(size, 1))
+    timestamp = int(time.time() * 1000) - size
+    batch, _ = app_data.parser.parse([doa_line(timestamp + i, array_type) for i in range(size)], app_data.array_angle)
+    app_data.cache.extend(batch)
+
+
+def bench_cache_requests(app, app_data, cache_sizes: list[int], filters: list[dict], clients: int,
+                         duration_s: float, accept_encoding: str, array_type: str) -> list[dict]:
+    results = []
+    for size in cache_sizes:
+        fill_cache(app_data, size, array_type)
+        for query in filters:
+            latencies = []
+            lock = threading.Lock()
+            deadline = time.perf_counter() + duration_s
+
+            def client():
+                test_client = app.test_client()
+                local = []
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = test_client.get('/cache', query_string=query,
+                                               headers={'Accept-Encoding': accept_encoding})
+                    response.get_data()
+                    local.append(time.perf_counter() - start)
+                with lock:
+                    latencies.extend(local)
+
+            threads = [threading.Thread(target=client) for _ in range(clients)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            results.append({
+                'cache_size': size,
+                'query': query,
+                'clients': clients,
+                'accept_encoding': accept_encoding,
+                'requests_per_s': len(latencies) / elapsed,
+                'latency_ms': percentiles([latency * 1000 for latency in latencies])
+            })
+    return results
+
+
+def bench_latency(app, app_data, server, doa_file: str, rate_hz: float, duration_s: float, poll_ms: float,
+                  array_type: str) -> dict:
+    from src.doa_cache import DoaCache
+    from src.config import DOA_CACHE_CAPACITY
+    app_data.cache = DoaCache(DOA_CACHE_CAPACITY)
+    app_data.doa_reader.reset()
+    subscription = app_data.broadcaster.subscribe()
+    server.start_doa_ingestion()
+
+    writer = DoaWriter(doa_file, rate_hz, array_type)
+    to_cache = []
+    to_response = []
+    stop = threading.Event()
+
+    def subscriber():
+        while not stop.is_set():
+            for record in subscription.get(timeout=0.1) or []:
+                if record.timestamp in writer.written_at:
+                    to_cache.append(time.perf_counter() - writer.written_at[record.timestamp])
+
+    def poller():
+        test_client = app.test_client()
+        cursor = None
+        while not stop.is_set():
+            payload = test_client.get('/cache', query_string={'since_cursor': cursor} if cursor else {}).get_json()
+            received_at = time.perf_counter()
+            if cursor is not None:
+                for row in payload['data']:
+                    if row[0] in writer.written_at:
+                        to_response.append(received_at - writer.written_at[row[0]])
+            cursor = payload['cursor']
+            time.sleep(poll_ms / 1000.0)
+
+    threads = [threading.Thread(target=subscriber, daemon=True), threading.Thread(target=poller, daemon=True)]
+    for thread in threads:
+        thread.start()
+    writer.start()
+    time.sleep(duration_s)
+    writer.stop()
+    time.sleep(0.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    app_data.broadcaster.unsubscribe(subscription)
+    return {
+        'rate_hz': rate_hz,
+        'poll_ms': poll_ms,
+        'writes': writer.writes,
+        'doa_to_cache_ms': percentiles([latency * 1000 for latency in to_cache]),
+        'doa_to_response_ms': percentiles([latency * 1000 for latency in to_response])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    parser.add_argument('--array-type', default='UCA', choices=['UCA', 'ULA'])
+    parser.add_argument('--kraken-version', default='1.7.0')
+    parser.add_argument('--ingestion-mode', default='auto', choices=['auto', 'inotify', 'poll'])
+    parser.add_argument('--batch-sizes', default='1,10,100,1000')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--cache-sizes', default='50,500,4000')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--accept-encoding', default='br')
+    parser.add_argument('--request-duration', type=float, default=3.0, help='Seconds per /cache scenario')
+    parser.add_argument('--rate', type=float, default=10.0, help='DOA updates per second for the latency test')
+    parser.add_argument('--latency-duration', type=float, default=10.0)
+    parser.add_argument('--poll-ms', type=float, default=50.0)
+    parser.add_argument('--skip', default='', help='Comma separated list of ingestion,requests,latency')
+    args = parser.parse_args()
+    skip = set(filter(None, args.skip.split(',')))
+
+    workdir = tempfile.mkdtemp(prefix='geo-proxy-bench-')
+    doa_file = create_kraken_dir(workdir, args.array_type)
+    # The configuration is read at import time, so the environment has to be ready before importing the server
+    os.environ['DOA_PATH'] = workdir
+    os.environ['KRAKEN_VERSION'] = args.kraken_version
+    os.environ['DOA_INGESTION_MODE'] = args.ingestion_mode
+    os.environ['DOA_TIME_THRESHOLD_MS'] = str(3_600_000)
+
+    import server
+    from src.app_data import app_data
+    from src.config import PROXY_VERSION
+    from src import doa_parser
+    logger = logging.getLogger('bench')
+    server.app.logger.setLevel(logging.WARNING)
+    server.app.debug = False
+
+    results = {
+        'meta': {
+            'proxy_version': PROXY_VERSION,
+            'git_revision': git_revision(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'numpy': doa_parser.np is not None,
+            'args': vars(args)
+        }
+    }
+    if 'ingestion' not in skip:
+        results['ingestion'] = bench_ingestion(app_data, logger, doa_file, [int(x) for x in args.batch_sizes.split(',')],
+                                               args.iterations, args.array_type)
+    if 'requests' not in skip:
+        newer_than = int(time.time() * 1000) - 1000
+        filters = [{}, {'confidence': 5}, {'confidence': 5, 'rssi': -40}, {'newer_than': newer_than}]
+        results['requests'] = bench_cache_requests(server.app, app_data, [int(x) for x in args.cache_sizes.split(',')],
+                                                   filters, args.clients, args.request_duration, args.accept_encoding,
+                                                   args.array_type)
+    if 'latency' not in skip:
+        results['latency'] = bench_latency(server.app, app_data, server, doa_file, args.rate, args.latency_duration,
+                                           args.poll_ms, args.array_type)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
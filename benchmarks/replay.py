@@ -0,0 +1,172 @@
+"""
+Replays a capture recorded with CAPTURE_FILE into a stand-in Kraken directory, where a geo-proxy started with the same
+DOA_PATH ingests and serves it.
+
+    python -m benchmarks.replay capture.jsonl.gz --doa-path /tmp/kraken-standin --speed 10 --pipeline
+
+Settings changes are applied to settings.json and DOA lines appended to DOA_value.html, with their timestamps moved to
+the replay time. With --pipeline the lines are also ingested in this process by AppData.update_cache, and the
+ingestion throughput is reported as JSON, so runs of different builds can be compared.
+Without --pipeline the DOA file only grows, so that a proxy reading it misses no line however fast the replay goes.
+With it, the file is rewritten once it grows past DOA_FILE_ROTATE_BYTES, right after the in-process ingestion has read
+it, which another proxy reading the same file may not have done yet at --speed 0.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from benchmarks.bench import git_revision
+from benchmarks.synthetic import create_kraken_dir
+
+# The DOA file is rewritten from scratch once it grows past this size
+DOA_FILE_ROTATE_BYTES = 1024 * 1024
+
+
+def line_timestamp(line: str) -> Optional[int]:
+    try:
+        return int(line.partition(', ')[0])
+    except ValueError:
+        return None
+
+
+def retime(line: str, anchor_ms: int, first_timestamp_ms: int, speed: float) -> str:
+    """
+    Moves the timestamp of a DOA line to the replay time: the first line of the capture, with first_timestamp_ms,
+    lands on anchor_ms. Lines are moved relative to the timestamps of the capture, not to the arrival times, which come
+    from the clock of the proxy and may be skewed from the Kraken one. Intervals are divided by the speed, which keeps
+    the lines in order. At maximum speed they are only shifted, and may end up in the future.
+    """
+    timestamp, separator, rest = line.partition(', ')
+    try:
+        offset_ms = int(timestamp) - first_timestamp_ms
+    except ValueError:
+        return line
+    return f'{anchor_ms + (round(offset_ms / speed) if speed > 0 else offset_ms)}{separator}{rest}'
+
+
+class DoaFileWriter:
+    """
+    Appends lines to the DOA file, which a tailing reader ingests like Kraken's own writes. With rotate, the file is
+    rewritten with the new lines only once it is past DOA_FILE_ROTATE_BYTES, which is only safe when the reader is
+    known to have read everything before every write.
+    """
+
+    def __init__(self, path: str, rotate: bool):
+        self.path = path
+        self.rotate = rotate
+        self._size = os.path.getsize(path)
+
+    def _rewrite(self, lines: list[str]):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.writelines(line + '\n' for line in lines)
+        os.replace(temp_path, self.path)
+        self._size = os.path.getsize(self.path)
+
+    def write(self, lines: list[str]):
+        if self.rotate and self._size >= DOA_FILE_ROTATE_BYTES:
+            self._rewrite(lines)
+            return
+        data = ''.join(line + '\n' for line in lines).encode()
+        with open(self.path, 'ab') as f:
+            f.write(data)
+        self._size += len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help='Capture file')
+    parser.add_argument('--doa-path', required=True, help='Stand-in Kraken directory, the DOA_PATH of the proxy')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed factor, 0 for as fast as possible')
+    parser.add_argument('--pipeline', action='store_true', help='Also ingest the lines with AppData.update_cache')
+    parser.add_argument('--output', help='Save the results to this JSON file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    logger = logging.getLogger('replay')
+
+    doa_file = create_kraken_dir(args.doa_path)
+    # The configuration is read at import time, so the environment has to be ready before importing the proxy
+    os.environ['DOA_PATH'] = args.doa_path
+    os.environ['CAPTURE_FILE'] = ''
+    os.environ.setdefault('HISTORY_ENABLED', 'false')
+
+    from src import metrics
+    from src.capture import read_header, read_capture, DOA, SETTINGS
+    from src.config import KRAKEN_SETTINGS_FILE, PROXY_VERSION
+    from src.kraken_settings import SettingsWriter
+    from src.utils import now
+
+    header = read_header(args.capture)
+    if header.get('kraken_version'):
+        os.environ.setdefault('KRAKEN_VERSION', header['kraken_version'])
+    # The in-process ingestion reads the file after every write, another proxy may fall behind
+    writer = DoaFileWriter(doa_file, rotate=args.pipeline)
+    settings_writer = SettingsWriter(KRAKEN_SETTINGS_FILE, 0, 'none')
+    app_data = None
+    if args.pipeline:
+        from src.app_data import app_data
+
+    logger.info(f'Replaying {args.capture} (Kraken {header.get("kraken_version")}, captured by geo-proxy '
+                f'{header.get("proxy_version")}) into {doa_file} at '
+                f'{"maximum speed" if args.speed <= 0 else f"{args.speed:g}x"}')
+    events = lines = 0
+    ingest_seconds = 0.0
+    started_at = time.monotonic()
+    first_arrival = None
+    first_timestamp = anchor_ms = None
+    for arrived_at, kind, value in read_capture(args.capture):
+        if first_arrival is None:
+            first_arrival = arrived_at
+        if args.speed > 0:
+            delay = started_at + (arrived_at - first_arrival) / 1000.0 / args.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        events += 1
+        if kind == SETTINGS:
+            settings_writer.update(value)
+        elif kind == DOA:
+            if first_timestamp is None:
+                first_timestamp = next((t for t in map(line_timestamp, value) if t is not None), None)
+                # The first line is moved to the time it is replayed at
+                anchor_ms = now()
+            if first_timestamp is not None:
+                value = [retime(line, anchor_ms, first_timestamp, args.speed) for line in value]
+            writer.write(value)
+            lines += len(value)
+            if app_data is not None:
+                ingest_started_at = time.perf_counter()
+                app_data.update_cache(logger)
+                ingest_seconds += time.perf_counter() - ingest_started_at
+
+    results = {
+        'meta': {
+            'proxy_version': PROXY_VERSION,
+            'git_revision': git_revision(),
+            'capture': args.capture,
+            'captured_with': header,
+            'args': vars(args)
+        },
+        'replay': {'events': events, 'lines': lines, 'seconds': time.monotonic() - started_at}
+    }
+    if app_data is not None:
+        results['ingestion'] = {
+            'lines_read': metrics.doa_lines_read.value(),
+            'lines_rejected': metrics.doa_lines_rejected.value(),
+            'records_outdated': metrics.doa_records_outdated.value(),
+            'records_added': metrics.doa_records_added.value(),
+            'update_cache_seconds': ingest_seconds,
+            'lines_per_second': metrics.doa_lines_read.value() / ingest_seconds if ingest_seconds else None
+        }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
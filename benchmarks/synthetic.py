@@ -0,0 +1,78 @@
+import json
+import os
+import random
+import threading
+import time
+
+KRAKEN_SETTINGS = {
+    'center_freq': 433.0,
+    'vfo_bw_0': 12500,
+    'vfo_mode': 'Standard',
+    'latitude': 50.45,
+    'longitude': 30.52,
+    'location_source': 'Static',
+    'station_id': 'BENCH',
+    'ant_arrangement': 'UCA'
+}
+
+
+def doa_line(timestamp: int, array_type: str = 'UCA', frequency_hz: int = 433_000_000) -> str:
+    return (f'{timestamp}, {random.uniform(0, 360):.3f}, {random.uniform(0, 10):.3f}, {random.uniform(-80, 0):.3f}, '
+            f'{frequency_hz}, {array_type}, 0, BENCH, 50.45, 30.52, 0, 0, None')
+
+
+def create_kraken_dir(path: str, array_type: str = 'UCA') -> str:
+    """Creates a stand-in DOA_PATH with a settings.json and an empty DOA_value.html. Returns the DOA file path."""
+    os.makedirs(os.path.join(path, '_android_web'), exist_ok=True)
+    with open(os.path.join(path, 'settings.json'), 'w') as f:
+        f.write(json.dumps({**KRAKEN_SETTINGS, 'ant_arrangement': array_type}, indent=2))
+    doa_file = os.path.join(path, '_android_web', 'DOA_value.html')
+    open(doa_file, 'w').close()
+    return doa_file
+
+
+class DoaWriter:
+    """
+    Writes DOA lines at a given rate like Kraken does. In 'rewrite' mode every update replaces the file contents,
+    in 'append' mode lines are appended. Remembers the write time of every timestamp for latency measurements.
+    """
+
+    def __init__(self, doa_file: str, rate_hz: float, array_type: str = 'UCA', mode: str = 'rewrite',
+                 lines_per_write: int = 1):
+        self.doa_file = doa_file
+        self.rate_hz = rate_hz
+        self.array_type = array_type
+        self.mode = mode
+        self.lines_per_write = lines_per_write
+        self.written_at: dict[int, float] = {}
+        self.writes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write_once(self):
+        timestamp = int(time.time() * 1000)
+        lines = [doa_line(timestamp + i, self.array_type) for i in range(self.lines_per_write)]
+        # Registered before writing, the reader may pick the lines up before write() returns
+        written_at = time.perf_counter()
+        for i in range(self.lines_per_write):
+            self.written_at[timestamp + i] = written_at
+        with open(self.doa_file, 'w' if self.mode == 'rewrite' else 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.writes += 1
+
+    def run(self):
+        interval = 1.0 / self.rate_hz
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            self.write_once()
+            next_at += interval
+            self._stop.wait(max(0.0, next_at - time.perf_counter()))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='doa-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
@@ -1,16 +1,50 @@
+import atexit
+import hmac
+import http.client
+import multiprocessing
 import shutil
+import signal
+import socket
+import sys
+import threading
+import time
 import traceback
+import zlib
 from datetime import datetime
+from typing import Iterator, Optional
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, request, Response, jsonify
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+from flask import Flask, request, Response, jsonify, g
 from flask_cors import CORS
 from flask_compress import Compress
+from waitress import serve as waitress_serve
 
-from src import ws_client
+from src import ws_client, encoders, metrics
+from src.aggregator import aggregator
 from src.app_data import app_data
+from src.capture import capture_writer
 from src.config import (LOG_LEVEL, SETTINGS_FILE, NOCALL, PROXY_VERSION, BACKUP_DIR_NAME, DOA_READ_REGULARITY_MS,
-                        KRAKEN_SETTINGS_FILENAME)
+                        KRAKEN_SETTINGS_FILENAME, DOA_INGESTION_MODE, DOA_WATCH_TIMEOUT_MS, STREAM_KEEPALIVE_MS, DEBUG,
+                        SERVER_MODE, SERVER_HOST, SERVER_PORT, SERVER_THREADS, SERVER_CONNECTION_LIMIT,
+                        SERVER_BACKLOG, SERVER_CHANNEL_TIMEOUT_S, SERVER_WORKERS, SHARED_CACHE_FILE,
+                        SHARED_CACHE_FOLLOW_MS, DOA_CACHE_CAPACITY, HISTORY_ENABLED, HISTORY_DEFAULT_RANGE_MS,
+                        RESPONSE_CACHE_SIZE, CACHE_STREAM_MIN_ROWS, DOA_POLL_SCHEDULE, DOA_POLL_MIN_MS, DOA_POLL_MAX_MS,
+                        DOA_POLL_STALE_FACTOR, DOA_POLL_THERMAL_C, DOA_POLL_THERMAL_FACTOR, DEBUG_TOKEN,
+                        DEBUG_PROFILE_MAX_S, DEBUG_PROFILE_HZ, STREAM_MAX_SUBSCRIBERS, SERVER_SPARE_THREADS,
+                        SERVER_ADMIN_SOCKET, DOA_TIME_THRESHOLD_MS)
+from src.dataclasses import CacheRecord
+from src.doa_cache import FIELD_COLUMNS
+from src.file_watcher import FileWatcher, inotify_available
+from src.health import health_sampler
+from src.history import history_store, downsample
+from src.ingest_scheduler import IngestionScheduler
+from src.kraken_settings import kraken_settings, geo_settings, writer_for
+from src.power import power_jobs, SUCCEEDED, FAILED
+from src.profiler import sample_stacks, collapsed, PhaseTimer, phase
+from src.response_cache import ResponseCache
+from src.shm_cache import SharedDoaCache
+from src.summary import summarize, WEIGHTINGS
 from src.system import *
 from src.utils import *
 
@@ -21,7 +55,7 @@ if not os.path.exists(SETTINGS_FILE):
     update_config(SETTINGS_FILE, {})
 
 
-if not os.path.exists(KRAKEN_SETTINGS_FILE):
+if not os.path.exists(KRAKEN_SETTINGS_FILE) and aggregator is None:
     raise Exception(f'File {KRAKEN_SETTINGS_FILE} does not exist')
 
 
@@ -34,15 +68,65 @@ class Error:
 
 
 app = Flask(__name__)
-app.debug = True
+app.debug = DEBUG
 app.logger.setLevel(LOG_LEVEL)
 compress = Compress()
+# Streamed responses compress themselves as they go, Flask-Compress would buffer them whole
+app.config['COMPRESS_STREAMS'] = False
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+power_jobs.logger = app.logger
+power_jobs.on_finished = lambda job: health_sampler.sample()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+
+
+def metrics_endpoint() -> str:
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.after_request
+def observe_response(response: Response):
+    # Registered before Flask-Compress, so it runs after it and sees the compressed response
+    endpoint = metrics_endpoint()
+    if 'request_started_at' in g:
+        metrics.http_request_seconds.observe(time.perf_counter() - g.request_started_at, endpoint, request.method,
+                                             response.status_code)
+    if not response.is_streamed:
+        metrics.http_response_bytes.observe(response.calculate_content_length() or 0, endpoint, 'sent')
+    return response
+
+
 compress.init_app(app)
+
+
+@app.after_request
+def observe_uncompressed_response(response: Response):
+    if response.is_streamed:
+        return response
+    # Bodies compressed ahead of Flask-Compress (see precompress) leave their uncompressed size behind
+    size = g.pop('uncompressed_size', None)
+    if size is None and 'Content-Encoding' not in response.headers:
+        size = response.calculate_content_length() or 0
+    if size is not None:
+        metrics.http_response_bytes.observe(size, metrics_endpoint(), 'uncompressed')
+    return response
+
+
 CORS(app)
 
 
+def not_aggregated() -> Response:
+    """Response to the requests about a local Kraken, which an aggregator does not have"""
+    return Response(Error('Not available in the aggregator mode').to_json(), status=404)
+
+
 @app.post('/frequency')
 def set_frequency():
+    if aggregator is not None:
+        return not_aggregated()
     try:
         payload = request.json
         try:
@@ -69,6 +153,8 @@ def set_frequency():
 
 @app.post('/coordinates')
 def set_coordinates():
+    if aggregator is not None:
+        return not_aggregated()
     try:
         payload = request.json
         lat = float(payload.get('lat'))
@@ -87,14 +173,16 @@ def set_coordinates():
 
 @app.post('/array_angle')
 def set_array_angle():
+    if aggregator is not None:
+        return not_aggregated()
     try:
         payload = request.json
         array_angle = payload.get('array_angle', None)
         if array_angle is not None and not is_valid_angle(float(array_angle)):
             return Response(Error(f'"{array_angle}" is not a valid angle').to_json(), status=400)
-        app_data.array_angle = round(float(array_angle), 3) if array_angle is not None else None
-        app.logger.info(f"Updating antenna array angle (heading): {app_data.array_angle}")
-        set_config_value(SETTINGS_FILE, 'array_angle', app_data.array_angle)
+        array_angle = round(float(array_angle), 3) if array_angle is not None else None
+        app.logger.info(f"Updating antenna array angle (heading): {array_angle}")
+        app_data.array_angle = array_angle
         return get_settings()
     except:
         app.logger.error(traceback.format_exc())
@@ -103,6 +191,8 @@ def set_array_angle():
 
 @app.post('/settings')
 def set_settings():
+    if aggregator is not None:
+        return not_aggregated()
     try:
         params = {}
         payload = request.json
@@ -119,7 +209,9 @@ def set_settings():
 
 @app.get('/settings')
 def get_settings():
-    kraken_config = read_config(KRAKEN_SETTINGS_FILE)
+    if aggregator is not None:
+        return not_aggregated()
+    kraken_config = kraken_settings.snapshot()
     lat = kraken_config['latitude']
     lon = kraken_config['longitude']
     frequency_hz = int(kraken_config['center_freq'] * 1_000_000)
@@ -140,6 +232,44 @@ def ping():
     return {"message": "ping"}
 
 
+# Set in server workers, where the ingestion metrics and threads are those of the main process behind this socket
+admin_socket: Optional[str] = None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def ask_main_process(path: str, timeout: float) -> http.client.HTTPResponse:
+    """Sends a GET request to the main process, with the Authorization header of the current request"""
+    connection = UnixHTTPConnection(admin_socket, timeout)
+    headers = {'Authorization': request.headers['Authorization']} if 'Authorization' in request.headers else {}
+    connection.request('GET', path, headers=headers)
+    return connection.getresponse()
+
+
+@app.get('/metrics')
+def get_metrics():
+    body = metrics.registry.render()
+    if request.args.get('scope') == 'ingestion':
+        body = metrics.ingestion_registry.render()
+    elif admin_socket is None:
+        body += metrics.ingestion_registry.render()
+    else:
+        try:
+            body += ask_main_process('/metrics?scope=ingestion', 5).read().decode()
+        except OSError as e:
+            app.logger.warning(f'Cannot get the ingestion metrics from the main process: {e}')
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.get('/healthcheck')
 def healthcheck():
     now_ = now()
@@ -150,11 +280,12 @@ def healthcheck():
     settings_file_exists = kraken_settings_file_exists()
     doa_file_exists = kraken_doa_file_exists()
     doa_ok = doa_updated_ms_ago < 1000 and doa_file_exists if doa_updated_ms_ago else False
-    kraken_service_running = is_kraken_service_running() if not in_docker else None
-    kraken_sdr_connected = is_kraken_sdr_connected() if not in_docker else None
-    cpu_temperature = get_cpu_temperature() if not in_docker else None
+    health = health_sampler.snapshot()
+    kraken_service_running = health['kraken_service_running']
+    kraken_sdr_connected = health['kraken_sdr_connected']
+    cpu_temperature = health['cpu_temperature']
     status_ok = doa_file_exists and settings_file_exists and (in_docker or (kraken_service_running and kraken_sdr_connected))
-    return jsonify({
+    result = {
         "status_ok": status_ok,
         "doa_ok": doa_ok,
         "in_docker": in_docker,
@@ -168,32 +299,16 @@ def healthcheck():
         "kraken_suspended": not (kraken_service_running and kraken_sdr_connected) if not in_docker else None,
         "cpu_temperature": cpu_temperature,
         "array_angle": app_data.array_angle,
-        "proxy_version": PROXY_VERSION
-    })
+        "proxy_version": PROXY_VERSION,
+        "health_sampled_ms_ago": now_ - health['sampled_at']
+    }
+    if request.args.get('history'):
+        result['history'] = [[sample['sampled_at'], sample['cpu_temperature'], sample['kraken_service_running'],
+                              sample['kraken_sdr_connected']] for sample in health_sampler.history]
+    return jsonify(result)
 
 
-@app.get('/cache')
-def cache():
-    app.logger.debug(f'Responding with cache (args={request.args}). Current size: {len(app_data.cache)}')
-    confidence = request.args.get('confidence')
-    rssi = request.args.get('rssi')
-    newer_than = request.args.get('newer_than')
-    result = sorted(list(app_data.cache), key=lambda x: x.timestamp, reverse=True)
-    latest = result[0] if result else None
-
-    if confidence:
-        result = [record for record in result if record.confidence >= float(confidence)]
-
-    if rssi:
-        result = [record for record in result if record.rssi >= float(rssi)]
-
-    if newer_than:
-        result = [record for record in result if record.timestamp >= int(newer_than)]
-
-    app.logger.debug(f'Filtered cache size: {len(app_data.cache)}')
-
-    data = [[record.timestamp, record.doa, record.confidence, record.rssi, record.frequency_hz] for record in result]
-
+def station_metadata(latest: Optional[CacheRecord]) -> dict:
     station_alias = get_cached_config_value(KRAKEN_SETTINGS_FILE, 'station_id')
     latitude = get_cached_config_value(KRAKEN_SETTINGS_FILE, 'latitude')
     longitude = get_cached_config_value(KRAKEN_SETTINGS_FILE, 'longitude')
@@ -205,34 +320,461 @@ def cache():
         curr_ant_arrangement = get_cached_config_value(KRAKEN_SETTINGS_FILE, 'ant_arrangement')
     bandwidth = get_cached_bandwidth_from_kraken_config()
 
-    return jsonify({
+    return {
         'lat': latitude if latitude is not None else 0,
         'lon': longitude if longitude is not None else 0,
         'arr': curr_ant_arrangement,
         'alias': station_alias if station_alias != NOCALL else None,
         'freq': curr_frequency,
         'array_angle': app_data.array_angle,
-        'bandwidth': bandwidth,
-        'data': data
+        'bandwidth': bandwidth
+    }
+
+
+def compress_algorithm() -> Optional[str]:
+    # Flask-Compress' own choice, so that precompressed bodies are the ones it would have sent
+    return compress._choose_compress_algorithm(request.headers.get('Accept-Encoding', ''))
+
+
+def precompress(body: bytes, mimetype: str, algorithm: Optional[str], timer: Optional[PhaseTimer] = None) \
+        -> tuple[bytes, Optional[str], int]:
+    """
+    Compresses a body the way Flask-Compress would. Returns the body, its encoding if it was compressed and the
+    uncompressed size.
+    """
+    if algorithm is None or mimetype not in app.config['COMPRESS_MIMETYPES'] \
+            or len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return body, None, len(body)
+    with phase(timer, 'compress'):
+        return compress.compress(app, Response(body), algorithm), algorithm, len(body)
+
+
+def gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def streamed_json(chunks: Iterator[bytes]) -> Response:
+    # Compressed here as it is streamed, clients that do not accept gzip get it uncompressed
+    if request.accept_encodings['gzip']:
+        response = Response(gzip_chunks(chunks), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(chunks, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def cache_etag(generation: int, metadata, mimetype: str) -> str:
+    query = sorted((key, value) for key, value in request.args.items(multi=True))
+    return f'{generation:x}-{zlib.crc32(json.dumps([metadata, query, mimetype]).encode()):08x}'
+
+
+def etag_matches(etag: str) -> bool:
+    # Flask-Compress appends the encoding to the ETag, e.g. W/"abc:br"
+    return any(tag.split(':')[0] == etag for tag in request.if_none_match.as_set(include_weak=True))
+
+
+def in_window(newer_than: Optional[int]) -> int:
+    """Leaves out the records older than DOA_TIME_THRESHOLD_MS that expiry has not dropped yet"""
+    threshold = now() - DOA_TIME_THRESHOLD_MS
+    return threshold if newer_than is None else max(newer_than, threshold)
+
+
+def frequencies_filter() -> Optional[set[int]]:
+    """Parses the frequency (repeatable) and frequencies (comma separated) query parameters"""
+    values = request.args.getlist('frequency') + request.args.get('frequencies', '').split(',')
+    frequencies = {int(value) for value in values if value.strip()}
+    return frequencies or None
+
+
+AGGREGATOR_UNSUPPORTED_ARGS = ('since_cursor', 'limit', 'offset', 'page', 'fields', 'order')
+
+
+def aggregated_cache(newer_than: Optional[int], confidence: Optional[float], rssi: Optional[float],
+                     frequencies: Optional[set[int]]) -> Response:
+    unsupported = [arg for arg in AGGREGATOR_UNSUPPORTED_ARGS if request.args.get(arg)]
+    if unsupported:
+        return Response(Error(f'Not supported by the aggregator: {", ".join(unsupported)}').to_json(), status=400)
+    # Stations going down or coming back change the response as well as their records
+    status = aggregator.status_key()
+    if etag_matches(cache_etag(aggregator.generation, status, encoders.JSON_MIMETYPE)):
+        return Response(status=304)
+    generation, stations, data = aggregator.snapshot(newer_than=newer_than, confidence=confidence, rssi=rssi,
+                                                     frequencies=frequencies)
+    response = jsonify({'cursor': generation, 'stations': stations, 'data': data})
+    response.set_etag(cache_etag(generation, status, encoders.JSON_MIMETYPE), weak=True)
+    return response
+
+
+CACHE_ROWS_PER_CHUNK = 1000
+
+
+def cache_chunks(payload: dict, query: dict, offset: int, limit: Optional[int]) -> Iterator[bytes]:
+    """
+    Streams a /cache JSON payload, reading its rows from the cache a chunk at a time, so that only one chunk is in
+    memory however large the window is
+    """
+    yield (json.dumps(payload, separators=(',', ':'))[:-1] + ',"data":[').encode()
+    cursor_key = 'since_cursor' if query['ascending'] else 'before_cursor'
+    separator = ''
+    while True:
+        chunk_limit = CACHE_ROWS_PER_CHUNK if limit is None else min(limit, CACHE_ROWS_PER_CHUNK)
+        rows, last = app_data.cache.page(**query, offset=offset, limit=chunk_limit)
+        offset = 0
+        if rows:
+            yield (separator + json.dumps(rows, separators=(',', ':'))[1:-1]).encode()
+            separator = ','
+        if limit is not None:
+            limit -= len(rows)
+        if last is None or limit == 0:
+            break
+        query[cursor_key] = last
+    yield (']' + (f',"next":{json.dumps(last)}' if 'next' in payload else '') + '}').encode()
+
+
+def debug_authorized() -> bool:
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {DEBUG_TOKEN}')
+
+
+def traced(response: Response, timer: Optional[PhaseTimer]) -> Response:
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+
+@app.get('/cache')
+def cache():
+    """
+    Records newest first (order=asc for oldest first), optionally projected to some fields and paginated with
+    limit/offset or with the next token of the previous page passed as page
+    """
+    app.logger.debug(f'Responding with cache (args={request.args}). Current size: {len(app_data.cache)}')
+    try:
+        confidence = float(request.args['confidence']) if request.args.get('confidence') else None
+        rssi = float(request.args['rssi']) if request.args.get('rssi') else None
+        newer_than = int(request.args['newer_than']) if request.args.get('newer_than') else None
+        since_cursor = int(request.args['since_cursor']) if request.args.get('since_cursor') else None
+        frequencies = frequencies_filter()
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        offset = int(request.args.get('offset') or 0)
+        page = int(request.args['page']) if request.args.get('page') else None
+    except ValueError:
+        return Response(Error('Invalid filter value').to_json(), status=400)
+    order = request.args.get('order') or 'desc'
+    fields = tuple(request.args['fields'].split(',')) if request.args.get('fields') else None
+    if (limit is not None and limit <= 0) or offset < 0 or order not in ('asc', 'desc') \
+            or (fields is not None and not set(fields) <= FIELD_COLUMNS.keys()):
+        return Response(Error('Invalid pagination or fields').to_json(), status=400)
+    if aggregator is not None:
+        return aggregated_cache(newer_than, confidence, rssi, frequencies)
+
+    # Timings of the phases of the request, returned in a Server-Timing header when asked for with X-Debug-Trace
+    timer = PhaseTimer() if request.headers.get('X-Debug-Trace') and debug_authorized() else None
+    mimetype = request.accept_mimetypes.best_match(encoders.supported_mimetypes(), default=encoders.JSON_MIMETYPE)
+    with phase(timer, 'config'):
+        metadata = station_metadata(app_data.cache.latest())
+    generation = app_data.cache.generation
+    newer_than = in_window(newer_than)
+    oldest = app_data.cache.oldest_timestamp(newer_than)
+    # Records leaving the window between expiries change the response as well
+    etag = cache_etag(generation, [metadata, oldest], mimetype)
+    if etag_matches(etag):
+        return traced(Response(status=304), timer)
+
+    if since_cursor is not None and since_cursor > generation:
+        # A cursor from the future can not be trusted, send everything
+        since_cursor = None
+    # Records added after the generation of the response are left out, so that cursor and rows agree
+    query = {'newer_than': newer_than, 'confidence': confidence, 'rssi': rssi, 'since_cursor': since_cursor,
+             'frequencies': frequencies, 'before_cursor': generation + 1, 'ascending': order == 'asc',
+             'fields': fields}
+    if page is not None:
+        if order == 'asc':
+            query['since_cursor'] = max(page, since_cursor or page)
+        else:
+            query['before_cursor'] = min(page, generation + 1)
+
+    payload = {
+        **metadata,
+        'cursor': generation,
+        'expired_before': oldest if oldest is not None else now(),
+    }
+    if fields is not None:
+        payload['fields'] = list(fields)
+    if limit is not None:
+        payload['next'] = None
+
+    if mimetype == encoders.JSON_MIMETYPE and min(limit or len(app_data.cache), len(app_data.cache)) > \
+            CACHE_STREAM_MIN_ROWS:
+        # The rows are read, serialized and compressed while the response is sent, after the headers
+        response = streamed_json(cache_chunks(payload, query, offset, limit))
+        response.set_etag(etag, weak=True)
+        response.vary.add('Accept')
+        return traced(response, timer)
+
+    def render() -> tuple[bytes, Optional[str], int, str]:
+        with phase(timer, 'query'):
+            if mimetype == encoders.COLUMNAR_MIMETYPE:
+                # Packed straight from the cache columns, without building rows first
+                data, last = app_data.cache.page_columns(**query, offset=offset, limit=limit)
+                rows = len(next(iter(data.values())))
+            else:
+                data, last = app_data.cache.page(**query, offset=offset, limit=limit)
+                rows = len(data)
+        app.logger.debug(f'Filtered cache size: {rows}')
+        body_payload = {**payload, 'data': data}
+        if limit is not None:
+            body_payload['next'] = last
+        with phase(timer, 'serialize'):
+            if mimetype == encoders.JSON_MIMETYPE:
+                body = jsonify(body_payload).get_data()
+            else:
+                body = encoders.encode(body_payload, mimetype)
+        return precompress(body, mimetype, encoding, timer) + (etag,)
+
+    encoding = compress_algorithm()
+    # The ETag covers the query, the metadata and the mimetype. Only a response cache miss has the render phases.
+    with phase(timer, 'response_cache'):
+        body, body_encoding, g.uncompressed_size, body_etag = response_cache.get(generation, (etag, encoding), render)
+    response = Response(body, mimetype=mimetype)
+    if body_encoding:
+        # Flask-Compress leaves responses that are already encoded alone, the ETag gets the same suffix it would add
+        response.headers['Content-Encoding'] = body_encoding
+        response.set_etag(f'{body_etag}:{body_encoding}', weak=True)
+    else:
+        response.set_etag(body_etag, weak=True)
+    response.vary.add('Accept')
+    return traced(response, timer)
+
+
+@app.get('/cache/frequencies')
+def cache_frequencies():
+    if aggregator is not None:
+        return not_aggregated()
+    summary = app_data.cache.frequency_summary()
+    return jsonify([{'frequency_hz': frequency_hz, **entry} for frequency_hz, entry in sorted(summary.items())])
+
+
+@app.get('/cache/summary')
+def cache_summary():
+    if aggregator is not None:
+        return not_aggregated()
+    try:
+        confidence = float(request.args['confidence']) if request.args.get('confidence') else None
+        rssi = float(request.args['rssi']) if request.args.get('rssi') else None
+        newer_than = int(request.args['newer_than']) if request.args.get('newer_than') else None
+        bin_width = float(request.args.get('bin') or 5)
+        bucket_ms = int(request.args['bucket_ms']) if request.args.get('bucket_ms') else None
+        max_points = int(request.args['max_points']) if request.args.get('max_points') else None
+        frequencies = frequencies_filter()
+    except ValueError:
+        return Response(Error('Invalid filter value').to_json(), status=400)
+    weighting = request.args.get('weighting') or 'count'
+    if weighting not in WEIGHTINGS:
+        return Response(Error(f'Weighting must be one of {", ".join(WEIGHTINGS)}').to_json(), status=400)
+    if not 0 < bin_width <= 360 or (bucket_ms is not None and bucket_ms <= 0) \
+            or (max_points is not None and max_points <= 0):
+        return Response(Error('Invalid summary parameters').to_json(), status=400)
+
+    metadata = station_metadata(app_data.cache.latest())
+    newer_than = in_window(newer_than)
+    tag_metadata = [metadata, app_data.cache.oldest_timestamp(newer_than)]
+    if etag_matches(cache_etag(app_data.cache.generation, tag_metadata, encoders.JSON_MIMETYPE)):
+        return Response(status=304)
+
+    generation, columns = app_data.cache.columns(newer_than=newer_than, frequencies=frequencies)
+    response = jsonify({
+        **metadata,
+        'cursor': generation,
+        'bin': bin_width,
+        'weighting': weighting,
+        **summarize(columns, bin_width, weighting, confidence=confidence, rssi=rssi, bucket_ms=bucket_ms,
+                    max_points=max_points)
     })
+    response.set_etag(cache_etag(generation, tag_metadata, encoders.JSON_MIMETYPE), weak=True)
+    return response
+
+
+def sse_event(event: str, data) -> str:
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+@app.get('/cache/stream')
+def cache_stream():
+    if aggregator is not None:
+        return not_aggregated()
+    try:
+        confidence = float(request.args['confidence']) if request.args.get('confidence') else None
+        rssi = float(request.args['rssi']) if request.args.get('rssi') else None
+        newer_than = int(request.args['newer_than']) if request.args.get('newer_than') else None
+        frequencies = frequencies_filter()
+    except ValueError:
+        return Response(Error('Invalid filter value').to_json(), status=400)
+
+    subscription = app_data.broadcaster.subscribe()
+    if subscription is None:
+        return Response(Error('Too many stream subscribers').to_json(), status=503)
+    app.logger.debug(f'Stream subscriber connected (args={request.args}), {len(app_data.broadcaster)} in total')
+
+    def generate():
+        try:
+            metadata = station_metadata(app_data.cache.latest())
+            yield sse_event('metadata', metadata)
+            if newer_than is not None:
+                # Records added since subscribing are both in the replay and queued, the queued ones are skipped
+                generation, _, rows = app_data.cache.snapshot(newer_than=in_window(newer_than),
+                                                              confidence=confidence, rssi=rssi,
+                                                              frequencies=frequencies)
+                subscription.skip_through = generation
+                yield sse_event('records', rows)
+            dropped = 0
+            while True:
+                records = subscription.get(timeout=STREAM_KEEPALIVE_MS / 1000.0)
+                if records is None:
+                    yield sse_event('disconnect', {'message': 'Consumer is too slow'})
+                    return
+                if subscription.dropped != dropped:
+                    yield sse_event('dropped', {'batches': subscription.dropped - dropped})
+                    dropped = subscription.dropped
+                if not records:
+                    yield ': keepalive\n\n'
+                    continue
+
+                current_metadata = station_metadata(records[-1])
+                if current_metadata != metadata:
+                    metadata = current_metadata
+                    yield sse_event('metadata', metadata)
+                data = [[record.timestamp, record.doa, record.confidence, record.rssi, record.frequency_hz]
+                        for record in reversed(records)
+                        if (confidence is None or record.confidence >= confidence)
+                        and (rssi is None or record.rssi >= rssi)
+                        and (frequencies is None or record.frequency_hz in frequencies)]
+                if data:
+                    yield sse_event('records', data)
+        finally:
+            app_data.broadcaster.unsubscribe(subscription)
+            app.logger.debug('Stream subscriber disconnected')
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+HISTORY_ROWS_PER_CHUNK = 1000
+
+
+def history_chunks(start: int, end: int, step: Optional[int], records) -> Iterator[bytes]:
+    yield f'{{"from":{start},"to":{end},"step":{json.dumps(step)},"data":['.encode()
+    rows = []
+    separator = ''
+    for record in records:
+        rows.append([record.timestamp, record.doa, record.confidence, record.rssi, record.frequency_hz])
+        if len(rows) == HISTORY_ROWS_PER_CHUNK:
+            yield (separator + json.dumps(rows, separators=(',', ':'))[1:-1]).encode()
+            rows = []
+            separator = ','
+    if rows:
+        yield (separator + json.dumps(rows, separators=(',', ':'))[1:-1]).encode()
+    yield b']}'
+
+
+@app.get('/history')
+def history():
+    if not HISTORY_ENABLED:
+        return Response(Error('History is disabled').to_json(), status=404)
+    try:
+        end = int(request.args['to']) if request.args.get('to') else now()
+        start = int(request.args['from']) if request.args.get('from') else end - HISTORY_DEFAULT_RANGE_MS
+        frequency = int(request.args['frequency']) if request.args.get('frequency') else None
+        step = int(request.args['step']) if request.args.get('step') else None
+    except ValueError:
+        return Response(Error('Invalid filter value').to_json(), status=400)
+    if start > end or (step is not None and step <= 0):
+        return Response(Error('Invalid time range').to_json(), status=400)
+
+    records = history_store.query(start, end, frequency)
+    if step:
+        records = downsample(records, step)
+    return streamed_json(history_chunks(start, end, step, records))
 
 
 @app.post('/suspend')
 def suspend():
+    """Queues a power transition and returns its job. With "wait": true, returns the healthcheck once it is over."""
     if is_in_docker():
         return Response(Error('Cant suspend in Docker').to_json(), status=400)
     try:
         payload = request.json
-        turn_power_on = payload.get('power_on')
-        if turn_power_on:
-            kraken_sdr_power_on()
-        else:
-            kraken_sdr_power_off()
-        return healthcheck()
+        job = power_jobs.submit(bool(payload.get('power_on')))
     except:
         app.logger.error(traceback.format_exc())
         return Response(None, status=400)
 
+    if payload.get('wait'):
+        # Waits as long as the transition takes, holding a thread of the stream budget
+        if not app_data.broadcaster.reserve():
+            return Response(Error('Too many stream subscribers').to_json(), status=503)
+        try:
+            job_json = job.to_json()
+            while job_json['state'] not in (SUCCEEDED, FAILED):
+                job_json = power_jobs.wait(job.id, job_json, STREAM_KEEPALIVE_MS / 1000.0)
+        finally:
+            app_data.broadcaster.release()
+        if job_json['state'] == FAILED:
+            return Response(Error(job_json['error']).to_json(), status=400)
+        return healthcheck()
+
+    response = jsonify(job.to_json())
+    response.status_code = 202
+    response.headers['Location'] = f'/suspend/jobs/{job.id}'
+    return response
+
+
+@app.get('/suspend/jobs')
+def suspend_jobs():
+    return jsonify(power_jobs.jobs())
+
+
+@app.get('/suspend/jobs/<job_id>')
+def suspend_job(job_id: str):
+    job = power_jobs.get(job_id)
+    if job is None:
+        return Response(Error('Unknown job').to_json(), status=404)
+    return jsonify(job)
+
+
+@app.get('/suspend/jobs/<job_id>/stream')
+def suspend_job_stream(job_id: str):
+    """Streams the job as server-sent "job" events, one per change, until it is over"""
+    job = power_jobs.get(job_id)
+    if job is None:
+        return Response(Error('Unknown job').to_json(), status=404)
+    if not app_data.broadcaster.reserve():
+        return Response(Error('Too many stream subscribers').to_json(), status=503)
+
+    def generate():
+        current = job
+        yield sse_event('job', current)
+        while current['state'] not in (SUCCEEDED, FAILED):
+            latest = power_jobs.wait(job_id, current, STREAM_KEEPALIVE_MS / 1000.0)
+            if latest is None:
+                return
+            if latest == current:
+                yield ': keepalive\n\n'
+                continue
+            current = latest
+            yield sse_event('job', current)
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also released when the client goes away before the stream started
+    response.call_on_close(app_data.broadcaster.release)
+    return response
+
 
 @app.post('/reboot')
 def reboot():
@@ -242,24 +784,224 @@ def reboot():
     return Response(status=200)
 
 
+profile_lock = threading.Lock()
+
+
+@app.get('/debug/profile')
+def debug_profile():
+    """
+    Samples the stacks of all the threads of this process for seconds (default 10) at hz samples per second, and
+    returns them collapsed, one 'thread;frame;...;frame count' line per stack, for flamegraph.pl or speedscope.
+    With several server workers, the main process, which ingests DOA, is profiled unless process=worker.
+    """
+    if not DEBUG_TOKEN:
+        return Response(status=404)
+    if not debug_authorized():
+        return Response(Error('Unauthorized').to_json(), status=401)
+    if admin_socket is not None and request.args.get('process') != 'worker':
+        try:
+            upstream = ask_main_process(request.full_path, DEBUG_PROFILE_MAX_S + 10)
+            response = Response(upstream.read(), status=upstream.status,
+                                content_type=upstream.getheader('Content-Type'))
+        except OSError as e:
+            return Response(Error(f'Cannot reach the main process: {e}').to_json(), status=502)
+        if upstream.getheader('X-Profile-Samples'):
+            response.headers['X-Profile-Samples'] = upstream.getheader('X-Profile-Samples')
+        return response
+    try:
+        seconds = float(request.args.get('seconds') or 10)
+        hz = int(request.args.get('hz') or DEBUG_PROFILE_HZ)
+    except ValueError:
+        return Response(Error('Invalid seconds or hz').to_json(), status=400)
+    if not 0 < seconds <= DEBUG_PROFILE_MAX_S or not 0 < hz <= 1000:
+        return Response(Error(f'seconds must be up to {DEBUG_PROFILE_MAX_S} and hz up to 1000').to_json(), status=400)
+    if not profile_lock.acquire(blocking=False):
+        return Response(Error('A profile is already running').to_json(), status=409)
+    try:
+        app.logger.info(f'Profiling for {seconds:g} s at {hz} Hz')
+        stacks, samples = sample_stacks(seconds, 1.0 / hz)
+    finally:
+        profile_lock.release()
+    response = Response(collapsed(stacks), mimetype='text/plain')
+    response.headers['X-Profile-Samples'] = str(samples)
+    return response
+
+
+def start_file_watcher() -> Optional[FileWatcher]:
+    if not inotify_available():
+        app.logger.warning('inotify is not available, falling back to polling')
+        return None
+
+    watch_doa = DOA_INGESTION_MODE != 'poll'
+    try:
+        watcher = FileWatcher(DOA_WATCH_TIMEOUT_MS / 1000.0,
+                              on_timeout=(lambda: app_data.update_cache(app.logger)) if watch_doa else None,
+                              logger=app.logger)
+        watcher.watch(KRAKEN_SETTINGS_FILE, kraken_settings.invalidate)
+        watcher.watch(SETTINGS_FILE, geo_settings.invalidate)
+        if watch_doa:
+            watcher.watch(DOA_FILE, lambda: app_data.update_cache(app.logger))
+    except OSError as e:
+        app.logger.warning(f'Cannot watch files with inotify ({e}), falling back to polling')
+        return None
+
+    for settings in (kraken_settings, geo_settings):
+        settings.invalidate()
+        settings.watched()
+    watcher.run_in_thread()
+    app.logger.info(f'Watching {KRAKEN_SETTINGS_FILE} with inotify')
+    if watch_doa:
+        app_data.update_cache(app.logger)
+        app.logger.info(f'Watching {DOA_FILE} with inotify')
+    return watcher
+
+
+def start_doa_ingestion():
+    watcher = start_file_watcher()
+    if watcher and DOA_INGESTION_MODE != 'poll':
+        return
+    if DOA_INGESTION_MODE == 'inotify':
+        raise Exception('DOA_INGESTION_MODE is inotify, but the DOA file cannot be watched with inotify')
+
+    if DOA_POLL_SCHEDULE == 'adaptive':
+        scheduler = IngestionScheduler(lambda: app_data.update_cache(app.logger), lambda: app_data.doa_reader.mtime_ns,
+                                       health_sampler.snapshot if not is_in_docker() else dict,
+                                       DOA_READ_REGULARITY_MS, DOA_POLL_MIN_MS, DOA_POLL_MAX_MS, DOA_POLL_STALE_FACTOR,
+                                       DOA_POLL_THERMAL_C, DOA_POLL_THERMAL_FACTOR, app.logger)
+        metrics.ingestion_registry.register(metrics.Gauge('geo_proxy_ingest_poll_delay_seconds',
+                                                'Current delay between DOA file polls',
+                                                callback=lambda: scheduler.delay_ms / 1000.0))
+        metrics.ingestion_registry.register(metrics.Gauge('geo_proxy_doa_write_interval_seconds',
+                                                'Learnt interval between Kraken writes of the DOA file',
+                                                callback=lambda: (scheduler.interval_ms or 0) / 1000.0))
+        scheduler.on_missed = metrics.scheduler_missed_runs.inc
+        scheduler.run_in_thread()
+        app.logger.info(f'Polling {DOA_FILE} adaptively, every {DOA_POLL_MIN_MS} to {DOA_POLL_MAX_MS} ms')
+        return
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(func=app_data.update_cache, args=[app.logger], trigger='interval',
+                      seconds=DOA_READ_REGULARITY_MS / 1000.0)
+    scheduler.add_listener(lambda event: metrics.scheduler_missed_runs.inc(), EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+    scheduler.start()
+    app.logger.info(f'Polling {DOA_FILE} every {DOA_READ_REGULARITY_MS} ms')
+
+
+def log_kraken_setting_change(key: str, old, new):
+    app.logger.info(f'Kraken setting {key} changed: {old} -> {new}')
+
+
+background_tasks_started = False
+
+
 def create_app():
+    """Starts DOA ingestion and the other background tasks. Safe to call more than once, they are started only once."""
+    global background_tasks_started
+    if background_tasks_started:
+        return app
+    background_tasks_started = True
+
+    if aggregator is not None:
+        aggregator.logger = app.logger
+        aggregator.run_in_thread()
+        app.logger.info(f'Aggregating {len(aggregator.upstreams)} stations: '
+                        f'{", ".join(upstream.name for upstream in aggregator.upstreams)}')
+        return app
+
     app.logger.info(f'Kraken settings file: {KRAKEN_SETTINGS_FILE}, exists: {kraken_settings_file_exists()}')
     app.logger.info(f'Kraken DOA file: {DOA_FILE}, exists: {kraken_doa_file_exists()}')
 
     now_ = datetime.now()
     if not os.path.exists(BACKUP_DIR_NAME):
         os.makedirs(BACKUP_DIR_NAME)
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=app_data.update_cache, args=[app.logger], trigger='interval',
-                      seconds=DOA_READ_REGULARITY_MS / 1000.0)
-    scheduler.start()
+    kraken_settings.logger = app.logger
+    writer_for(KRAKEN_SETTINGS_FILE).logger = app.logger
+    health_sampler.logger = app.logger
+    if not is_in_docker():
+        health_sampler.run_in_thread()
+    for key in ('center_freq', 'station_id', 'latitude', 'longitude', 'ant_arrangement'):
+        kraken_settings.subscribe(key, log_kraken_setting_change)
+    if HISTORY_ENABLED:
+        history_store.logger = app.logger
+        history_store.run_in_thread()
+        app.logger.info(f'Recording DOA history in {history_store.path}')
+    if capture_writer is not None:
+        capture_writer.logger = app.logger
+        capture_writer.run_in_thread()
+        atexit.register(capture_writer.close)
+    start_doa_ingestion()
     app.logger.info(f'Cache updater started {now_.isoformat()}, running')
     destination = os.path.join(BACKUP_DIR_NAME, f'{now_.strftime("%Y%m%d-%H%M%S")}-{KRAKEN_SETTINGS_FILENAME}.bak')
     shutil.copyfile(KRAKEN_SETTINGS_FILE, destination)
+    ws_client.run_in_thread(lambda lines: app_data.ingest_pushed(lines, app.logger), app.logger)
     return app
 
 
+def run_worker(sock: socket.socket):
+    """Entry point of a server worker process. Serves the cache the main process writes to shared memory."""
+    global admin_socket
+    admin_socket = SERVER_ADMIN_SOCKET
+    # Each worker has its own request metrics, the label keeps their series apart
+    metrics.registry.labels['worker'] = str(os.getpid())
+    app_data.cache = SharedDoaCache.open(SHARED_CACHE_FILE)
+    app_data.follow_cache_in_thread(SHARED_CACHE_FOLLOW_MS, app.logger)
+    if not is_in_docker():
+        health_sampler.run_in_thread()
+    waitress_serve(app, sockets=[sock], threads=SERVER_THREADS, connection_limit=SERVER_CONNECTION_LIMIT,
+                   channel_timeout=SERVER_CHANNEL_TIMEOUT_S, ident='geo-proxy')
+
+
+def serve_with_workers():
+    app_data.cache = SharedDoaCache.create(SHARED_CACHE_FILE, DOA_CACHE_CAPACITY)
+    sock = socket.create_server((SERVER_HOST, SERVER_PORT), backlog=SERVER_BACKLOG)
+    context = multiprocessing.get_context('spawn')
+
+    def start_worker() -> multiprocessing.Process:
+        worker = context.Process(target=run_worker, args=(sock,), name='geo-proxy-worker', daemon=True)
+        worker.start()
+        return worker
+
+    # Workers are started before any thread of this process, and spawned rather than forked
+    workers = [start_worker() for _ in range(SERVER_WORKERS)]
+    app.logger.info(f'Serving on {SERVER_HOST}:{SERVER_PORT} with {SERVER_WORKERS} workers, {SERVER_THREADS} '
+                    f'threads each, sharing {SHARED_CACHE_FILE}')
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    create_app()
+    if os.path.exists(SERVER_ADMIN_SOCKET):
+        os.unlink(SERVER_ADMIN_SOCKET)
+    threading.Thread(target=waitress_serve, args=(app,), name='admin-server', daemon=True,
+                     kwargs={'unix_socket': SERVER_ADMIN_SOCKET, 'unix_socket_perms': '600', 'threads': 2,
+                             'ident': 'geo-proxy'}).start()
+    while True:
+        time.sleep(1)
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                app.logger.warning(f'Worker {worker.pid} exited with code {worker.exitcode}, restarting')
+                workers[i] = start_worker()
+
+
+def serve():
+    if SERVER_THREADS < STREAM_MAX_SUBSCRIBERS + SERVER_SPARE_THREADS:
+        raise Exception(f'SERVER_THREADS ({SERVER_THREADS}) must be at least STREAM_MAX_SUBSCRIBERS '
+                        f'({STREAM_MAX_SUBSCRIBERS}) plus SERVER_SPARE_THREADS ({SERVER_SPARE_THREADS}), stream '
+                        f'clients would otherwise take all the threads and block health checks')
+    # Jobs that were running when the station stopped are over, whatever the jobs file says
+    power_jobs.recover()
+    # The aggregator keeps its stations in process memory, so it is served by a single process
+    if SERVER_MODE != 'development' and SERVER_WORKERS > 1 and aggregator is None:
+        serve_with_workers()
+        return
+
+    create_app()
+    if SERVER_MODE == 'development':
+        app.run(host=SERVER_HOST, port=SERVER_PORT, threaded=True, use_reloader=False)
+        return
+
+    app.logger.info(f'Serving on {SERVER_HOST}:{SERVER_PORT} with {SERVER_THREADS} threads')
+    waitress_serve(app, host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS,
+                   connection_limit=SERVER_CONNECTION_LIMIT, backlog=SERVER_BACKLOG,
+                   channel_timeout=SERVER_CHANNEL_TIMEOUT_S, ident='geo-proxy')
+
+
 if __name__ == '__main__':
-    app = create_app()
-    ws_client.run_in_thread()
-    app.run(host='0.0.0.0', port=8082)
+    serve()
@@ -0,0 +1,202 @@
+import gzip
+import heapq
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from typing import Optional
+from urllib.parse import urlsplit, urlencode
+
+from src import metrics
+from src.config import AGGREGATOR_UPSTREAMS, AGGREGATOR_POLL_MS, AGGREGATOR_TIMEOUT_MS, AGGREGATOR_MAX_BACKOFF_MS, \
+    AGGREGATOR_WORKERS, DOA_CACHE_CAPACITY, DOA_TIME_THRESHOLD_MS
+from src.dataclasses import DoaBatch
+from src.doa_cache import DoaCache
+from src.utils import now
+
+TICK_MS = 50
+
+
+def parse_upstreams(value: str) -> list[tuple[str, str]]:
+    """Parses a comma separated list of [name=]url into (name, url) pairs. Unnamed stations are named by their URL."""
+    upstreams = []
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        name, _, url = item.partition('=') if '=' in item.split('://')[0] else ('', '', item)
+        upstreams.append((name or url, url.rstrip('/')))
+    return upstreams
+
+
+class Upstream:
+    """
+    An upstream geo-proxy polled through a single keep-alive connection. Keeps its records in its own DoaCache and
+    asks only for the records added since the previous poll (since_cursor, or newer_than for upstreams that do not
+    return a cursor).
+    """
+
+    def __init__(self, name: str, url: str, timeout_s: float, capacity: int):
+        self.name = name
+        self.url = url
+        self.timeout_s = timeout_s
+        split = urlsplit(url)
+        self._connection_class = HTTPSConnection if split.scheme == 'https' else HTTPConnection
+        self._host = split.netloc
+        self._path = split.path + '/cache'
+        self._connection: Optional[HTTPConnection] = None
+        self.cache = DoaCache(capacity)
+        self.metadata: dict = {}
+        self.cursor: Optional[int] = None
+        self.newest: Optional[int] = None
+        self.fetched_at = 0
+        self.failures = 0
+        self.error: Optional[str] = None
+        self.next_poll_at = 0.0
+        self.polling = False
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _get(self, query: dict) -> dict:
+        if self._connection is None:
+            self._connection = self._connection_class(self._host, timeout=self.timeout_s)
+        path = f'{self._path}?{urlencode(query)}' if query else self._path
+        self._connection.request('GET', path, headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip'})
+        response = self._connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise HTTPException(f'HTTP {response.status}')
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+    def poll(self, time_threshold: int) -> int:
+        """Fetches the new records. Returns the number of records added."""
+        if self.cursor is not None:
+            query = {'since_cursor': self.cursor}
+        else:
+            query = {'newer_than': max(self.newest + 1, time_threshold) if self.newest else time_threshold}
+        payload = self._get(query)
+        rows = payload.pop('data')
+        self.cursor = payload.pop('cursor', None)
+        payload.pop('expired_before', None)
+        self.metadata = payload
+        self.fetched_at = now()
+
+        # Rows come newest first
+        rows = [row for row in reversed(rows) if row[0] > time_threshold]
+        rows.sort(key=lambda row: row[0])
+        batch = DoaBatch(timestamps=[row[0] for row in rows],
+                         doas=[row[1] for row in rows],
+                         confidences=[row[2] for row in rows],
+                         rssis=[row[3] for row in rows],
+                         frequencies=[row[4] for row in rows],
+                         arrangements=[payload.get('arr')] * len(rows))
+        if rows:
+            self.newest = max(self.newest or 0, rows[-1][0])
+        return len(self.cache.extend(batch)[0])
+
+    def status(self) -> dict:
+        return {
+            **self.metadata,
+            'id': self.name,
+            'ok': self.error is None and self.fetched_at > 0,
+            'error': self.error,
+            'updated_ms_ago': now() - self.fetched_at if self.fetched_at else None
+        }
+
+
+class Aggregator:
+    """
+    Polls upstream geo-proxy stations concurrently and serves their records as one station-tagged cache.
+    Every station is polled on its own schedule by a shared thread pool, so a slow or unreachable station delays
+    neither the others nor the responses, which are served from the local copies. Failing stations are retried with
+    an exponential, jittered backoff.
+    """
+
+    def __init__(self, upstreams: list[tuple[str, str]], poll_ms: int, timeout_ms: int, max_backoff_ms: int,
+                 workers: int, capacity: int, logger=None):
+        self.upstreams = [Upstream(name, url, timeout_ms / 1000.0, capacity) for name, url in upstreams]
+        self.poll_ms = poll_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.logger = logger
+        self.generation = time.time_ns() // 1000
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=min(workers, max(len(self.upstreams), 1)),
+                                            thread_name_prefix='aggregator')
+
+    def _changed(self):
+        with self._lock:
+            self.generation += 1
+
+    def _poll(self, upstream: Upstream):
+        started_at = time.perf_counter()
+        try:
+            if upstream.poll(now() - DOA_TIME_THRESHOLD_MS):
+                self._changed()
+            if upstream.failures and self.logger:
+                self.logger.info(f'Station {upstream.name} is reachable again')
+            upstream.failures = 0
+            upstream.error = None
+            upstream.next_poll_at = time.monotonic() + self.poll_ms / 1000.0
+            metrics.aggregator_fetch_seconds.observe(time.perf_counter() - started_at, upstream.name, 'ok')
+        except (OSError, HTTPException, ValueError, KeyError, TypeError, IndexError) as e:
+            upstream.close()
+            upstream.failures += 1
+            upstream.error = str(e) or type(e).__name__
+            backoff_ms = min(self.max_backoff_ms, self.poll_ms * 2 ** upstream.failures)
+            upstream.next_poll_at = time.monotonic() + random.uniform(0.5, 1.0) * backoff_ms / 1000.0
+            metrics.aggregator_fetch_seconds.observe(time.perf_counter() - started_at, upstream.name, 'error')
+            if upstream.failures == 1 and self.logger:
+                self.logger.warning(f'Cannot fetch station {upstream.name}: {upstream.error}')
+        finally:
+            upstream.polling = False
+
+    def tick(self):
+        time_threshold = now() - DOA_TIME_THRESHOLD_MS
+        monotonic = time.monotonic()
+        for upstream in self.upstreams:
+            if upstream.cache.expire(time_threshold):
+                self._changed()
+            if not upstream.polling and upstream.next_poll_at <= monotonic:
+                upstream.polling = True
+                self._executor.submit(self._poll, upstream)
+
+    def run(self):
+        while True:
+            self.tick()
+            time.sleep(TICK_MS / 1000.0)
+
+    def run_in_thread(self):
+        threading.Thread(target=self.run, name='aggregator', daemon=True).start()
+
+    def status_key(self) -> list:
+        """What the responses say of the stations, but their ages, for ETags"""
+        return [[upstream.name, upstream.fetched_at > 0, upstream.error, upstream.metadata]
+                for upstream in self.upstreams]
+
+    def snapshot(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+                 rssi: Optional[float] = None,
+                 frequencies: Optional[set[int]] = None) -> tuple[int, list[dict], list[list]]:
+        """
+        Returns the generation, the status and metadata of every station and the matching
+        [timestamp, doa, confidence, rssi, frequency_hz, station id] rows of all stations, newest first
+        """
+        generation = self.generation
+        stations = []
+        rows = []
+        for upstream in self.upstreams:
+            station_rows = upstream.cache.query(newer_than=newer_than, confidence=confidence, rssi=rssi,
+                                                frequencies=frequencies)
+            for row in station_rows:
+                row.append(upstream.name)
+            rows.append(station_rows)
+            stations.append(upstream.status())
+        return generation, stations, list(heapq.merge(*rows, key=lambda row: row[0], reverse=True))
+
+
+aggregator = Aggregator(parse_upstreams(AGGREGATOR_UPSTREAMS), AGGREGATOR_POLL_MS, AGGREGATOR_TIMEOUT_MS,
+                        AGGREGATOR_MAX_BACKOFF_MS, AGGREGATOR_WORKERS, DOA_CACHE_CAPACITY) \
+    if AGGREGATOR_UPSTREAMS else None
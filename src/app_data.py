@@ -1,93 +1,127 @@
+import logging
+import threading
+import time
 import traceback
+from typing import Optional
 
-from packaging.version import parse as parse_version
-
-from src.config import SETTINGS_FILE, TIME, DOA_TIME_THRESHOLD_MS, DOA_FILE, ARRAY_ARRANGEMENT, DOA_ANGLE, FREQUENCY_HZ, \
-    CONFIDENCE, RSSI
-from src.dataclasses import CacheRecord
-from src.utils import get_kraken_version, get_config_value, now, kraken_doa_file_exists, doa_last_updated_at_ms, \
-    normalize_angle
+from src import metrics
+from src.config import SETTINGS_FILE, DOA_TIME_THRESHOLD_MS, DOA_FILE, DOA_CACHE_CAPACITY, STREAM_MAX_SUBSCRIBERS, \
+    STREAM_QUEUE_SIZE, STREAM_SLOW_CONSUMER, HISTORY_ENABLED, DOA_PUSH_STALE_MS
+from src.broadcaster import Broadcaster
+from src.capture import capture_writer
+from src.doa_cache import DoaCache
+from src.doa_parser import parser_for_version
+from src.doa_reader import DoaFileReader
+from src.history import history_store
+from src.kraken_settings import geo_settings, kraken_settings
+from src.utils import get_kraken_version, set_config_value, now
 
 
 class AppData:
     def __init__(self):
         self.kraken_version = get_kraken_version()
-        self.cache: set[CacheRecord] = set()
-        self.cache_last_updated_at = 0
-        self.array_angle: float = get_config_value(SETTINGS_FILE, 'array_angle')
-
-    def version_specific_time(self, ll: list, logger) -> int:
-        if self.kraken_version is not None and parse_version(self.kraken_version) == parse_version('1.6'):
-            logger.debug(f'Kraken version: {self.kraken_version}. Use _now function.')
-            return now()
-        else:
-            logger.debug(f'Kraken version: {self.kraken_version}. Use TIME.')
-            return int(ll[TIME])
-        
+        # Created on import, before the server has set its loggers up
+        self.parser = parser_for_version(self.kraken_version, logging.getLogger(__name__))
+        self.cache = DoaCache(DOA_CACHE_CAPACITY)
+        self.doa_reader = DoaFileReader(DOA_FILE)
+        self.broadcaster = Broadcaster(STREAM_MAX_SUBSCRIBERS, STREAM_QUEUE_SIZE,
+                                       disconnect_slow=STREAM_SLOW_CONSUMER == 'disconnect')
+        # Last time the push feed delivered DOA records
+        self.pushed_at = 0
+
+    @property
+    def array_angle(self) -> Optional[float]:
+        # Read from the settings file, so that all server processes see changes made through any of them
+        return geo_settings.get('array_angle')
+
+    @array_angle.setter
+    def array_angle(self, value: Optional[float]):
+        set_config_value(SETTINGS_FILE, 'array_angle', value)
+
+    @property
+    def cache_last_updated_at(self) -> int:
+        return self.cache.updated_at
+
+    def push_active(self) -> bool:
+        return now() - self.pushed_at < DOA_PUSH_STALE_MS
+
     def update_cache(self, logger):
-        logger.debug('Updating app cache...')
+        """Expires old records and, unless the push feed delivers them, ingests the new lines of the DOA file"""
+        started_at = time.perf_counter()
         try:
-            logger.debug(f'Current app cache size: {len(self.cache)}')
-            time_threshold = now() - DOA_TIME_THRESHOLD_MS
-            logger.debug(f'now = {now()}, time_threshold = {time_threshold}')
-            self.cache = set([item for item in self.cache if item.timestamp >= time_threshold])
-            logger.debug(f'Reduced by time threshold {time_threshold}, app cache size: {len(self.cache)}')
-    
-            if not kraken_doa_file_exists():
-                logger.debug(f'File {DOA_FILE} does not exist. Skipping...')
+            expired = self.cache.expire(now() - DOA_TIME_THRESHOLD_MS)
+            metrics.doa_records_expired.inc(expired)
+            if self.push_active():
+                # The file is still followed, so that the poll scheduler keeps up with its writes and file ingestion
+                # takes over where the feed stops
+                self.doa_reader.skip()
                 return
-    
-            if self.cache_last_updated_at >= doa_last_updated_at_ms():
-                logger.debug(f'File {DOA_FILE} has not changed. Skipping...')
+
+            lines = self.doa_reader.read_lines()
+            if lines is None:
                 return
-    
-            logger.debug(f'Parsing {DOA_FILE}...')
-            with open(DOA_FILE) as f:
-                read = f.read()
-                logger.debug(f'Data read: {read[0:200]} ...')
-                lines = read.split('\n')
-                logger.debug(f'{len(lines)} lines read')
-    
-            for line in lines:
-                logger.debug(f'Processing a line str={line[0:100]}...')
-                if not line:
-                    logger.debug('Line is too short. Skipping...')
-                    continue
-    
-                ll = line.split(', ')
-                if len(ll) < 9:
-                    logger.debug(f'DOA is of the wrong format: {ll}')
-                    continue
-    
-                ant_arrangement = ll[ARRAY_ARRANGEMENT]
-                logger.debug(f'Antenna array type: {ant_arrangement}')
-                # A hack for DOA heading for UCA array. Because KrakenSDR counts the angle counterclockwise
-                if ant_arrangement == 'UCA':
-                    logger.debug('Set doa_angle=360-DOA_ANGLE')
-                    doa_angle = 360-float(ll[DOA_ANGLE])
-                else:
-                    logger.debug('Set doa_angle=DOA_ANGLE')
-                    doa_angle = float(ll[DOA_ANGLE])
-    
-                if self.array_angle is not None:
-                    logger.debug(f'Applying offset array_angle={self.array_angle} degrees...')
-                    doa_angle = normalize_angle(doa_angle + self.array_angle)
-                frequency_hz = int(ll[FREQUENCY_HZ])
-                data = CacheRecord(timestamp=self.version_specific_time(ll, logger),
-                                   doa=round(doa_angle, 3),
-                                   confidence=round(float(ll[CONFIDENCE]), 2),
-                                   rssi=round(float(ll[RSSI]), 2),
-                                   frequency_hz=frequency_hz,
-                                   ant_arrangement=ll[ARRAY_ARRANGEMENT])
-    
-                if data.timestamp > time_threshold:
-                    logger.debug(f'Adding a line {data} to cache')
-                    self.cache.add(data)
-                    self.cache_last_updated_at = now()
-                else:
-                    logger.debug(f'Line {line[0:30]} is outdated (time_threshold = {time_threshold}, line ts = {data.timestamp}, delta = {time_threshold - data.timestamp}). Skipping...')
+            if self.doa_reader.mtime_ns is not None:
+                metrics.ingest_lag_seconds.observe(max(0.0, (time.time_ns() - self.doa_reader.mtime_ns) / 1e9))
+            self.ingest(lines, logger)
         except:
             logger.error(traceback.format_exc())
+        finally:
+            metrics.update_cache_seconds.observe(time.perf_counter() - started_at)
+
+    def ingest_pushed(self, lines: list[str], logger):
+        # Lines that only look like DOA lines must not switch file ingestion off. Records the file already delivered
+        # count, the feed would otherwise never take over from a file watcher that sees the writes first.
+        if self.ingest(lines, logger):
+            self.pushed_at = now()
+
+    def ingest(self, lines: list[str], logger) -> int:
+        """
+        Parses DOA lines and adds the fresh records to the cache, the stream subscribers and the history.
+        Returns the number of valid records within the cache window, added or already there.
+        """
+        if capture_writer is not None:
+            capture_writer.record(lines, kraken_settings.snapshot(), self.kraken_version)
+        time_threshold = now() - DOA_TIME_THRESHOLD_MS
+        batch, rejected = self.parser.parse(lines, self.array_angle)
+        fresh = batch.newer_than(time_threshold)
+        added, sequences = self.cache.extend(fresh)
+        if len(self.broadcaster):
+            self.broadcaster.publish([fresh.record(i) for i in added], sequences)
+        if HISTORY_ENABLED and added:
+            history_store.append(fresh if len(added) == len(fresh) else fresh.take(added))
+
+        metrics.doa_lines_read.inc(len(lines))
+        metrics.doa_lines_parsed.inc(len(batch))
+        metrics.doa_lines_rejected.inc(rejected)
+        metrics.doa_records_outdated.inc(len(batch) - len(fresh))
+        metrics.doa_records_added.inc(len(added))
+        logger.debug(f'Cache updated: {len(lines)} lines read, {rejected} rejected, '
+                     f'{len(batch) - len(fresh)} outdated, {len(added)} added, size {len(self.cache)}')
+        return len(fresh)
+
+    def follow_cache(self, interval_ms: int, logger):
+        """Publishes records added to a shared cache by another process to the stream subscribers of this one"""
+        cursor = self.cache.generation
+        while True:
+            time.sleep(interval_ms / 1000.0)
+            try:
+                if self.cache.generation == cursor:
+                    continue
+                if not len(self.broadcaster):
+                    cursor = self.cache.generation
+                    continue
+                cursor, records, sequences = self.cache.records_since(cursor)
+                self.broadcaster.publish(records, sequences)
+            except:
+                logger.error(traceback.format_exc())
+
+    def follow_cache_in_thread(self, interval_ms: int, logger):
+        threading.Thread(target=self.follow_cache, args=(interval_ms, logger), name='cache-follower',
+                         daemon=True).start()
 
 
 app_data = AppData()
+metrics.registry.register(metrics.Gauge('geo_proxy_cache_size', 'Records in the DOA cache',
+                                        callback=lambda: len(app_data.cache)))
+metrics.registry.register(metrics.Gauge('geo_proxy_stream_subscribers', 'Connected /cache/stream clients',
+                                        callback=lambda: len(app_data.broadcaster)))
@@ -0,0 +1,98 @@
+import queue
+import threading
+from typing import Optional
+
+from src.dataclasses import CacheRecord
+
+
+class Subscription:
+    def __init__(self, queue_size: int):
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.closed = False
+        # Records up to this sequence were sent some other way (a replay of the cache) and are skipped
+        self.skip_through: Optional[int] = None
+
+    def get(self, timeout: float) -> Optional[list[CacheRecord]]:
+        """Returns the next batch of records, or an empty list if nothing arrived in time.
+        None means the subscription was closed."""
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return [] if not self.closed else None
+        if item is None:
+            return None
+        records, sequences = item
+        if self.skip_through is not None and sequences[0] <= self.skip_through:
+            records = [record for record, sequence in zip(records, sequences) if sequence > self.skip_through]
+        return records
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait(None)
+
+
+class Broadcaster:
+    """
+    Fans out freshly ingested records to stream subscribers. Each subscriber has a bounded queue; when a slow consumer
+    fills it up, new batches are either dropped for that subscriber (counted in Subscription.dropped)
+    or the subscriber is disconnected.
+    Other long waits for a server thread (see reserve) share the max_subscribers budget with the subscribers.
+    """
+
+    def __init__(self, max_subscribers: int, queue_size: int, disconnect_slow: bool):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.disconnect_slow = disconnect_slow
+        self._subscriptions: list[Subscription] = []
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self) -> Optional[Subscription]:
+        with self._lock:
+            if len(self._subscriptions) + self._reserved >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscriptions.append(subscription)
+            return subscription
+
+    def reserve(self) -> bool:
+        """Takes a place in the budget for a long wait that is not a subscription. False if there is none left."""
+        with self._lock:
+            if len(self._subscriptions) + self._reserved >= self.max_subscribers:
+                return False
+            self._reserved += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._reserved -= 1
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, records: list[CacheRecord], sequences: list[int]):
+        """Queues records, oldest first, with the cache sequences they were added at"""
+        if not records or not self._subscriptions:
+            return
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait((records, sequences))
+            except queue.Full:
+                if self.disconnect_slow:
+                    self.unsubscribe(subscription)
+                    subscription.close()
+                else:
+                    subscription.dropped += 1
@@ -0,0 +1,114 @@
+import gzip
+import json
+import threading
+import time
+import traceback
+import zlib
+from typing import Iterator, Mapping, Optional
+
+from src.config import CAPTURE_FILE, CAPTURE_FLUSH_MS, PROXY_VERSION
+from src.utils import now
+
+CAPTURE_VERSION = 1
+DOA = 'doa'
+SETTINGS = 'settings'
+
+
+class CaptureWriter:
+    """
+    Records the ingested DOA lines and the Kraken settings changes, with their arrival times, for replay.
+    A capture is gzip compressed JSON lines: a header object when a capture session starts, then
+    [arrival ms, 'doa', [lines]] and [arrival ms, 'settings', {changed keys}] events. The first settings event of a
+    session has all the keys. Sessions are appended.
+    Recording only queues the events in memory. A background thread compresses and writes them every flush_ms, so
+    ingestion does not wait for gzip or the SD card, and a crash loses at most that.
+    """
+
+    def __init__(self, path: str, flush_ms: int, logger=None):
+        self.path = path
+        self.flush_ms = flush_ms
+        self.logger = logger
+        self._file = None
+        self._started = False
+        self._settings: Optional[Mapping] = None
+        self._pending: list = []
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._thread = None
+
+    def record(self, lines: list[str], settings: Mapping, kraken_version: Optional[str] = None):
+        """Queues ingested lines, preceded by the settings keys that changed since the previous call"""
+        with self._lock:
+            arrived_at = now()
+            if not self._started:
+                self._started = True
+                self._pending.append({'capture': CAPTURE_VERSION, 'proxy_version': PROXY_VERSION,
+                                      'kraken_version': kraken_version, 'started_at': arrived_at})
+            # Settings snapshots are replaced, never modified, when the file changes
+            if settings is not self._settings:
+                previous = self._settings or {}
+                changed = {key: value for key, value in settings.items()
+                           if key not in previous or previous[key] != value}
+                if changed or self._settings is None:
+                    self._pending.append([arrived_at, SETTINGS, changed])
+                self._settings = settings
+            self._pending.append([arrived_at, DOA, lines])
+
+    def flush(self):
+        """Writes the queued events"""
+        with self._io_lock:
+            with self._lock:
+                events, self._pending = self._pending, []
+            if not events:
+                return
+            if self._file is None:
+                self._file = gzip.open(self.path, 'at', compresslevel=6)
+                if self.logger:
+                    self.logger.info(f'Capturing DOA lines to {self.path}')
+            self._file.write(''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events))
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_ms / 1000.0)
+            try:
+                self.flush()
+            except:
+                if self.logger:
+                    self.logger.error(traceback.format_exc())
+
+    def run_in_thread(self):
+        self._thread = threading.Thread(target=self.run, name='capture-writer', daemon=True)
+        self._thread.start()
+
+
+def read_header(path: str) -> dict:
+    """Returns the header of the first session of a capture"""
+    with gzip.open(path, 'rt') as file:
+        return json.loads(file.readline())
+
+
+def read_capture(path: str) -> Iterator[tuple[int, str, object]]:
+    """Yields the (arrival ms, kind, value) events of a capture, ignoring session headers and a torn tail"""
+    with gzip.open(path, 'rt') as file:
+        try:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # The last line of a session that was not closed properly
+                    continue
+                if isinstance(event, list):
+                    yield event[0], event[1], event[2]
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            pass
+
+
+capture_writer = CaptureWriter(CAPTURE_FILE, CAPTURE_FLUSH_MS) if CAPTURE_FILE else None
@@ -1,8 +1,35 @@
 import os
+import tempfile
 
 PROXY_VERSION = '2024.11.26'
 
 LOG_LEVEL = str(os.getenv('LOG_LEVEL', 'INFO'))
+DEBUG = str(os.getenv('DEBUG', 'false')).lower() in ('1', 'true', 'yes')
+# Bearer token of /debug/profile and of X-Debug-Trace timings, both are disabled while it is empty
+DEBUG_TOKEN = str(os.getenv('DEBUG_TOKEN', ''))
+DEBUG_PROFILE_MAX_S = int(os.getenv('DEBUG_PROFILE_MAX_S', 60))
+DEBUG_PROFILE_HZ = int(os.getenv('DEBUG_PROFILE_HZ', 100))
+# production: waitress WSGI server; development: Flask's development server
+SERVER_MODE = str(os.getenv('SERVER_MODE', 'production')).lower()
+SERVER_HOST = str(os.getenv('SERVER_HOST', '0.0.0.0'))
+SERVER_PORT = int(os.getenv('SERVER_PORT', 8082))
+# Every /cache/stream client, power job stream and /suspend with wait holds a thread for as long as it lasts. There are
+# at most STREAM_MAX_SUBSCRIBERS of them together, and the server has SERVER_SPARE_THREADS more threads for the other
+# requests (/debug/profile, health checks)
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', 16))
+SERVER_SPARE_THREADS = int(os.getenv('SERVER_SPARE_THREADS', 8))
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', STREAM_MAX_SUBSCRIBERS + SERVER_SPARE_THREADS))
+SERVER_CONNECTION_LIMIT = int(os.getenv('SERVER_CONNECTION_LIMIT', 100))
+SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', 64))
+# Idle and keep-alive connections are closed after this many seconds without activity
+SERVER_CHANNEL_TIMEOUT_S = int(os.getenv('SERVER_CHANNEL_TIMEOUT_S', 30))
+# With more than one worker, a single main process ingests DOA into a shared memory cache that the workers serve
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 1))
+SHARED_CACHE_FILE = str(os.getenv('SHARED_CACHE_FILE', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'geo-proxy-cache')))
+SHARED_CACHE_FOLLOW_MS = int(os.getenv('SHARED_CACHE_FOLLOW_MS', 50))
+# The main process answers the workers' ingestion metrics and profiling requests on this unix socket
+SERVER_ADMIN_SOCKET = str(os.getenv('SERVER_ADMIN_SOCKET', os.path.join(tempfile.gettempdir(), 'geo-proxy-admin.sock')))
 SETTINGS_FILENAME = 'geo_settings.json'
 SETTINGS_FILE = os.path.join(os.path.dirname(__file__), SETTINGS_FILENAME)
 KRAKEN_SETTINGS_FILENAME = 'settings.json'
@@ -21,8 +48,74 @@ WEB_UI_FILE_OLD = os.path.join(DOA_PATH, '_UI/_web_interface/kraken_web_interfac
 WEB_UI_VARIABLES_FILE = os.path.join(DOA_PATH, '_ui/_web_interface/variables.py')
 
 BACKUP_DIR_NAME = os.path.join(DOA_PATH, 'settings_backups')
+SETTINGS_STAT_INTERVAL_MS = int(os.getenv('SETTINGS_STAT_INTERVAL_MS', 200))
+# Settings updates are written this long after the first pending one, merged with the ones arriving meanwhile
+SETTINGS_WRITE_DEBOUNCE_MS = int(os.getenv('SETTINGS_WRITE_DEBOUNCE_MS', 100))
+# 'full' syncs the written file and its directory, 'file' only the file, 'none' leaves it to the OS
+SETTINGS_FSYNC = str(os.getenv('SETTINGS_FSYNC', 'full'))
+HEALTH_SAMPLE_INTERVAL_MS = int(os.getenv('HEALTH_SAMPLE_INTERVAL_MS', 2000))
+HEALTH_HISTORY_SIZE = int(os.getenv('HEALTH_HISTORY_SIZE', 150))
 DOA_READ_REGULARITY_MS = int(os.getenv('DOA_READ_REGULARITY_MS', 100))
+# auto: inotify if available, falling back to polling; inotify: fails to start without inotify; poll
+DOA_INGESTION_MODE = str(os.getenv('DOA_INGESTION_MODE', 'auto')).lower()
+DOA_WATCH_TIMEOUT_MS = int(os.getenv('DOA_WATCH_TIMEOUT_MS', 1000))
+# adaptive: polls just after Kraken's expected writes, learnt from the DOA file, starting at DOA_READ_REGULARITY_MS;
+# fixed: polls every DOA_READ_REGULARITY_MS
+DOA_POLL_SCHEDULE = str(os.getenv('DOA_POLL_SCHEDULE', 'adaptive')).lower()
+DOA_POLL_MIN_MS = int(os.getenv('DOA_POLL_MIN_MS', 20))
+DOA_POLL_MAX_MS = int(os.getenv('DOA_POLL_MAX_MS', 1000))
+# The DOA file is stale, and polls back off, once it has not changed for this many write intervals
+DOA_POLL_STALE_FACTOR = float(os.getenv('DOA_POLL_STALE_FACTOR', 3))
+# Polls are this many times further apart while the CPU is at or above this temperature
+DOA_POLL_THERMAL_C = float(os.getenv('DOA_POLL_THERMAL_C', 75))
+DOA_POLL_THERMAL_FACTOR = float(os.getenv('DOA_POLL_THERMAL_FACTOR', 2))
+# Kraken's web interface push feed; while it delivers DOA lines, the DOA file is not read
+KRAKEN_PUSH_URL = str(os.getenv('KRAKEN_PUSH_URL', 'ws://127.0.0.1:8080/_push'))
+DOA_PUSH_STALE_MS = int(os.getenv('DOA_PUSH_STALE_MS', 2000))
+PUSH_MIN_BACKOFF_MS = int(os.getenv('PUSH_MIN_BACKOFF_MS', 500))
+PUSH_MAX_BACKOFF_MS = int(os.getenv('PUSH_MAX_BACKOFF_MS', 30000))
 DOA_TIME_THRESHOLD_MS = int(os.getenv('DOA_TIME_THRESHOLD_MS', 5000))
+DOA_CACHE_CAPACITY = int(os.getenv('DOA_CACHE_CAPACITY', 4096))
+# Smallest batch of DOA lines worth parsing with NumPy, when it is installed
+NUMPY_MIN_BATCH = int(os.getenv('NUMPY_MIN_BATCH', 64))
+# Encoded /cache bodies kept for the current cache generation, 0 disables the response cache
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 64))
+# JSON /cache responses that may have more rows than this are streamed in chunks instead of built in memory and cached.
+# By default that is any window of more than half the cache.
+CACHE_STREAM_MIN_ROWS = int(os.getenv('CACHE_STREAM_MIN_ROWS', DOA_CACHE_CAPACITY // 2))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 64))
+# What to do with a /cache/stream client that can not keep up: drop (its messages) or disconnect
+STREAM_SLOW_CONSUMER = str(os.getenv('STREAM_SLOW_CONSUMER', 'drop')).lower()
+STREAM_KEEPALIVE_MS = int(os.getenv('STREAM_KEEPALIVE_MS', 15000))
+# Opt-in: history takes up to HISTORY_MAX_BYTES of disk, in Kraken's DOA_PATH unless HISTORY_DIR is set
+HISTORY_ENABLED = str(os.getenv('HISTORY_ENABLED', 'false')).lower() in ('1', 'true', 'yes')
+HISTORY_DIR = str(os.getenv('HISTORY_DIR', os.path.join(DOA_PATH, 'doa_history')))
+# A new segment is started when the current one reaches either limit, retention deletes whole segments
+HISTORY_SEGMENT_BYTES = int(os.getenv('HISTORY_SEGMENT_BYTES', 4 * 1024 * 1024))
+HISTORY_SEGMENT_MS = int(os.getenv('HISTORY_SEGMENT_MS', 3_600_000))
+HISTORY_RETENTION_MS = int(os.getenv('HISTORY_RETENTION_MS', 7 * 24 * 3_600_000))
+HISTORY_MAX_BYTES = int(os.getenv('HISTORY_MAX_BYTES', 512 * 1024 * 1024))
+# Records are buffered in memory and written with a single fsync this often
+HISTORY_FLUSH_MS = int(os.getenv('HISTORY_FLUSH_MS', 10000))
+HISTORY_INDEX_INTERVAL = int(os.getenv('HISTORY_INDEX_INTERVAL', 256))
+HISTORY_DEFAULT_RANGE_MS = int(os.getenv('HISTORY_DEFAULT_RANGE_MS', 3_600_000))
+# When set, every ingested DOA line and Kraken settings change is recorded to this file for python -m benchmarks.replay
+CAPTURE_FILE = str(os.getenv('CAPTURE_FILE', ''))
+CAPTURE_FLUSH_MS = int(os.getenv('CAPTURE_FLUSH_MS', 1000))
+# Comma separated list of upstream geo-proxy base URLs, optionally named (name=http://host:8082).
+# When set, the proxy serves the merged caches of these stations instead of a local Kraken.
+AGGREGATOR_UPSTREAMS = str(os.getenv('AGGREGATOR_UPSTREAMS', ''))
+AGGREGATOR_POLL_MS = int(os.getenv('AGGREGATOR_POLL_MS', 500))
+AGGREGATOR_TIMEOUT_MS = int(os.getenv('AGGREGATOR_TIMEOUT_MS', 2000))
+AGGREGATOR_MAX_BACKOFF_MS = int(os.getenv('AGGREGATOR_MAX_BACKOFF_MS', 30000))
+AGGREGATOR_WORKERS = int(os.getenv('AGGREGATOR_WORKERS', 32))
+# 'system' switches the SDR relay and the Kraken service, 'fake' simulates them for development without hardware
+POWER_BACKEND = str(os.getenv('POWER_BACKEND', 'system'))
+POWER_JOB_HISTORY = int(os.getenv('POWER_JOB_HISTORY', 20))
+# Serializes power transitions between the processes of a station
+POWER_LOCK_FILE = str(os.getenv('POWER_LOCK_FILE', '/tmp/geo-proxy-power.lock'))
+# Recent power jobs of all processes, for status requests that land on another process than the job
+POWER_JOBS_FILE = str(os.getenv('POWER_JOBS_FILE', '/tmp/geo-proxy-power-jobs.json'))
 TIME = 0
 DOA_ANGLE = 1
 CONFIDENCE = 2
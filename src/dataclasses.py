@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass(eq=True, frozen=True)
@@ -9,3 +9,39 @@ class CacheRecord:
     rssi: float
     frequency_hz: int
     ant_arrangement: str
+
+
+@dataclass
+class DoaBatch:
+    """Column-wise batch of parsed DOA records"""
+    timestamps: list[int] = field(default_factory=list)
+    doas: list[float] = field(default_factory=list)
+    confidences: list[float] = field(default_factory=list)
+    rssis: list[float] = field(default_factory=list)
+    frequencies: list[int] = field(default_factory=list)
+    arrangements: list[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def record(self, i: int) -> CacheRecord:
+        return CacheRecord(timestamp=self.timestamps[i],
+                           doa=self.doas[i],
+                           confidence=self.confidences[i],
+                           rssi=self.rssis[i],
+                           frequency_hz=self.frequencies[i],
+                           ant_arrangement=self.arrangements[i])
+
+    def take(self, indices: list[int]) -> 'DoaBatch':
+        return DoaBatch(timestamps=[self.timestamps[i] for i in indices],
+                        doas=[self.doas[i] for i in indices],
+                        confidences=[self.confidences[i] for i in indices],
+                        rssis=[self.rssis[i] for i in indices],
+                        frequencies=[self.frequencies[i] for i in indices],
+                        arrangements=[self.arrangements[i] for i in indices])
+
+    def newer_than(self, timestamp: int) -> 'DoaBatch':
+        """Returns the records with timestamps strictly greater than the given one, in timestamp order"""
+        indices = sorted((i for i, ts in enumerate(self.timestamps) if ts > timestamp),
+                         key=self.timestamps.__getitem__)
+        return self if len(indices) == len(self) and indices == list(range(len(self))) else self.take(indices)
@@ -0,0 +1,381 @@
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from typing import Iterator, Optional
+
+from src.dataclasses import CacheRecord, DoaBatch
+
+# Numeric columns returned by DoaCache.columns, with their array typecodes
+COLUMNS = (('timestamps', 'q'), ('doas', 'd'), ('confidences', 'd'), ('rssis', 'd'), ('frequencies', 'q'))
+# Row fields, in the default order, and the columns they come from
+FIELD_COLUMNS = {'timestamp': 'timestamps', 'doa': 'doas', 'confidence': 'confidences', 'rssi': 'rssis',
+                 'frequency_hz': 'frequencies'}
+# A partition drops the counters of the records that left the ring once they are the majority and at least this many
+PARTITION_COMPACT_SIZE = 1024
+
+
+class Partition:
+    """
+    Append counters of the records of one frequency, in order. A record with counter c is at c % capacity in the
+    ring, as long as it has not left it. Counters before start belong to records that left the ring.
+    """
+    __slots__ = ('counters', 'start')
+
+    def __init__(self):
+        self.counters = array('q')
+        self.start = 0
+
+    def __len__(self) -> int:
+        return len(self.counters) - self.start
+
+
+class DoaCache:
+    """
+    Fixed-capacity ring buffer of DOA records, ordered by timestamp and stored column-wise.
+    Records must arrive in non-decreasing timestamp order; older ones are rejected, so expiry is just a head
+    pointer move and time filters are a bisect.
+    The generation grows with every change. Each record remembers the generation it was added at, which lets clients
+    ask for the records added after a cursor.
+    Records are also partitioned by frequency, so that frequency filtered queries only touch the matching records.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError(f'Cache capacity must be positive, got {capacity}')
+        self.capacity = capacity
+        self._timestamps = array('q', bytes(8 * capacity))
+        self._doas = array('d', bytes(8 * capacity))
+        self._confidences = array('d', bytes(8 * capacity))
+        self._rssis = array('d', bytes(8 * capacity))
+        self._frequencies = array('q', bytes(8 * capacity))
+        self._sequences = array('q', bytes(8 * capacity))
+        self._arrangements: list[Optional[str]] = [None] * capacity
+        self._head = 0
+        self._size = 0
+        # Number of records ever appended, the ring position of a record is its append counter % capacity
+        self._appended = 0
+        self._partitions: Optional[dict[int, Partition]] = {}
+        # Starting from the wall clock keeps generations growing across restarts, so old cursors stay meaningful
+        self.generation = time.time_ns() // 1000
+        self.updated_at = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _read(self, fn, *args):
+        """Runs a read-only function against a consistent state of the cache"""
+        with self._lock:
+            return fn(*args)
+
+    def _index(self, i: int) -> int:
+        return (self._head + i) % self.capacity
+
+    def _bisect(self, value: int, column: Optional[array] = None) -> int:
+        """Returns the logical position of the first record with column (timestamp by default) value >= the given one"""
+        column = self._timestamps if column is None else column
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if column[self._index(mid)] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _record(self, i: int) -> CacheRecord:
+        return CacheRecord(timestamp=self._timestamps[i],
+                           doa=self._doas[i],
+                           confidence=self._confidences[i],
+                           rssi=self._rssis[i],
+                           frequency_hz=self._frequencies[i],
+                           ant_arrangement=self._arrangements[i])
+
+    def _is_duplicate(self, values: tuple) -> bool:
+        position = self._size - 1
+        while position >= 0:
+            i = self._index(position)
+            if self._timestamps[i] != values[0]:
+                return False
+            if (self._timestamps[i], self._doas[i], self._confidences[i], self._rssis[i], self._frequencies[i],
+                    self._arrangements[i]) == values:
+                return True
+            position -= 1
+        return False
+
+    def _append(self, values: tuple) -> bool:
+        timestamp, doa, confidence, rssi, frequency_hz, ant_arrangement = values
+        if self._size:
+            newest = self._timestamps[self._index(self._size - 1)]
+            if timestamp < newest or (timestamp == newest and self._is_duplicate(values)):
+                return False
+
+        if self._size == self.capacity:
+            self._head = self._index(1)
+            self._size -= 1
+
+        i = self._index(self._size)
+        self._timestamps[i] = timestamp
+        self._doas[i] = doa
+        self._confidences[i] = confidence
+        self._rssis[i] = rssi
+        self._frequencies[i] = frequency_hz
+        self._arrangements[i] = ant_arrangement
+        self.generation += 1
+        self._sequences[i] = self.generation
+        self._size += 1
+        if self._partitions is not None:
+            partition = self._partitions.get(frequency_hz)
+            if partition is None:
+                partition = self._partitions[frequency_hz] = Partition()
+            partition.counters.append(self._appended)
+        self._appended += 1
+        return True
+
+    def append(self, record: CacheRecord) -> bool:
+        """Adds a record to the tail. Returns False if it is a duplicate or older than the newest record."""
+        with self._lock:
+            return self._append((record.timestamp, record.doa, record.confidence, record.rssi, record.frequency_hz,
+                                 record.ant_arrangement))
+
+    def extend(self, batch: DoaBatch) -> tuple[list[int], list[int]]:
+        """
+        Appends a batch sorted by timestamp and, if it is not empty, sets updated_at. Returns the batch indices of the
+        records that were added and the sequences they were added at.
+        """
+        with self._lock:
+            if len(batch):
+                self.updated_at = time.time_ns() // 1_000_000
+            rows = zip(batch.timestamps, batch.doas, batch.confidences, batch.rssis, batch.frequencies,
+                       batch.arrangements)
+            added = [i for i, values in enumerate(rows) if self._append(values)]
+            return added, list(range(self.generation - len(added) + 1, self.generation + 1))
+
+    def expire(self, time_threshold: int) -> int:
+        """Drops records older than time_threshold. Returns the number of dropped records."""
+        with self._lock:
+            expired = self._bisect(time_threshold)
+            for position in range(expired):
+                self._arrangements[self._index(position)] = None
+            self._head = self._index(expired)
+            self._size -= expired
+            if expired:
+                self.generation += 1
+                if self._partitions:
+                    for frequency_hz in [f for f, partition in self._partitions.items() if not self._trim(partition)]:
+                        del self._partitions[frequency_hz]
+            return expired
+
+    def _trim(self, partition: Partition) -> int:
+        """Skips the counters of the records that left the ring. Returns the number of records left."""
+        partition.start = bisect.bisect_left(partition.counters, self._appended - self._size, partition.start)
+        if partition.start >= PARTITION_COMPACT_SIZE and partition.start * 2 >= len(partition.counters):
+            del partition.counters[0:partition.start]
+            partition.start = 0
+        return len(partition)
+
+    def _bisect_partition(self, partition: Partition, value: int, column: array) -> int:
+        """Returns the position in the partition of its first record with column value >= the given one"""
+        lo, hi = partition.start, len(partition.counters)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if column[partition.counters[mid] % self.capacity] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _latest(self) -> Optional[CacheRecord]:
+        return self._record(self._index(self._size - 1)) if self._size else None
+
+    def latest(self) -> Optional[CacheRecord]:
+        return self._read(self._latest)
+
+    def _oldest_timestamp(self, newer_than: Optional[int] = None) -> Optional[int]:
+        i = self._bisect(newer_than) if newer_than is not None else 0
+        return self._timestamps[self._index(i)] if i < self._size else None
+
+    def oldest_timestamp(self, newer_than: Optional[int] = None) -> Optional[int]:
+        """Returns the timestamp of the oldest record, from newer_than on if given"""
+        return self._read(self._oldest_timestamp, newer_than)
+
+    def _row(self, i: int) -> list:
+        return [self._timestamps[i], self._doas[i], self._confidences[i], self._rssis[i], self._frequencies[i]]
+
+    def _bounds(self, bisect_fn, start: int, end: int, newer_than: Optional[int], since_cursor: Optional[int],
+                before_cursor: Optional[int]) -> tuple[int, int]:
+        if newer_than is not None:
+            start = max(start, bisect_fn(newer_than, self._timestamps))
+        if since_cursor is not None:
+            start = max(start, bisect_fn(since_cursor + 1, self._sequences))
+        if before_cursor is not None:
+            end = min(end, bisect_fn(before_cursor, self._sequences))
+        return start, end
+
+    def _indices(self, newer_than: Optional[int], since_cursor: Optional[int], before_cursor: Optional[int],
+                 frequencies: Optional[set[int]], ascending: bool) -> Iterator[int]:
+        """Ring indices of the records within the time and cursor bounds and of the given frequencies, in order"""
+        if frequencies is None or self._partitions is None:
+            start, end = self._bounds(self._bisect, 0, self._size, newer_than, since_cursor, before_cursor)
+            positions = range(start, end) if ascending else range(end - 1, start - 1, -1)
+            indices = (self._index(position) for position in positions)
+            if frequencies is None:
+                return indices
+            return (i for i in indices if self._frequencies[i] in frequencies)
+
+        ranges = []
+        for frequency_hz in frequencies:
+            partition = self._partitions.get(frequency_hz)
+            if partition is None or not self._trim(partition):
+                continue
+            start, end = self._bounds(lambda value, column: self._bisect_partition(partition, value, column),
+                                      partition.start, len(partition.counters), newer_than, since_cursor,
+                                      before_cursor)
+            ranges.append(self._partition_indices(partition, start, end, ascending))
+        if len(ranges) == 1:
+            return ranges[0]
+        return heapq.merge(*ranges, key=self._sequences.__getitem__, reverse=not ascending)
+
+    def _partition_indices(self, partition: Partition, start: int, end: int, ascending: bool) -> Iterator[int]:
+        for k in range(start, end) if ascending else range(end - 1, start - 1, -1):
+            yield partition.counters[k] % self.capacity
+
+    def _selection(self, newer_than: Optional[int], confidence: Optional[float], rssi: Optional[float],
+                   since_cursor: Optional[int], frequencies: Optional[set[int]], before_cursor: Optional[int],
+                   ascending: bool, offset: int, limit: Optional[int]) -> tuple[list[int], Optional[int]]:
+        """Ring indices of a page of records, and the sequence of the last one if more records follow"""
+        selected = []
+        for i in self._indices(newer_than, since_cursor, before_cursor, frequencies, ascending):
+            if confidence is not None and self._confidences[i] < confidence:
+                continue
+            if rssi is not None and self._rssis[i] < rssi:
+                continue
+            if offset:
+                offset -= 1
+                continue
+            if limit is not None and len(selected) == limit:
+                return selected, self._sequences[selected[-1]] if selected else None
+            selected.append(i)
+        return selected, None
+
+    def _page(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+              rssi: Optional[float] = None, since_cursor: Optional[int] = None,
+              frequencies: Optional[set[int]] = None, before_cursor: Optional[int] = None, ascending: bool = False,
+              offset: int = 0, limit: Optional[int] = None,
+              fields: Optional[tuple[str, ...]] = None) -> tuple[list[list], Optional[int]]:
+        row = self._row
+        if fields is not None:
+            columns = [getattr(self, f'_{FIELD_COLUMNS[field]}') for field in fields]
+            row = lambda i: [column[i] for column in columns]
+        selected, last = self._selection(newer_than, confidence, rssi, since_cursor, frequencies, before_cursor,
+                                         ascending, offset, limit)
+        return [row(i) for i in selected], last
+
+    def _page_columns(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+                      rssi: Optional[float] = None, since_cursor: Optional[int] = None,
+                      frequencies: Optional[set[int]] = None, before_cursor: Optional[int] = None,
+                      ascending: bool = False, offset: int = 0, limit: Optional[int] = None,
+                      fields: Optional[tuple[str, ...]] = None) -> tuple[dict[str, array], Optional[int]]:
+        selected, last = self._selection(newer_than, confidence, rssi, since_cursor, frequencies, before_cursor,
+                                         ascending, offset, limit)
+        typecodes = dict(COLUMNS)
+        page = {}
+        for field in fields or FIELD_COLUMNS:
+            column = getattr(self, f'_{FIELD_COLUMNS[field]}')
+            page[field] = array(typecodes[FIELD_COLUMNS[field]], [column[i] for i in selected])
+        return page, last
+
+    def _query(self, newer_than: Optional[int], confidence: Optional[float], rssi: Optional[float],
+               since_cursor: Optional[int], frequencies: Optional[set[int]] = None) -> list[list]:
+        return self._page(newer_than, confidence, rssi, since_cursor, frequencies)[0]
+
+    def _frequency_summary(self) -> dict[int, dict]:
+        summary = {}
+        if self._partitions is not None:
+            for frequency_hz, partition in self._partitions.items():
+                if self._trim(partition):
+                    summary[frequency_hz] = {
+                        'count': len(partition),
+                        'last_seen': self._timestamps[partition.counters[-1] % self.capacity]
+                    }
+            return summary
+        for position in range(self._size):
+            i = self._index(position)
+            entry = summary.setdefault(self._frequencies[i], {'count': 0, 'last_seen': None})
+            entry['count'] += 1
+            entry['last_seen'] = self._timestamps[i]
+        return summary
+
+    def frequency_summary(self) -> dict[int, dict]:
+        """Returns the number of records and the newest timestamp of every frequency in the cache"""
+        return self._read(self._frequency_summary)
+
+    def _records_since(self, since_cursor: int) -> tuple[int, list[CacheRecord], list[int]]:
+        start = self._bisect(since_cursor + 1, self._sequences)
+        indices = [self._index(position) for position in range(start, self._size)]
+        return self.generation, [self._record(i) for i in indices], [self._sequences[i] for i in indices]
+
+    def records_since(self, since_cursor: int) -> tuple[int, list[CacheRecord], list[int]]:
+        """Returns the current generation and the records added after the cursor with their sequences, oldest first"""
+        return self._read(self._records_since, since_cursor)
+
+    def _column(self, name: str, typecode: str, start: int) -> array:
+        column = getattr(self, f'_{name}')
+        first = self._index(start)
+        end = first + self._size - start
+        if end <= self.capacity:
+            return array(typecode, column[first:end].tobytes())
+        return array(typecode, column[first:].tobytes() + column[0:end - self.capacity].tobytes())
+
+    def _columns(self, newer_than: Optional[int], frequencies: Optional[set[int]]) -> tuple[int, dict[str, array]]:
+        if frequencies is not None:
+            indices = list(self._indices(newer_than, None, None, frequencies, True))
+            return self.generation, {name: array(typecode, [getattr(self, f'_{name}')[i] for i in indices])
+                                     for name, typecode in COLUMNS}
+        start = self._bisect(newer_than) if newer_than is not None else 0
+        return self.generation, {name: self._column(name, typecode, start) for name, typecode in COLUMNS}
+
+    def columns(self, newer_than: Optional[int] = None,
+                frequencies: Optional[set[int]] = None) -> tuple[int, dict[str, array]]:
+        """
+        Returns the generation and copies of the numeric columns (see COLUMNS) from newer_than on, of the given
+        frequencies only if any, oldest first
+        """
+        return self._read(self._columns, newer_than, frequencies)
+
+    def query(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+              rssi: Optional[float] = None, since_cursor: Optional[int] = None,
+              frequencies: Optional[set[int]] = None) -> list[list]:
+        """Returns [timestamp, doa, confidence, rssi, frequency_hz] rows matching the filters, newest first"""
+        return self._read(self._query, newer_than, confidence, rssi, since_cursor, frequencies)
+
+    def page(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+             rssi: Optional[float] = None, since_cursor: Optional[int] = None, frequencies: Optional[set[int]] = None,
+             before_cursor: Optional[int] = None, ascending: bool = False, offset: int = 0,
+             limit: Optional[int] = None, fields: Optional[tuple[str, ...]] = None) -> tuple[list[list], Optional[int]]:
+        """
+        Same as query, with records added before before_cursor only, oldest first if ascending, the first offset rows
+        skipped and at most limit rows returned. Rows have the given fields (see FIELD_COLUMNS) only.
+        Also returns the sequence of the last row when more rows follow, to continue from as before_cursor (or
+        since_cursor when ascending).
+        """
+        return self._read(self._page, newer_than, confidence, rssi, since_cursor, frequencies, before_cursor, ascending,
+                          offset, limit, fields)
+
+    def page_columns(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+                     rssi: Optional[float] = None, since_cursor: Optional[int] = None,
+                     frequencies: Optional[set[int]] = None, before_cursor: Optional[int] = None,
+                     ascending: bool = False, offset: int = 0, limit: Optional[int] = None,
+                     fields: Optional[tuple[str, ...]] = None) -> tuple[dict[str, array], Optional[int]]:
+        """Same as page, with the rows returned as one array per field instead"""
+        return self._read(self._page_columns, newer_than, confidence, rssi, since_cursor, frequencies, before_cursor,
+                          ascending, offset, limit, fields)
+
+    def snapshot(self, newer_than: Optional[int] = None, confidence: Optional[float] = None,
+                 rssi: Optional[float] = None, since_cursor: Optional[int] = None,
+                 frequencies: Optional[set[int]] = None) -> tuple[int, Optional[int], list]:
+        """Same as query, but also returns the generation and the oldest timestamp the rows are consistent with"""
+        return self._read(lambda: (self.generation, self._oldest_timestamp(newer_than),
+                                   self._query(newer_than, confidence, rssi, since_cursor, frequencies)))
@@ -0,0 +1,93 @@
+from typing import Optional
+
+from packaging.version import parse as parse_version, InvalidVersion
+
+from src.config import TIME, DOA_ANGLE, CONFIDENCE, RSSI, FREQUENCY_HZ, ARRAY_ARRANGEMENT, NUMPY_MIN_BATCH
+from src.dataclasses import DoaBatch
+from src.utils import now
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+MIN_FIELDS = 9
+
+
+class DoaParser:
+    """
+    Parses chunks of DOA_value.html lines into a DoaBatch in one go.
+    Applies the UCA counterclockwise flip and the array_angle offset to the whole batch, with NumPy when it is
+    installed and the batch is large enough. Malformed rows are skipped; the happy path has no per-row error handling.
+    """
+
+    def __init__(self, use_receive_time: bool):
+        # Kraken 1.6 writes unusable timestamps, so the time a line was read is used instead
+        self.use_receive_time = use_receive_time
+
+    def parse(self, lines: list[str], array_angle: Optional[float]) -> tuple[DoaBatch, int]:
+        """Returns the parsed batch and the number of rejected non-empty lines"""
+        lines = [line for line in lines if line]
+        rows = [row for row in (line.split(', ') for line in lines) if len(row) >= MIN_FIELDS]
+        if not rows:
+            return DoaBatch(), len(lines)
+
+        try:
+            batch = self._convert(rows, array_angle)
+        except ValueError:
+            rows = [row for row in rows if self._is_valid(row)]
+            batch = self._convert(rows, array_angle) if rows else DoaBatch()
+        return batch, len(lines) - len(batch)
+
+    def _is_valid(self, row: list[str]) -> bool:
+        try:
+            self._convert([row], None)
+            return True
+        except ValueError:
+            return False
+
+    def _convert(self, rows: list[list[str]], array_angle: Optional[float]) -> DoaBatch:
+        columns = list(zip(*rows))
+        if self.use_receive_time:
+            timestamps = [now()] * len(rows)
+        else:
+            timestamps = [int(value) for value in columns[TIME]]
+        arrangements = list(columns[ARRAY_ARRANGEMENT])
+        frequencies = [int(value) for value in columns[FREQUENCY_HZ]]
+
+        if np is not None and len(rows) >= NUMPY_MIN_BATCH:
+            doas = np.array(columns[DOA_ANGLE], dtype=np.float64)
+            # A hack for DOA heading for UCA array. Because KrakenSDR counts the angle counterclockwise
+            doas = np.where(np.array(arrangements) == 'UCA', 360 - doas, doas)
+            if array_angle is not None:
+                doas = np.mod(doas + array_angle, 360)
+            # np.round scales before rounding half to even, so a value exactly between two steps may end up one
+            # step away from what round() gives. That is below the resolution of the Kraken output.
+            doas = np.round(doas, 3).tolist()
+            confidences = np.round(np.array(columns[CONFIDENCE], dtype=np.float64), 2).tolist()
+            rssis = np.round(np.array(columns[RSSI], dtype=np.float64), 2).tolist()
+        else:
+            doas = [360 - float(value) if arrangement == 'UCA' else float(value)
+                    for value, arrangement in zip(columns[DOA_ANGLE], arrangements)]
+            if array_angle is not None:
+                doas = [round((value + array_angle) % 360, 3) for value in doas]
+            else:
+                doas = [round(value, 3) for value in doas]
+            confidences = [round(float(value), 2) for value in columns[CONFIDENCE]]
+            rssis = [round(float(value), 2) for value in columns[RSSI]]
+        return DoaBatch(timestamps=timestamps,
+                        doas=doas,
+                        confidences=confidences,
+                        rssis=rssis,
+                        frequencies=frequencies,
+                        arrangements=arrangements)
+
+
+def parser_for_version(kraken_version: Optional[str], logger=None) -> DoaParser:
+    try:
+        is_1_6 = kraken_version is not None and parse_version(kraken_version) == parse_version('1.6')
+    except InvalidVersion:
+        if logger:
+            logger.warning(f'Unknown Kraken version format "{kraken_version}", using DOA timestamps')
+        is_1_6 = False
+    return DoaParser(use_receive_time=is_1_6)
@@ -0,0 +1,122 @@
+import os
+import time
+from typing import Optional
+
+HEAD_FINGERPRINT_SIZE = 64
+# An unterminated last line is only returned once the file has not changed for this long
+TAIL_SETTLE_MS = 10
+
+
+class DoaFileReader:
+    """
+    Tails a DOA file, returning only the lines appended since the previous read.
+    Remembers the inode, size, mtime and byte offset of the file, and starts over from the beginning when Kraken
+    truncates, rewrites or replaces it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._inode = None
+        self._mtime_ns = None
+        self._size = 0
+        self._offset = 0
+        self._head = b''
+        self._pending = b''
+
+    def reset(self):
+        self._inode = None
+        self._mtime_ns = None
+        self._size = 0
+        self._offset = 0
+        self._head = b''
+        self._pending = b''
+
+    @property
+    def mtime_ns(self) -> Optional[int]:
+        """Modification time of the file as of the last read"""
+        return self._mtime_ns
+
+    def _is_rewritten(self, fd: int, stat: os.stat_result) -> bool:
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            return True
+        if stat.st_size == self._size and stat.st_mtime_ns != self._mtime_ns:
+            return True
+        return os.pread(fd, len(self._head), 0) != self._head
+
+    def _settled(self, stat: os.stat_result) -> bool:
+        age_ms = (time.time_ns() - stat.st_mtime_ns) / 1e6
+        if age_ms < TAIL_SETTLE_MS:
+            time.sleep((TAIL_SETTLE_MS - age_ms) / 1000.0)
+        try:
+            current = os.stat(self.path)
+        except OSError:
+            return False
+        return (current.st_ino, current.st_size, current.st_mtime_ns) == (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def skip(self):
+        """Moves past the current contents of the file without reading them, as if they had been read"""
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            self.reset()
+            return
+        try:
+            stat = os.fstat(fd)
+            self._head = os.pread(fd, HEAD_FINGERPRINT_SIZE, 0)
+        finally:
+            os.close(fd)
+        self._inode = stat.st_ino
+        self._mtime_ns = stat.st_mtime_ns
+        self._size = stat.st_size
+        self._offset = stat.st_size
+        self._pending = b''
+
+    def read_lines(self) -> Optional[list[str]]:
+        """Returns the new lines, or None if the file does not exist or has not changed"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.reset()
+            return None
+
+        if (stat.st_ino == self._inode and stat.st_size == self._size
+                and stat.st_mtime_ns == self._mtime_ns):
+            return None
+
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            self.reset()
+            return None
+
+        try:
+            stat = os.fstat(fd)
+            if self._inode is None or self._is_rewritten(fd, stat):
+                self._offset = 0
+                self._pending = b''
+            data = os.pread(fd, stat.st_size - self._offset, self._offset) if stat.st_size > self._offset else b''
+            if self._offset == 0:
+                self._head = data[0:HEAD_FINGERPRINT_SIZE]
+        finally:
+            os.close(fd)
+
+        self._inode = stat.st_ino
+        self._mtime_ns = stat.st_mtime_ns
+        self._size = stat.st_size
+
+        chunks = data.split(b'\n')
+        tail = chunks.pop()
+        self._offset += len(data) - len(tail)
+
+        # Kraken may never append a newline to the last line, so an unterminated one is returned once the file has
+        # settled, rather than in the middle of a write. The offset stays at its start, so the line is read again
+        # until it is terminated, and not returned again unless it has grown since.
+        if chunks:
+            if chunks[0] == self._pending:
+                chunks.pop(0)
+            self._pending = b''
+        if tail and tail != self._pending and self._settled(stat):
+            chunks.append(tail)
+            self._pending = tail
+
+        return [chunk.decode('utf-8', errors='replace') for chunk in chunks]
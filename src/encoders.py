@@ -0,0 +1,64 @@
+import json
+import struct
+import sys
+from array import array
+
+try:
+    import msgpack
+except ModuleNotFoundError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.geo-proxy.columnar'
+MSGPACK_MIMETYPE = 'application/msgpack'
+COLUMNAR_MAGIC = b'GPC1'
+COLUMNAR_HEADER_LENGTH = struct.Struct('<I')
+
+
+def supported_mimetypes() -> list[str]:
+    mimetypes = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    return mimetypes
+
+
+def encode_columnar(payload: dict) -> bytes:
+    """
+    Encodes a /cache payload, with 'data' given as a dict of field name to array (see DoaCache.page_columns), as:
+      - 4 bytes magic, b'GPC1'
+      - uint32 little-endian length of the header
+      - UTF-8 JSON header: every payload field except 'data', plus 'rows' and 'columns', a list of
+        [name, struct type code, byte offset from the end of the header]
+      - one packed little-endian array per column, in the order of 'columns'
+    """
+    columns: dict[str, array] = payload['data']
+    body = []
+    layout = []
+    offset = 0
+    for name, packed in columns.items():
+        typecode = packed.typecode
+        if sys.byteorder != 'little':
+            packed = array(typecode, packed)
+            packed.byteswap()
+        chunk = packed.tobytes()
+        layout.append([name, typecode, offset])
+        body.append(chunk)
+        offset += len(chunk)
+
+    header = {key: value for key, value in payload.items() if key != 'data'}
+    header['rows'] = len(next(iter(columns.values()), ()))
+    header['columns'] = layout
+    header_bytes = json.dumps(header, separators=(',', ':')).encode()
+    return b''.join([COLUMNAR_MAGIC, COLUMNAR_HEADER_LENGTH.pack(len(header_bytes)), header_bytes, *body])
+
+
+def encode_msgpack(payload: dict) -> bytes:
+    return msgpack.packb(payload)
+
+
+def encode(payload: dict, mimetype: str) -> bytes:
+    if mimetype == COLUMNAR_MIMETYPE:
+        return encode_columnar(payload)
+    if mimetype == MSGPACK_MIMETYPE:
+        return encode_msgpack(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
@@ -0,0 +1,123 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+except (OSError, AttributeError):
+    _inotify_init1 = None
+    _inotify_add_watch = None
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+READ_BUFFER_SIZE = 64 * 1024
+
+
+def inotify_available() -> bool:
+    return _inotify_init1 is not None
+
+
+def open_inotify(paths: list[str], mask: int) -> int:
+    """Returns a non-blocking inotify descriptor watching the existing paths among the given ones"""
+    if not inotify_available():
+        raise OSError('inotify is not available')
+    fd = _inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+    for path in paths:
+        if os.path.exists(path):
+            _inotify_add_watch(fd, os.fsencode(path), mask)
+    return fd
+
+
+class FileWatcher:
+    """
+    Sleeps on inotify events for a set of files and calls their callbacks when the files change.
+    Parent directories are watched instead of the files, so a file replaced by rename is still followed.
+    Changes arriving together are coalesced into a single callback call. on_timeout is called every timeout_s seconds
+    whatever events arrive, as events of other files in the watched directories would otherwise keep postponing it.
+    """
+
+    def __init__(self, timeout_s: float, on_timeout: Optional[Callable] = None, logger=None):
+        if not inotify_available():
+            raise OSError('inotify is not available')
+        self._fd = _inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+        self.timeout_s = timeout_s
+        self.on_timeout = on_timeout
+        self.logger = logger
+        self._callbacks: dict[int, dict[str, list[Callable]]] = {}
+        self._directories: dict[str, int] = {}
+        self._thread = None
+
+    def watch(self, path: str, callback: Callable):
+        directory, name = os.path.split(os.path.abspath(path))
+        wd = self._directories.get(directory)
+        if wd is None:
+            wd = _inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f'Cannot watch {directory}: {os.strerror(errno)}')
+            self._directories[directory] = wd
+        self._callbacks.setdefault(wd, {}).setdefault(name, []).append(callback)
+
+    def _read_events(self) -> list[Callable]:
+        triggered = []
+        try:
+            buffer = os.read(self._fd, READ_BUFFER_SIZE)
+        except BlockingIOError:
+            return triggered
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0').decode('utf-8', errors='replace')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                callbacks = [cb for names in self._callbacks.values() for cbs in names.values() for cb in cbs]
+            else:
+                callbacks = self._callbacks.get(wd, {}).get(name, [])
+            for callback in callbacks:
+                if callback not in triggered:
+                    triggered.append(callback)
+        return triggered
+
+    def _call(self, callback: Callable):
+        try:
+            callback()
+        except:
+            if self.logger:
+                self.logger.error(traceback.format_exc())
+
+    def run(self):
+        timed_out_at = time.monotonic()
+        while True:
+            remaining = max(0.0, timed_out_at + self.timeout_s - time.monotonic())
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if ready:
+                for callback in self._read_events():
+                    self._call(callback)
+            if time.monotonic() - timed_out_at >= self.timeout_s:
+                timed_out_at = time.monotonic()
+                if self.on_timeout:
+                    self._call(self.on_timeout)
+
+    def run_in_thread(self):
+        self._thread = threading.Thread(target=self.run, name='file-watcher', daemon=True)
+        self._thread.start()
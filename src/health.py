@@ -0,0 +1,69 @@
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from src.config import HEALTH_SAMPLE_INTERVAL_MS, HEALTH_HISTORY_SIZE
+from src.system import is_in_docker, is_kraken_service_running, is_kraken_sdr_connected, get_cpu_temperature
+from src.utils import now
+
+
+class HealthSampler:
+    """
+    Probes the Kraken service, the SDR and the CPU temperature in a background thread, so that health checks only
+    read the latest snapshot. Keeps a short history of the samples.
+    Without the thread (in Docker), or if it falls behind, a snapshot older than interval_ms is refreshed on read.
+    """
+
+    def __init__(self, interval_ms: int, history_size: int, logger=None):
+        self.interval_ms = interval_ms
+        self.logger = logger
+        self.history: deque = deque(maxlen=history_size)
+        self._snapshot: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._sampling = threading.Lock()
+        self._thread = None
+
+    def sample(self) -> dict:
+        in_docker = is_in_docker()
+        snapshot = {
+            'sampled_at': now(),
+            'kraken_service_running': is_kraken_service_running() if not in_docker else None,
+            'kraken_sdr_connected': is_kraken_sdr_connected() if not in_docker else None,
+            'cpu_temperature': get_cpu_temperature() if not in_docker else None
+        }
+        with self._lock:
+            self._snapshot = snapshot
+            self.history.append(snapshot)
+        return snapshot
+
+    def snapshot(self) -> dict:
+        snapshot = self._snapshot
+        # The thread samples every interval_ms plus the time the probes take
+        max_age_ms = self.interval_ms if self._thread is None else 2 * self.interval_ms
+        if snapshot is not None and now() - snapshot['sampled_at'] < max_age_ms:
+            return snapshot
+        # Concurrent readers of a stale snapshot share a single probe
+        if not self._sampling.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            return self.sample()
+        finally:
+            self._sampling.release()
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except:
+                if self.logger:
+                    self.logger.error(traceback.format_exc())
+            time.sleep(self.interval_ms / 1000.0)
+
+    def run_in_thread(self):
+        self._thread = threading.Thread(target=self.run, name='health-sampler', daemon=True)
+        self._thread.start()
+
+
+health_sampler = HealthSampler(HEALTH_SAMPLE_INTERVAL_MS, HEALTH_HISTORY_SIZE)
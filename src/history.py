@@ -0,0 +1,276 @@
+import bisect
+import os
+import struct
+import threading
+import time
+import traceback
+from typing import Iterable, Iterator, Optional
+
+from src.config import HISTORY_DIR, HISTORY_SEGMENT_BYTES, HISTORY_SEGMENT_MS, HISTORY_RETENTION_MS, \
+    HISTORY_MAX_BYTES, HISTORY_FLUSH_MS, HISTORY_INDEX_INTERVAL
+from src.dataclasses import CacheRecord, DoaBatch
+from src.utils import now
+
+# timestamp, doa, confidence, rssi, frequency, antenna arrangement
+RECORD = struct.Struct('<qfffI8s')
+# timestamp, record number in the segment
+INDEX_ENTRY = struct.Struct('<qq')
+SEGMENT_SUFFIX = '.doa'
+INDEX_SUFFIX = '.idx'
+READ_CHUNK_RECORDS = 4096
+
+
+def unpack_record(values: tuple) -> CacheRecord:
+    timestamp, doa, confidence, rssi, frequency_hz, arrangement = values
+    return CacheRecord(timestamp=timestamp,
+                       doa=round(doa, 3),
+                       confidence=round(confidence, 3),
+                       rssi=round(rssi, 3),
+                       frequency_hz=frequency_hz,
+                       ant_arrangement=arrangement.rstrip(b'\0').decode() or None)
+
+
+def read_records(data, start: int, end: int, frequency: Optional[int]) -> Iterator[CacheRecord]:
+    for values in RECORD.iter_unpack(data):
+        timestamp = values[0]
+        if timestamp < start:
+            continue
+        if timestamp > end:
+            return
+        if frequency is None or values[4] == frequency:
+            yield unpack_record(values)
+
+
+def downsample(records: Iterable[CacheRecord], step_ms: int) -> Iterator[CacheRecord]:
+    """Keeps the most confident record of every frequency in each step_ms long bucket"""
+    bucket = None
+    best: dict[int, CacheRecord] = {}
+    for record in records:
+        record_bucket = record.timestamp // step_ms
+        if record_bucket != bucket:
+            yield from sorted(best.values(), key=lambda r: r.timestamp)
+            bucket = record_bucket
+            best = {}
+        current = best.get(record.frequency_hz)
+        if current is None or record.confidence > current.confidence:
+            best[record.frequency_hz] = record
+    yield from sorted(best.values(), key=lambda r: r.timestamp)
+
+
+class HistoryStore:
+    """
+    Append-only on-disk log of the ingested DOA records, in fixed-size binary records.
+    The log is split in segments named after their first timestamp, each with a sparse index holding the timestamp of
+    every index_interval-th record. Appends only go to an in-memory buffer, that a background thread writes and
+    fsyncs every flush_ms, so that the SD card sees a few large writes instead of one per DOA update. Whole segments
+    are deleted once they are older than retention_ms or the log outgrows max_bytes.
+    Any process can query the log, only the writing process also sees the records that are not flushed yet.
+    """
+
+    def __init__(self, path: str, segment_bytes: int, segment_ms: int, retention_ms: int, max_bytes: int,
+                 flush_ms: int, index_interval: int, logger=None):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.segment_ms = segment_ms
+        self.retention_ms = retention_ms
+        self.max_bytes = max_bytes
+        self.flush_ms = flush_ms
+        self.index_interval = index_interval
+        self.logger = logger
+        self._pending = bytearray()
+        self._pending_timestamps: list[int] = []
+        self._resume_after: Optional[int] = None
+        self._active: Optional[tuple] = None  # first timestamp, data fd, index fd, records
+        self._buffer_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._thread = None
+
+    def _segments(self) -> list[int]:
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _segment_path(self, first_timestamp: int, suffix: str = SEGMENT_SUFFIX) -> str:
+        return os.path.join(self.path, f'{first_timestamp:013d}{suffix}')
+
+    def open(self):
+        """Prepares for writing: drops a torn record at the end of the last segment and remembers its last timestamp"""
+        os.makedirs(self.path, exist_ok=True)
+        segments = self._segments()
+        if not segments:
+            return
+        path = self._segment_path(segments[-1])
+        size = os.path.getsize(path)
+        size -= size % RECORD.size
+        os.truncate(path, size)
+        if size:
+            with open(path, 'rb') as f:
+                f.seek(size - RECORD.size)
+                # Kraken rewrites its last lines after a restart, they are in the log already
+                self._resume_after = RECORD.unpack(f.read(RECORD.size))[0]
+
+    def append(self, batch: DoaBatch):
+        if not len(batch):
+            return
+        packed = bytearray()
+        timestamps = []
+        for i in range(len(batch)):
+            timestamp = batch.timestamps[i]
+            if self._resume_after is not None and timestamp <= self._resume_after:
+                continue
+            packed += RECORD.pack(timestamp, batch.doas[i], batch.confidences[i], batch.rssis[i],
+                                  batch.frequencies[i], (batch.arrangements[i] or '').encode()[0:8])
+            timestamps.append(timestamp)
+        with self._buffer_lock:
+            self._pending += packed
+            self._pending_timestamps.extend(timestamps)
+
+    def _start_segment(self, first_timestamp: int):
+        self._close_segment()
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        self._active = (first_timestamp, os.open(self._segment_path(first_timestamp), flags, 0o644),
+                        os.open(self._segment_path(first_timestamp, INDEX_SUFFIX), flags, 0o644), 0)
+
+    def _close_segment(self):
+        if self._active is not None:
+            for fd in self._active[1:3]:
+                os.fsync(fd)
+                os.close(fd)
+            self._active = None
+
+    def _needs_rotation(self, timestamp: int, records: int) -> bool:
+        first_timestamp = self._active[0]
+        return records * RECORD.size >= self.segment_bytes or timestamp - first_timestamp >= self.segment_ms
+
+    def flush(self):
+        with self._io_lock:
+            with self._buffer_lock:
+                data, timestamps = self._pending, self._pending_timestamps
+                self._pending, self._pending_timestamps = bytearray(), []
+            if timestamps:
+                self._resume_after = None
+            start = 0
+            for i, timestamp in enumerate(timestamps):
+                if self._active is None or self._needs_rotation(timestamp, self._active[3] + i - start):
+                    self._write(data, timestamps, start, i)
+                    self._start_segment(timestamp)
+                    start = i
+            self._write(data, timestamps, start, len(timestamps))
+        if self._active is not None and timestamps:
+            os.fdatasync(self._active[1])
+            os.fdatasync(self._active[2])
+        self.enforce_retention()
+
+    def _write(self, data: bytearray, timestamps: list[int], start: int, end: int):
+        if start == end:
+            return
+        first_timestamp, data_fd, index_fd, records = self._active
+        index = bytearray()
+        for i in range(start, end):
+            if (records + i - start) % self.index_interval == 0:
+                index += INDEX_ENTRY.pack(timestamps[i], records + i - start)
+        os.write(data_fd, data[start * RECORD.size:end * RECORD.size])
+        if index:
+            os.write(index_fd, index)
+        self._active = (first_timestamp, data_fd, index_fd, records + end - start)
+
+    def enforce_retention(self):
+        segments = self._segments()
+        active = self._active[0] if self._active is not None else None
+        sizes = {}
+        for first_timestamp in segments:
+            try:
+                sizes[first_timestamp] = os.path.getsize(self._segment_path(first_timestamp))
+            except OSError:
+                sizes[first_timestamp] = 0
+        total = sum(sizes.values())
+        expired_before = now() - self.retention_ms
+        for i, first_timestamp in enumerate(segments[:-1]):
+            if first_timestamp == active:
+                break
+            # A segment ends where the next one starts
+            if total <= self.max_bytes and segments[i + 1] > expired_before:
+                break
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+                try:
+                    os.remove(self._segment_path(first_timestamp, suffix))
+                except OSError:
+                    pass
+            total -= sizes[first_timestamp]
+            if self.logger:
+                self.logger.info(f'Deleted history segment {first_timestamp}')
+
+    def _first_record(self, first_timestamp: int, start: int) -> int:
+        try:
+            with open(self._segment_path(first_timestamp, INDEX_SUFFIX), 'rb') as f:
+                index = f.read()
+        except OSError:
+            return 0
+        index = index[0:len(index) - len(index) % INDEX_ENTRY.size]
+        entries = list(INDEX_ENTRY.iter_unpack(index))
+        position = bisect.bisect_left(entries, (start, -1)) - 1
+        return entries[position][1] if position >= 0 else 0
+
+    def _read_segment(self, first_timestamp: int, records: int, start: int, end: int,
+                      frequency: Optional[int]) -> Iterator[CacheRecord]:
+        record = self._first_record(first_timestamp, start)
+        try:
+            f = open(self._segment_path(first_timestamp), 'rb')
+        except OSError:
+            # Deleted by the retention since it was listed
+            return
+        with f:
+            while record < records:
+                count = min(READ_CHUNK_RECORDS, records - record)
+                f.seek(record * RECORD.size)
+                data = f.read(count * RECORD.size)
+                data = data[0:len(data) - len(data) % RECORD.size]
+                if not data:
+                    return
+                yield from read_records(data, start, end, frequency)
+                last_timestamp = RECORD.unpack_from(data, len(data) - RECORD.size)[0]
+                if last_timestamp > end:
+                    return
+                record += len(data) // RECORD.size
+
+    def query(self, start: int, end: int, frequency: Optional[int] = None) -> Iterator[CacheRecord]:
+        """Yields the records with start <= timestamp <= end, oldest first"""
+        with self._io_lock:
+            segments = self._segments()
+            selected = []
+            for i, first_timestamp in enumerate(segments):
+                next_timestamp = segments[i + 1] if i + 1 < len(segments) else None
+                if first_timestamp > end or (next_timestamp is not None and next_timestamp < start):
+                    continue
+                try:
+                    records = os.path.getsize(self._segment_path(first_timestamp)) // RECORD.size
+                except OSError:
+                    continue
+                selected.append((first_timestamp, records))
+            with self._buffer_lock:
+                pending = bytes(self._pending)
+
+        for first_timestamp, records in selected:
+            yield from self._read_segment(first_timestamp, records, start, end, frequency)
+        yield from read_records(pending, start, end, frequency)
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_ms / 1000.0)
+            try:
+                self.flush()
+            except:
+                if self.logger:
+                    self.logger.error(traceback.format_exc())
+
+    def run_in_thread(self):
+        self.open()
+        self._thread = threading.Thread(target=self.run, name='history-writer', daemon=True)
+        self._thread.start()
+
+
+history_store = HistoryStore(HISTORY_DIR, HISTORY_SEGMENT_BYTES, HISTORY_SEGMENT_MS, HISTORY_RETENTION_MS,
+                             HISTORY_MAX_BYTES, HISTORY_FLUSH_MS, HISTORY_INDEX_INTERVAL)
@@ -0,0 +1,137 @@
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+# The interval estimate follows new samples with this weight
+INTERVAL_SMOOTHING = 0.25
+# Polls are scheduled this long after an expected write, plus a share of the interval, to let Kraken finish writing
+POLL_GUARD_MS = 5
+POLL_GUARD_SHARE = 0.05
+# A write that is late is looked for this often, in shares of the interval
+LATE_POLL_SHARE = 0.25
+# Polls at the expected write times only see the latest of faster writes. Every PROBE_EVERY writes, and after every
+# write that came early, the file is also polled halfway through the interval to find out if the cadence went up.
+PROBE_EVERY = 4
+# A write this early, in shares of the interval, sets the interval right away
+SPEEDUP_SHARE = 0.75
+
+
+def missed_run(late_ms: float, duration_ms: float, delay_ms: float) -> bool:
+    """A run missed a poll if it started, or took, longer than the delay between polls it was scheduled with"""
+    return late_ms > delay_ms or duration_ms > delay_ms
+
+
+class IngestionScheduler:
+    """
+    Runs DOA ingestion just after Kraken is expected to have written the DOA file.
+    The interval between writes is learnt from the modification times of the file. Once the file has not changed for
+    stale_factor intervals (stale_factor times max_ms until an interval is known), or before that if the Kraken
+    service or SDR is down, polls back off exponentially up to max_ms.
+    Delays are multiplied by thermal_factor while the CPU temperature is at or above thermal_c.
+    """
+
+    def __init__(self, run: Callable[[], None], modified_at: Callable[[], Optional[int]], health: Callable[[], dict],
+                 initial_ms: int, min_ms: int, max_ms: int, stale_factor: float, thermal_c: float,
+                 thermal_factor: float, logger=None):
+        self._run = run
+        self.modified_at = modified_at
+        self.health = health
+        self.initial_ms = initial_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.stale_factor = stale_factor
+        self.thermal_c = thermal_c
+        self.thermal_factor = thermal_factor
+        self.logger = logger
+        # Called for every run that started late or took longer than the delay before it
+        self.on_missed: Optional[Callable[[], None]] = None
+        self.interval_ms: Optional[float] = None
+        self.delay_ms: float = initial_ms
+        self.state = 'learning'
+        self._modified_ns: Optional[int] = None
+        self._backoff_ms: Optional[float] = None
+        self._writes = 0
+        self._speeding_up = False
+        self._probed_ns: Optional[int] = None
+
+    def observe(self, modified_ns: Optional[int]):
+        """Updates the interval estimate with the modification time of the file as of the last ingestion"""
+        if modified_ns is None or modified_ns == self._modified_ns:
+            return
+        if self._modified_ns is not None and modified_ns > self._modified_ns:
+            sample = (modified_ns - self._modified_ns) / 1e6
+            self._speeding_up = self.interval_ms is not None and sample < SPEEDUP_SHARE * self.interval_ms
+            if self.interval_ms is None:
+                # A longer gap is a pause of Kraken, such as the one before the first write after a start
+                if sample <= self.max_ms * self.stale_factor:
+                    self.interval_ms = sample
+            elif self._speeding_up:
+                self.interval_ms = sample
+            else:
+                # A long pause moves the estimate by a bounded step, a slower cadence is still learnt in a few writes
+                sample = min(sample, self.interval_ms * self.stale_factor)
+                self.interval_ms += INTERVAL_SMOOTHING * (sample - self.interval_ms)
+            if self.interval_ms is not None:
+                self.interval_ms = max(self.interval_ms, self.min_ms)
+        self._modified_ns = modified_ns
+        self._writes += 1
+
+    def _backoff(self) -> float:
+        self._backoff_ms = min(self.max_ms, 2 * (self._backoff_ms or self.interval_ms or self.initial_ms))
+        return self._backoff_ms
+
+    def next_delay_ms(self, now_ns: int) -> float:
+        health = self.health() or {}
+        since_ms = (now_ns - self._modified_ns) / 1e6 if self._modified_ns is not None else None
+        if since_ms is not None and since_ms <= (self.interval_ms or self.max_ms) * self.stale_factor:
+            # Writes are followed as long as they come, whatever the health probes say
+            self._backoff_ms = None
+            until_ms = (self.interval_ms or self.initial_ms) - since_ms
+            if self.interval_ms is None:
+                self.state = 'learning'
+                delay = self.initial_ms
+            elif self.interval_ms / 2 > since_ms and self._probed_ns != self._modified_ns \
+                    and (self._speeding_up or self._writes % PROBE_EVERY == 0):
+                self.state = 'probing'
+                self._probed_ns = self._modified_ns
+                delay = self.interval_ms / 2 - since_ms
+            elif until_ms > 0:
+                self.state = 'active'
+                delay = until_ms + POLL_GUARD_MS + POLL_GUARD_SHARE * self.interval_ms
+            else:
+                self.state = 'late'
+                delay = LATE_POLL_SHARE * self.interval_ms
+        elif health.get('kraken_service_running') is False or health.get('kraken_sdr_connected') is False:
+            self.state = 'kraken down'
+            delay = self._backoff()
+        else:
+            self.state = 'stale'
+            delay = self._backoff()
+
+        temperature = health.get('cpu_temperature')
+        if temperature is not None and temperature >= self.thermal_c:
+            self.state += ', thermal'
+            delay *= self.thermal_factor
+        return min(self.max_ms, max(self.min_ms, delay))
+
+    def run(self):
+        due = time.monotonic()
+        while True:
+            started = time.monotonic()
+            delay_ms = self.delay_ms
+            try:
+                self._run()
+                self.observe(self.modified_at())
+                self.delay_ms = self.next_delay_ms(time.time_ns())
+            except:
+                if self.logger:
+                    self.logger.error(traceback.format_exc())
+            finished = time.monotonic()
+            if self.on_missed and missed_run((started - due) * 1000, (finished - started) * 1000, delay_ms):
+                self.on_missed()
+            due = finished + self.delay_ms / 1000.0
+            time.sleep(self.delay_ms / 1000.0)
+
+    def run_in_thread(self):
+        threading.Thread(target=self.run, name='ingestion-scheduler', daemon=True).start()
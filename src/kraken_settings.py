@@ -0,0 +1,219 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import traceback
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional
+
+from src.config import KRAKEN_SETTINGS_FILE, SETTINGS_FILE, SETTINGS_STAT_INTERVAL_MS, SETTINGS_WRITE_DEBOUNCE_MS, \
+    SETTINGS_FSYNC
+
+
+class SettingsFile:
+    """
+    Parsed, read-only snapshot of a JSON settings file that is shared by all readers.
+    The file is re-read only when its inode, size or mtime change. Without a file watcher it is stat-ed at most once
+    per stat_interval_ms; once watched() is called, refreshes happen only on invalidate().
+    Listeners subscribed to a key are called with (key, old value, new value) when a later refresh changes it.
+    """
+
+    def __init__(self, path: str, stat_interval_ms: int, logger=None):
+        self.path = path
+        self.stat_interval_ms = stat_interval_ms
+        self.logger = logger
+        self._snapshot: Mapping = MappingProxyType({})
+        self._stat_key = None
+        self._checked_at = 0.0
+        self._dirty = True
+        self._loaded = False
+        self._watched = False
+        self._listeners: dict[str, list[Callable]] = {}
+        self._lock = threading.Lock()
+
+    def watched(self):
+        self._watched = True
+
+    def invalidate(self):
+        self._dirty = True
+
+    def subscribe(self, key: str, callback: Callable):
+        self._listeners.setdefault(key, []).append(callback)
+
+    def _needs_check(self) -> bool:
+        if self._dirty:
+            return True
+        if self._watched:
+            return False
+        return (time.monotonic() - self._checked_at) * 1000 >= self.stat_interval_ms
+
+    def refresh(self):
+        with self._lock:
+            if not self._needs_check():
+                return
+            self._dirty = False
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+                stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                stat_key = None
+            if stat_key == self._stat_key:
+                return
+
+            try:
+                settings = {}
+                if stat_key is not None:
+                    with open(self.path) as file:
+                        settings = json.loads(file.read())
+            except (OSError, ValueError):
+                # Most likely caught the file in the middle of a rewrite, keep the old snapshot and retry later
+                self._dirty = True
+                if self.logger:
+                    self.logger.warning(f'Failed to read {self.path}: {traceback.format_exc(limit=0)}')
+                return
+
+            old = self._snapshot
+            self._snapshot = MappingProxyType(settings)
+            self._stat_key = stat_key
+            if not self._loaded:
+                self._loaded = True
+                return
+
+        for key, callbacks in self._listeners.items():
+            if old.get(key) != settings.get(key):
+                for callback in callbacks:
+                    callback(key, old.get(key), settings.get(key))
+
+    def snapshot(self) -> Mapping:
+        self.refresh()
+        # Updates this process made that are not in the file yet
+        writer = _writers.get(self.path)
+        pending = writer.pending() if writer is not None else None
+        return MappingProxyType({**self._snapshot, **pending}) if pending else self._snapshot
+
+    def get(self, key: str, default=None):
+        return self.snapshot().get(key, default)
+
+
+class SettingsWriter:
+    """
+    Applies updates to a JSON settings file. With debounce_ms, updates are written behind, by a timer started by the
+    first pending one, so that all the updates arriving within debounce_ms of it, one after another or concurrently,
+    are merged into one write. Snapshots of the file in this process see pending updates right away. Keys whose values
+    did not change are not written, and nothing is written when none did.
+    The file is replaced atomically through a temporary file, so readers (Kraken included) never see a partial one.
+    Writes are serialized between threads and, with a lock on the directory, between processes.
+    """
+
+    def __init__(self, path: str, debounce_ms: int, fsync: str, logger=None):
+        self.path = path
+        self.debounce_ms = debounce_ms
+        self.fsync = fsync
+        self.logger = logger
+        self._pending: Optional[dict] = None
+        self._writing: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def update(self, updates: dict):
+        """Without debounce_ms, returns once the updates are in the file. With it, returns at once."""
+        if self.debounce_ms <= 0:
+            with self._write_lock:
+                self._write(updates)
+            return
+        with self._lock:
+            if self._pending is None:
+                self._pending = {}
+                timer = threading.Timer(self.debounce_ms / 1000.0, self.flush)
+                timer.name = 'settings-writer'
+                timer.start()
+            self._pending.update(updates)
+
+    def pending(self) -> Optional[dict]:
+        """The updates that are not in the file yet"""
+        with self._lock:
+            if self._pending is None and self._writing is None:
+                return None
+            return {**(self._writing or {}), **(self._pending or {})}
+
+    def flush(self):
+        """Writes the pending updates"""
+        with self._write_lock:
+            with self._lock:
+                self._writing, self._pending = self._pending, None
+            if self._writing is None:
+                return
+            try:
+                self._write(self._writing)
+            except:
+                if self.logger:
+                    self.logger.error(f'Failed to write {self.path}: {traceback.format_exc()}')
+            finally:
+                with self._lock:
+                    self._writing = None
+
+    def _write(self, updates: dict):
+        directory = os.path.dirname(self.path) or '.'
+        directory_fd = os.open(directory, os.O_RDONLY)
+        try:
+            fcntl.flock(directory_fd, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as file:
+                    stat = os.fstat(file.fileno())
+                    settings = json.loads(file.read())
+            except FileNotFoundError:
+                settings, stat = {}, None
+            changed = {key: value for key, value in updates.items() if key not in settings or settings[key] != value}
+            if not changed and stat is not None:
+                return
+            settings.update(changed)
+
+            temp_path = os.path.join(directory, f'.{os.path.basename(self.path)}.{os.getpid()}.tmp')
+            try:
+                with open(temp_path, 'w') as file:
+                    file.write(json.dumps(settings, indent=2))
+                    file.flush()
+                    if stat is not None:
+                        os.fchmod(file.fileno(), stat.st_mode & 0o7777)
+                        try:
+                            os.fchown(file.fileno(), stat.st_uid, stat.st_gid)
+                        except PermissionError:
+                            pass
+                    if self.fsync in ('file', 'full'):
+                        os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+            except:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            if self.fsync == 'full':
+                os.fsync(directory_fd)
+            if self.logger:
+                self.logger.debug(f'Wrote {sorted(changed)} to {self.path}')
+        finally:
+            os.close(directory_fd)
+        settings_file = settings_for(self.path)
+        if settings_file:
+            settings_file.invalidate()
+
+
+kraken_settings = SettingsFile(KRAKEN_SETTINGS_FILE, SETTINGS_STAT_INTERVAL_MS)
+geo_settings = SettingsFile(SETTINGS_FILE, SETTINGS_STAT_INTERVAL_MS)
+
+
+def settings_for(path: str) -> Optional[SettingsFile]:
+    return {KRAKEN_SETTINGS_FILE: kraken_settings, SETTINGS_FILE: geo_settings}.get(path)
+
+
+_writers: dict[str, SettingsWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def writer_for(path: str) -> SettingsWriter:
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = SettingsWriter(path, SETTINGS_WRITE_DEBOUNCE_MS, SETTINGS_FSYNC)
+        return writer
@@ -0,0 +1,167 @@
+import bisect
+import threading
+from typing import Callable, Optional
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple, *extra: str) -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+    def render(self, extra: str = '') -> list[str]:
+        """Renders the series, with the extra formatted labels added to every one of them"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {} if labels else {(): 0}
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self, extra: str = '') -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f'{self.name}{format_labels(self.labels, key, extra)} {format_value(value)}'
+                                for key, value in values.items()]
+
+
+class Gauge(Metric):
+    """A gauge that is either set explicitly or read from a callback at scrape time"""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Optional[Callable] = None):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self._value = 0
+
+    def set(self, value: float):
+        self._value = value
+
+    def render(self, extra: str = '') -> list[str]:
+        value = self.callback() if self.callback else self._value
+        labels = format_labels((), (), extra)
+        return self.header() + ([f'{self.name}{labels} {format_value(value)}'] if value is not None else [])
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = LATENCY_BUCKETS, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Counts per bucket (the last one is +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self, extra: str = '') -> list[str]:
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        lines = self.header()
+        for key, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                labels = format_labels(self.labels, key, extra, f'le="{le}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key, extra)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key, extra)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+        # Labels added to every series, such as the worker process the metrics come from
+        self.labels: dict[str, str] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        extra = format_labels(tuple(self.labels), tuple(self.labels.values()))[1:-1]
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(extra))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+# DOA ingestion runs in the main process only, which serves these to the workers when there are several of them
+ingestion_registry = Registry()
+
+update_cache_seconds = ingestion_registry.register(Histogram(
+    'geo_proxy_update_cache_duration_seconds', 'Duration of update_cache runs'))
+doa_lines_read = ingestion_registry.register(Counter(
+    'geo_proxy_doa_lines_read_total', 'Lines read from the DOA file'))
+doa_lines_parsed = ingestion_registry.register(Counter(
+    'geo_proxy_doa_lines_parsed_total', 'DOA lines parsed into records'))
+doa_lines_rejected = ingestion_registry.register(Counter(
+    'geo_proxy_doa_lines_rejected_total', 'Malformed DOA lines'))
+doa_records_outdated = ingestion_registry.register(Counter(
+    'geo_proxy_doa_records_outdated_total', 'Parsed records that were already older than the cache window'))
+doa_records_added = ingestion_registry.register(Counter(
+    'geo_proxy_doa_records_added_total', 'Records added to the cache'))
+doa_records_expired = ingestion_registry.register(Counter(
+    'geo_proxy_doa_records_expired_total', 'Records expired from the cache'))
+ingest_lag_seconds = ingestion_registry.register(Histogram(
+    'geo_proxy_ingest_lag_seconds', 'Time between the DOA file modification and its ingestion'))
+push_messages = ingestion_registry.register(Counter(
+    'geo_proxy_push_messages_total', 'Messages received from the Kraken push WebSocket'))
+push_reconnects = ingestion_registry.register(Counter(
+    'geo_proxy_push_reconnects_total', 'Reconnections to the Kraken push WebSocket'))
+scheduler_missed_runs = ingestion_registry.register(Counter(
+    'geo_proxy_scheduler_missed_runs_total', 'Ingestion runs that were missed, started a poll interval late or took '
+    'longer than a poll interval'))
+response_cache_requests = registry.register(Counter(
+    'geo_proxy_response_cache_requests_total', '/cache bodies served from the response cache (hit), computed (miss) '
+    'or shared with an identical request in progress (shared)', labels=('outcome',)))
+http_request_seconds = registry.register(Histogram(
+    'geo_proxy_http_request_duration_seconds', 'HTTP request handling time', labels=('endpoint', 'method', 'status')))
+http_response_bytes = registry.register(Histogram(
+    'geo_proxy_http_response_size_bytes', 'HTTP response body size before and after compression',
+    buckets=SIZE_BUCKETS, labels=('endpoint', 'stage')))
+aggregator_fetch_seconds = registry.register(Histogram(
+    'geo_proxy_aggregator_fetch_duration_seconds', 'Upstream station fetch time in the aggregator mode',
+    labels=('station', 'outcome')))
@@ -0,0 +1,402 @@
+import fcntl
+import json
+import os
+import queue
+import select
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from src.config import POWER_BACKEND, POWER_JOB_HISTORY, POWER_LOCK_FILE, POWER_JOBS_FILE
+from src.file_watcher import open_inotify, IN_CREATE, IN_DELETE, IN_MODIFY
+from src.system import KRAKEN_SERVICE, SYSTEMD_CGROUP_DIRS, KRAKEN_POWER_RELAY_PIN_BCM, GPIO, \
+    turn_kraken_sdr_relay_on, turn_kraken_sdr_relay_off, start_kraken_service, stop_kraken_service, \
+    is_kraken_sdr_connected, is_kraken_service_running
+from src.utils import now
+
+SERVICE_STOP_TIMEOUT_S = 10
+SDR_DISCONNECT_TIMEOUT_S = 10
+SDR_CONNECT_TIMEOUT_S = 15
+SERVICE_START_TIMEOUT_S = 15
+SETTLE_S = 0.2
+# State is re-checked this often even without events, in case one was missed
+FALLBACK_CHECK_S = 1.0
+# Jobs of other processes are only seen through the jobs file, which is re-read this often by waiters
+JOBS_FILE_POLL_S = 0.5
+NETLINK_KOBJECT_UEVENT = 15
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class StateEvents:
+    """
+    Descriptors that become readable when the SDR or the Kraken service may have changed state: kernel uevents for
+    USB devices coming and going, and inotify on the systemd cgroups of the service
+    """
+
+    def __init__(self):
+        self._uevents = None
+        self._inotify = None
+        try:
+            self._uevents = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            self._uevents.bind((0, 1))
+            self._uevents.setblocking(False)
+        except (OSError, AttributeError):
+            self.close()
+        service_dirs = [os.path.join(directory, KRAKEN_SERVICE) for directory in SYSTEMD_CGROUP_DIRS]
+        try:
+            self._inotify = open_inotify(list(SYSTEMD_CGROUP_DIRS) + service_dirs +
+                                         [os.path.join(directory, 'cgroup.events') for directory in service_dirs],
+                                         IN_CREATE | IN_DELETE | IN_MODIFY)
+        except OSError:
+            self._inotify = None
+
+    def wait(self, timeout_s: float):
+        fds = [fd for fd in (self._uevents.fileno() if self._uevents else None, self._inotify) if fd is not None]
+        if not fds:
+            time.sleep(timeout_s)
+            return
+        ready, _, _ = select.select(fds, [], [], timeout_s)
+        for fd in ready:
+            try:
+                while os.read(fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self._uevents is not None:
+            self._uevents.close()
+            self._uevents = None
+        if self._inotify is not None:
+            os.close(self._inotify)
+            self._inotify = None
+
+
+class SystemPowerBackend:
+    """The SDR power relay on GPIO and the Kraken systemd service. State changes are waited for on StateEvents."""
+
+    def set_relay(self, on: bool):
+        if GPIO is None:
+            raise RuntimeError(f'RPi.GPIO is not available, cannot switch the relay (bcm pin '
+                               f'{KRAKEN_POWER_RELAY_PIN_BCM})')
+        if on:
+            turn_kraken_sdr_relay_on()
+        else:
+            turn_kraken_sdr_relay_off()
+
+    def start_service(self):
+        start_kraken_service()
+
+    def stop_service(self):
+        stop_kraken_service()
+
+    def sdr_connected(self) -> bool:
+        return is_kraken_sdr_connected()
+
+    def service_running(self) -> bool:
+        return is_kraken_service_running()
+
+    def wait_until(self, condition: Callable[[], bool], timeout_s: float) -> bool:
+        deadline = time.monotonic() + timeout_s
+        events = StateEvents()
+        try:
+            while not condition():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                events.wait(min(remaining, FALLBACK_CHECK_S))
+            return True
+        finally:
+            events.close()
+
+
+class FakePowerBackend:
+    """
+    Simulated relay and service, for development and tests without the hardware. The SDR follows the relay and the
+    service follows start and stop after the given delays. The service only starts with the SDR connected.
+    """
+
+    def __init__(self, device_delay_s: float = 1.0, service_delay_s: float = 1.0):
+        self.device_delay_s = device_delay_s
+        self.service_delay_s = service_delay_s
+        self.relay = True
+        self.connected = True
+        self.running = True
+        self._changed = threading.Condition()
+
+    def _later(self, delay_s: float, apply: Callable):
+        def run():
+            with self._changed:
+                apply()
+                self._changed.notify_all()
+        threading.Timer(delay_s, run).start()
+
+    def set_relay(self, on: bool):
+        self.relay = on
+        self._later(self.device_delay_s, lambda: setattr(self, 'connected', self.relay))
+
+    def start_service(self):
+        self._later(self.service_delay_s, lambda: setattr(self, 'running', self.connected))
+
+    def stop_service(self):
+        self._later(self.service_delay_s, lambda: setattr(self, 'running', False))
+
+    def sdr_connected(self) -> bool:
+        return self.connected
+
+    def service_running(self) -> bool:
+        return self.running
+
+    def wait_until(self, condition: Callable[[], bool], timeout_s: float) -> bool:
+        with self._changed:
+            return self._changed.wait_for(condition, timeout_s)
+
+
+def process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PowerJob:
+    def __init__(self, power_on: bool, steps_total: int):
+        self.id = uuid.uuid4().hex[0:12]
+        # The process running the job
+        self.pid = os.getpid()
+        self.power_on = power_on
+        self.state = QUEUED
+        self.step: Optional[str] = None
+        self.steps_done = 0
+        self.steps_total = steps_total
+        self.error: Optional[str] = None
+        self.created_at = now()
+        self.started_at: Optional[int] = None
+        self.finished_at: Optional[int] = None
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'PowerJob':
+        """A job as published to the jobs file, by this process or another one"""
+        job = cls(data['power_on'], data['steps_total'])
+        for key, value in data.items():
+            setattr(job, key, value)
+        return job
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (SUCCEEDED, FAILED)
+
+    def to_json(self) -> dict:
+        return {
+            'id': self.id,
+            'pid': self.pid,
+            'power_on': self.power_on,
+            'state': self.state,
+            'step': self.step,
+            'steps_done': self.steps_done,
+            'steps_total': self.steps_total,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class PowerJobs:
+    """
+    Runs SDR power transitions as background jobs, one at a time, in submission order. Processes serving the same
+    station are serialized by a lock file as well. Submitting the same transition as the latest pending job of any
+    process of the station returns that job instead of queueing another one. Keeps the last history_size jobs for
+    polling, and publishes them to jobs_file so that every process of the station can report on them.
+    """
+
+    def __init__(self, backend, history_size: int, lock_file: str, jobs_file: str, logger=None):
+        self.backend = backend
+        self.history_size = history_size
+        self.lock_file = lock_file
+        self.jobs_file = jobs_file
+        self.logger = logger
+        self.on_finished: Optional[Callable[[PowerJob], None]] = None
+        self._jobs: OrderedDict[str, PowerJob] = OrderedDict()
+        self._queue: queue.Queue = queue.Queue()
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def _steps(self, power_on: bool) -> list[tuple[str, Callable]]:
+        backend = self.backend
+        if power_on:
+            return [
+                ('Turning the SDR relay on', lambda: backend.set_relay(True)),
+                ('Waiting for the SDR to connect',
+                 lambda: self._wait(backend.sdr_connected, SDR_CONNECT_TIMEOUT_S, 'Kraken SDR have not connected in time')),
+                ('Starting the Kraken service', lambda: (time.sleep(SETTLE_S), backend.start_service())),
+                ('Waiting for the Kraken service to start',
+                 lambda: self._wait(backend.service_running, SERVICE_START_TIMEOUT_S,
+                                    'Kraken service have not started in time'))
+            ]
+        return [
+            ('Stopping the Kraken service', backend.stop_service),
+            ('Waiting for the Kraken service to stop',
+             lambda: self._wait(lambda: not backend.service_running(), SERVICE_STOP_TIMEOUT_S,
+                                'Kraken service have not stopped in time')),
+            ('Turning the SDR relay off', lambda: (time.sleep(SETTLE_S), backend.set_relay(False))),
+            ('Waiting for the SDR to disconnect',
+             lambda: self._wait(lambda: not backend.sdr_connected(), SDR_DISCONNECT_TIMEOUT_S,
+                                f'Kraken SDR have not disconnected in time. Is the on/off relay connected correctly '
+                                f'(bcm pin {KRAKEN_POWER_RELAY_PIN_BCM})?'))
+        ]
+
+    def _wait(self, condition: Callable[[], bool], timeout_s: float, message: str):
+        if not self.backend.wait_until(condition, timeout_s):
+            raise TimeoutError(message)
+
+    def _update(self, job: PowerJob, **changes):
+        with self._changed:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            self._publish()
+            self._changed.notify_all()
+
+    @contextmanager
+    def _jobs_file_lock(self):
+        """Serializes the changes of the jobs file between processes"""
+        with open(self.lock_file + '.jobs', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _all_jobs(self) -> list[dict]:
+        """The jobs of the jobs file, updated with the local ones, oldest first"""
+        jobs = {job['id']: job for job in self._read_jobs_file()}
+        for job in self._jobs.values():
+            jobs[job.id] = job.to_json()
+        return sorted(jobs.values(), key=lambda job: job['created_at'])
+
+    def _publish(self):
+        """Merges the local jobs into the jobs file, which is replaced atomically"""
+        with self._jobs_file_lock():
+            self._write_jobs_file(self._all_jobs()[-self.history_size:])
+
+    def _write_jobs_file(self, jobs: list[dict]):
+        temp_file = f'{self.jobs_file}.{os.getpid()}.tmp'
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(jobs, f)
+            os.replace(temp_file, self.jobs_file)
+        except OSError:
+            if self.logger:
+                self.logger.warning(f'Cannot write {self.jobs_file}')
+
+    def _read_jobs_file(self) -> list[dict]:
+        """Reads the jobs of all processes. Unfinished jobs of processes that exited are reported as failed."""
+        try:
+            with open(self.jobs_file) as f:
+                jobs = json.load(f)
+        except (OSError, ValueError):
+            return []
+        for job in jobs:
+            if job['state'] not in (SUCCEEDED, FAILED) and job['id'] not in self._jobs \
+                    and not process_exists(job.get('pid', 0)):
+                job.update(state=FAILED, error='The process running the job exited', finished_at=job['created_at'])
+        return jobs
+
+    def recover(self):
+        """
+        Marks the unfinished jobs left in the jobs file as failed. Called when the station starts, before any process
+        could have submitted a job, as a new process may have the PID of one that ran a job before a restart.
+        """
+        with self._jobs_file_lock():
+            jobs = self._read_jobs_file()
+            abandoned = [job for job in jobs if job['state'] not in (SUCCEEDED, FAILED)]
+            if not abandoned:
+                return
+            for job in abandoned:
+                job.update(state=FAILED, error='The proxy restarted before the job finished',
+                           finished_at=job['created_at'])
+            self._write_jobs_file(jobs)
+
+    def submit(self, power_on: bool) -> PowerJob:
+        with self._changed, self._jobs_file_lock():
+            # Holding the lock, no other process can queue a job between this check and the publication of the new one
+            jobs = self._all_jobs()
+            latest = jobs[-1] if jobs else None
+            if latest is not None and latest['state'] not in (SUCCEEDED, FAILED) and latest['power_on'] == power_on:
+                return self._jobs.get(latest['id']) or PowerJob.from_json(latest)
+            job = PowerJob(power_on, len(self._steps(power_on)))
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history_size and next(iter(self._jobs.values())).finished:
+                self._jobs.popitem(last=False)
+            self._write_jobs_file(self._all_jobs()[-self.history_size:])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='power-jobs', daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns the JSON of a job of any process of the station, if it is still known"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_json()
+        return next((job for job in self._read_jobs_file() if job['id'] == job_id), None)
+
+    def jobs(self) -> list[dict]:
+        """Returns the JSON of the recent jobs of all processes of the station, oldest first"""
+        with self._changed:
+            jobs = {job['id']: job for job in self._read_jobs_file()}
+            jobs.update((job.id, job.to_json()) for job in self._jobs.values())
+        return sorted(jobs.values(), key=lambda job: job['created_at'])
+
+    def wait(self, job_id: str, current: Optional[dict], timeout_s: float) -> Optional[dict]:
+        """Waits until the job differs from current, or the timeout. Returns the job as get does."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            deadline = time.monotonic() + timeout_s
+            while (latest := self.get(job_id)) == current and time.monotonic() < deadline:
+                time.sleep(min(JOBS_FILE_POLL_S, max(deadline - time.monotonic(), 0)))
+            return latest
+        with self._changed:
+            self._changed.wait_for(lambda: job.to_json() != current, timeout_s)
+            return job.to_json()
+
+    def _execute(self, job: PowerJob):
+        with open(self.lock_file, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._update(job, state=RUNNING, started_at=now())
+            for i, (step, run) in enumerate(self._steps(job.power_on)):
+                self._update(job, step=step, steps_done=i)
+                run()
+            self._update(job, state=SUCCEEDED, step=None, steps_done=job.steps_total, finished_at=now())
+
+    def run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._execute(job)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(traceback.format_exc())
+                self._update(job, state=FAILED, error=str(e) or type(e).__name__, finished_at=now())
+            if self.logger:
+                self.logger.info(f'Power {"on" if job.power_on else "off"} job {job.id} {job.state}')
+            if self.on_finished:
+                try:
+                    self.on_finished(job)
+                except:
+                    if self.logger:
+                        self.logger.error(traceback.format_exc())
+
+
+power_jobs = PowerJobs(FakePowerBackend() if POWER_BACKEND == 'fake' else SystemPowerBackend(), POWER_JOB_HISTORY,
+                       POWER_LOCK_FILE, POWER_JOBS_FILE)
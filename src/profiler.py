@@ -0,0 +1,65 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+def sample_stacks(duration_s: float, interval_s: float) -> tuple[Counter, int]:
+    """
+    Samples the stacks of all threads but the calling one every interval_s for duration_s.
+    Returns the number of times every collapsed stack (thread name;outermost frame;...;innermost frame) was seen and
+    the number of samples taken.
+    """
+    stacks = Counter()
+    samples = 0
+    own_id = threading.get_ident()
+    deadline = time.monotonic() + duration_s
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, str(thread_id)))
+            stacks[';'.join(reversed(labels))] += 1
+        samples += 1
+        time.sleep(interval_s)
+    return stacks, samples
+
+
+def collapsed(stacks: Counter) -> str:
+    """Formats stacks for flamegraph.pl, speedscope and the like, most frequent first"""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+class PhaseTimer:
+    """Times the phases of a request, for a Server-Timing header"""
+
+    def __init__(self):
+        self.phases: list[tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, (time.perf_counter() - started_at) * 1000))
+
+    def server_timing(self) -> str:
+        return ', '.join(f'{name};dur={duration_ms:.3f}' for name, duration_ms in self.phases)
+
+
+def phase(timer, name: str):
+    """Times a phase when a timer is given, does nothing otherwise"""
+    return timer.phase(name) if timer is not None else nullcontext()
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from src import metrics
+
+
+class Flight:
+    """A computation in progress that identical requests wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Bounded LRU of encoded response bodies for one generation of the DOA cache.
+    Entries are dropped as soon as a request sees a newer generation. Identical requests that arrive while a body is
+    being computed wait for that computation instead of repeating it.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.generation = None
+        self._entries: OrderedDict = OrderedDict()
+        self._flights: dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, generation: int, key: Hashable, compute: Callable):
+        if self.max_entries <= 0:
+            return compute()
+
+        with self._lock:
+            if generation != self.generation:
+                self.generation = generation
+                self._entries.clear()
+            key = (generation, key)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                metrics.response_cache_requests.inc(1, 'hit')
+                return self._entries[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            metrics.response_cache_requests.inc(1, 'shared')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        metrics.response_cache_requests.inc(1, 'miss')
+        try:
+            flight.value = compute()
+            with self._lock:
+                if self.generation == generation:
+                    self._entries[key] = flight.value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -0,0 +1,178 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Optional
+
+from src.doa_cache import DoaCache
+
+MAGIC = b'GPS1'
+LAYOUT_VERSION = 1
+# magic, layout version, then int64 capacity, sequence, head, size, generation, updated_at
+HEADER = struct.Struct('<4sIqqqqqq')
+HEADER_SIZE = 64
+CAPACITY, SEQUENCE, HEAD, SIZE, GENERATION, UPDATED_AT = range(6)
+ARRANGEMENT_SIZE = 8
+NUMERIC_COLUMNS = (('_timestamps', 'q'), ('_doas', 'd'), ('_confidences', 'd'), ('_rssis', 'd'),
+                   ('_frequencies', 'q'), ('_sequences', 'q'))
+# Lock-free read attempts before a reader waits for the writer to finish instead
+READ_ATTEMPTS = 100
+
+
+def segment_size(capacity: int) -> int:
+    return HEADER_SIZE + capacity * (8 * len(NUMERIC_COLUMNS) + ARRANGEMENT_SIZE)
+
+
+class FixedStringColumn:
+    """Column of short strings stored as fixed-size, zero-padded slots"""
+
+    def __init__(self, buffer: memoryview, size: int):
+        self._buffer = buffer
+        self._size = size
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        value = bytes(self._buffer[i * self._size:(i + 1) * self._size]).rstrip(b'\0')
+        return value.decode() if value else None
+
+    def __setitem__(self, i: int, value: Optional[str]):
+        encoded = (value or '').encode()[0:self._size]
+        self._buffer[i * self._size:(i + 1) * self._size] = encoded.ljust(self._size, b'\0')
+
+
+_fence_lock = threading.Lock()
+
+
+def memory_fence():
+    """
+    Keeps the memory accesses before the call ahead of the ones after it, also on weakly ordered CPUs such as ARM.
+    Python has no fence of its own. A lock release (store-release) keeps earlier accesses before it and the next
+    acquire (load-acquire) keeps later ones after it, so two release-acquire steps make a full fence.
+    """
+    _fence_lock.acquire()
+    _fence_lock.release()
+    _fence_lock.acquire()
+    _fence_lock.release()
+
+
+class SeqLock:
+    """
+    Writer side of a sequence lock: the sequence is odd while the segment is being changed. Reads of the writer
+    process take mutex alone, they do not change the segment and must not make the readers retry.
+    Changes also hold an exclusive flock of the segment file, which readers that keep seeing changes wait on.
+    """
+
+    def __init__(self, header: memoryview, fd: int):
+        self._header = header
+        self._fd = fd
+        self.mutex = threading.Lock()
+
+    def __enter__(self):
+        self.mutex.acquire()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._header[0] += 1
+        memory_fence()
+
+    def __exit__(self, *args):
+        memory_fence()
+        self._header[0] += 1
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.mutex.release()
+
+
+class SharedDoaCache(DoaCache):
+    """
+    DoaCache kept in a memory-mapped file with a fixed layout: a 64-byte header followed by one array per column.
+    A single ingesting process creates it and writes to it; any number of server processes open it read-only and
+    query it in place. Readers take no locks: they retry until the header sequence number is the same (and even)
+    before and after the read, which gives them a consistent snapshot. After READ_ATTEMPTS tries they take a shared
+    flock of the segment file, which waits for the change in progress.
+    """
+
+    def __init__(self, path: str, capacity: int, writer: bool):
+        self.path = path
+        self.capacity = capacity
+        self.writer = writer
+        size = segment_size(capacity)
+        # Kept open for the flock that readers fall back to
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT if writer else os.O_RDONLY, 0o644)
+        try:
+            if writer:
+                os.ftruncate(self._fd, size)
+            self._mmap = mmap.mmap(self._fd, size, access=mmap.ACCESS_WRITE if writer else mmap.ACCESS_READ)
+        except:
+            os.close(self._fd)
+            raise
+
+        view = memoryview(self._mmap)
+        self._header = view[8:HEADER.size].cast('q')
+        offset = HEADER_SIZE
+        for name, typecode in NUMERIC_COLUMNS:
+            setattr(self, name, view[offset:offset + 8 * capacity].cast(typecode))
+            offset += 8 * capacity
+        self._arrangements = FixedStringColumn(view[offset:offset + ARRANGEMENT_SIZE * capacity], ARRANGEMENT_SIZE)
+
+        # Only the writer partitions the records by frequency, readers filter frequencies by scanning
+        self._appended = 0
+        self._partitions = {} if writer else None
+        if writer:
+            HEADER.pack_into(self._mmap, 0, MAGIC, LAYOUT_VERSION, capacity, 0, 0, 0, time.time_ns() // 1000, 0)
+            self._lock = SeqLock(self._header[SEQUENCE:SEQUENCE + 1], self._fd)
+        else:
+            # flock belongs to the open file, so the threads of a reader take turns at holding it
+            self._fallback_lock = threading.Lock()
+            magic, version, stored_capacity = HEADER.unpack_from(self._mmap, 0)[0:3]
+            if magic != MAGIC or version != LAYOUT_VERSION or stored_capacity != capacity:
+                raise ValueError(f'{path} is not a compatible shared cache segment')
+
+    @classmethod
+    def create(cls, path: str, capacity: int) -> 'SharedDoaCache':
+        return cls(path, capacity, writer=True)
+
+    @classmethod
+    def open(cls, path: str) -> 'SharedDoaCache':
+        with open(path, 'rb') as f:
+            capacity = HEADER.unpack(f.read(HEADER.size))[2]
+        return cls(path, capacity, writer=False)
+
+    def _header_field(index: int):
+        return property(lambda self: self._header[index],
+                        lambda self, value: self._header.__setitem__(index, value))
+
+    _sequence = _header_field(SEQUENCE)
+    _head = _header_field(HEAD)
+    _size = _header_field(SIZE)
+    generation = _header_field(GENERATION)
+    updated_at = _header_field(UPDATED_AT)
+    del _header_field
+
+    def __len__(self) -> int:
+        return self._read(lambda: self._size)
+
+    def _read(self, fn, *args):
+        if self.writer:
+            with self._lock.mutex:
+                return fn(*args)
+
+        for _ in range(READ_ATTEMPTS):
+            before = self._sequence
+            if before % 2 == 0:
+                memory_fence()
+                try:
+                    result = fn(*args)
+                    memory_fence()
+                    if self._sequence == before:
+                        return result
+                except (IndexError, ValueError, UnicodeDecodeError):
+                    # A torn read of the head or size, retry
+                    pass
+            time.sleep(0)
+
+        # The writer keeps changing the segment, wait until it is done with the current change and read meanwhile
+        with self._fallback_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                return fn(*args)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
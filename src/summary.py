@@ -0,0 +1,160 @@
+import math
+from array import array
+from typing import Optional
+
+from src.config import NUMPY_MIN_BATCH
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+WEIGHTINGS = ('count', 'confidence', 'rssi', 'confidence_rssi')
+
+
+def circular_mean(sin_sum: float, cos_sum: float, weight_sum: float) -> dict:
+    """Mean bearing, mean resultant length (1 when all bearings agree) and circular standard deviation in degrees"""
+    if weight_sum <= 0:
+        return {'doa': None, 'r': None, 'std': None}
+    r = min(1.0, math.hypot(sin_sum, cos_sum) / weight_sum)
+    return {
+        'doa': round(math.degrees(math.atan2(sin_sum, cos_sum)) % 360, 3),
+        'r': round(r, 4),
+        'std': round(math.degrees(math.sqrt(-2 * math.log(r))), 3) if r > 0 else None
+    }
+
+
+def weight(weighting: str, confidence: float, rssi: float) -> float:
+    if weighting == 'count':
+        return 1.0
+    if weighting == 'confidence':
+        return max(confidence, 0.0)
+    # RSSI is in dB, weigh by the linear power
+    if weighting == 'rssi':
+        return 10 ** (rssi / 10)
+    return max(confidence, 0.0) * 10 ** (rssi / 10)
+
+
+def summarize(columns: dict[str, array], bin_width: float, weighting: str, confidence: Optional[float] = None,
+              rssi: Optional[float] = None, bucket_ms: Optional[int] = None, max_points: Optional[int] = None) -> dict:
+    """
+    Summarizes the bearings of the cache columns (see DoaCache.columns) that pass the confidence and RSSI filters:
+    a weighted circular mean, a bearing histogram with bin_width degree bins and, optionally, the circular mean of
+    every bucket_ms time bucket and at most max_points records, keeping the heaviest (or most confident) record of
+    every stretch. Buckets and points are oldest first.
+    """
+    if np is not None and len(columns['timestamps']) >= NUMPY_MIN_BATCH:
+        return _summarize_numpy(columns, bin_width, weighting, confidence, rssi, bucket_ms, max_points)
+    return _summarize_python(columns, bin_width, weighting, confidence, rssi, bucket_ms, max_points)
+
+
+def _summarize_numpy(columns: dict[str, array], bin_width: float, weighting: str, confidence: Optional[float],
+                     rssi: Optional[float], bucket_ms: Optional[int], max_points: Optional[int]) -> dict:
+    timestamps = np.frombuffer(columns['timestamps'], dtype=np.int64)
+    doas = np.frombuffer(columns['doas'], dtype=np.float64)
+    confidences = np.frombuffer(columns['confidences'], dtype=np.float64)
+    rssis = np.frombuffer(columns['rssis'], dtype=np.float64)
+    frequencies = np.frombuffer(columns['frequencies'], dtype=np.int64)
+
+    mask = np.ones(len(timestamps), dtype=bool)
+    if confidence is not None:
+        mask &= confidences >= confidence
+    if rssi is not None:
+        mask &= rssis >= rssi
+    if not mask.all():
+        timestamps, doas, confidences = timestamps[mask], doas[mask], confidences[mask]
+        rssis, frequencies = rssis[mask], frequencies[mask]
+
+    if weighting == 'count':
+        weights = np.ones(len(doas))
+    elif weighting == 'confidence':
+        weights = np.maximum(confidences, 0.0)
+    elif weighting == 'rssi':
+        weights = np.power(10.0, rssis / 10)
+    else:
+        weights = np.maximum(confidences, 0.0) * np.power(10.0, rssis / 10)
+    radians = np.deg2rad(doas)
+    sines = np.sin(radians) * weights
+    cosines = np.cos(radians) * weights
+
+    bins = math.ceil(360 / bin_width)
+    histogram = np.bincount(np.minimum((doas // bin_width).astype(np.int64), bins - 1),
+                            weights=None if weighting == 'count' else weights, minlength=bins)
+    result = {
+        'count': len(doas),
+        'mean': circular_mean(float(sines.sum()), float(cosines.sum()), float(weights.sum())),
+        'histogram': histogram.tolist() if weighting == 'count' else np.round(histogram, 6).tolist()
+    }
+
+    if bucket_ms:
+        keys, inverse = np.unique(timestamps // bucket_ms, return_inverse=True)
+        counts = np.bincount(inverse)
+        bucket_sines = np.bincount(inverse, weights=sines)
+        bucket_cosines = np.bincount(inverse, weights=cosines)
+        bucket_weights = np.bincount(inverse, weights=weights)
+        result['buckets'] = []
+        for i, key in enumerate(keys.tolist()):
+            mean = circular_mean(float(bucket_sines[i]), float(bucket_cosines[i]), float(bucket_weights[i]))
+            result['buckets'].append([key * bucket_ms, int(counts[i]), mean['doa'], mean['r']])
+
+    if max_points:
+        selected = np.arange(len(doas))
+        if len(doas) > max_points:
+            groups = selected * max_points // len(doas)
+            peaks = confidences if weighting == 'count' else weights
+            order = np.lexsort((-peaks, groups))
+            firsts = np.concatenate(([0], np.flatnonzero(np.diff(groups[order])) + 1))
+            selected = np.sort(order[firsts])
+        result['points'] = np.stack([timestamps[selected], doas[selected], confidences[selected], rssis[selected],
+                                     frequencies[selected]], axis=1).tolist()
+        for point in result['points']:
+            point[0], point[4] = int(point[0]), int(point[4])
+    return result
+
+
+def _summarize_python(columns: dict[str, array], bin_width: float, weighting: str, confidence: Optional[float],
+                      rssi: Optional[float], bucket_ms: Optional[int], max_points: Optional[int]) -> dict:
+    rows = [row for row in zip(columns['timestamps'], columns['doas'], columns['confidences'], columns['rssis'],
+                               columns['frequencies'])
+            if (confidence is None or row[2] >= confidence) and (rssi is None or row[3] >= rssi)]
+    weights = [weight(weighting, row[2], row[3]) for row in rows]
+    radians = [math.radians(row[1]) for row in rows]
+    sines = [math.sin(angle) * w for angle, w in zip(radians, weights)]
+    cosines = [math.cos(angle) * w for angle, w in zip(radians, weights)]
+
+    bins = math.ceil(360 / bin_width)
+    histogram = [0] * bins if weighting == 'count' else [0.0] * bins
+    for row, w in zip(rows, weights):
+        histogram[min(int(row[1] // bin_width), bins - 1)] += 1 if weighting == 'count' else w
+    result = {
+        'count': len(rows),
+        'mean': circular_mean(sum(sines), sum(cosines), sum(weights)),
+        'histogram': histogram if weighting == 'count' else [round(value, 6) for value in histogram]
+    }
+
+    if bucket_ms:
+        buckets: dict[int, list] = {}
+        for row, w, s, c in zip(rows, weights, sines, cosines):
+            bucket = buckets.setdefault(row[0] // bucket_ms, [0, 0.0, 0.0, 0.0])
+            bucket[0] += 1
+            bucket[1] += s
+            bucket[2] += c
+            bucket[3] += w
+        result['buckets'] = []
+        for key in sorted(buckets):
+            count, s, c, w = buckets[key]
+            mean = circular_mean(s, c, w)
+            result['buckets'].append([key * bucket_ms, count, mean['doa'], mean['r']])
+
+    if max_points:
+        selected = range(len(rows))
+        if len(rows) > max_points:
+            peaks = [row[2] for row in rows] if weighting == 'count' else weights
+            best: dict[int, int] = {}
+            for i in range(len(rows)):
+                group = i * max_points // len(rows)
+                if group not in best or peaks[i] > peaks[best[group]]:
+                    best[group] = i
+            selected = sorted(best.values())
+        result['points'] = [list(rows[i]) for i in selected]
+    return result
@@ -5,50 +5,20 @@ except (RuntimeError, ModuleNotFoundError):
 
 import os
 import re
-import time
+from typing import Optional
 
 KRAKEN_POWER_RELAY_PIN_BCM = 27
+KRAKEN_SERVICE = 'krakensdr.service'
+RTL2838_USB_ID = ('0bda', '2838')
+USB_DEVICES_DIR = '/sys/bus/usb/devices'
+SYSTEMD_CGROUP_DIRS = ('/sys/fs/cgroup/system.slice', '/sys/fs/cgroup/systemd/system.slice')
+CPU_TEMPERATURE_FILE = '/sys/class/thermal/thermal_zone0/temp'
 
 
 def is_in_docker():
     return os.environ.get('IS_IN_DOCKER', False)
 
 
-def kraken_sdr_power_off():
-    timeout = 10
-    start = time.time()
-    stop_kraken_service()
-    while is_kraken_service_running():
-        if time.time() - start > timeout:
-            raise Exception('Kraken service have not stopped in time')
-        time.sleep(0.1)
-    time.sleep(0.2)
-    start = time.time()
-    turn_kraken_sdr_relay_off()
-    while is_kraken_sdr_connected():
-        if time.time() - start > timeout:
-            raise Exception(f'Kraken SDR have not disconnected in time. Is the on/off relay connected correctly '
-                            f'(bcm pin {KRAKEN_POWER_RELAY_PIN_BCM})?')
-        time.sleep(0.1)
-
-
-def kraken_sdr_power_on():
-    timeout = 15
-    start = time.time()
-    turn_kraken_sdr_relay_on()
-    while not is_kraken_sdr_connected():
-        if time.time() - start > timeout:
-            raise Exception('Kraken SDR have not connected in time')
-        time.sleep(0.1)
-    time.sleep(0.2)
-    start = time.time()
-    start_kraken_service()
-    while not is_kraken_service_running():
-        if time.time() - start > timeout:
-            raise Exception('Kraken service have not started in time')
-        time.sleep(0.1)
-
-
 def turn_kraken_sdr_relay_off():
     GPIO.cleanup()
     GPIO.setmode(GPIO.BCM)
@@ -63,7 +33,23 @@ def turn_kraken_sdr_relay_on():
     GPIO.output(KRAKEN_POWER_RELAY_PIN_BCM, GPIO.HIGH)
 
 
+def read_sys_file(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
 def is_kraken_sdr_connected() -> bool:
+    if os.path.isdir(USB_DEVICES_DIR):
+        for device in os.listdir(USB_DEVICES_DIR):
+            device_dir = os.path.join(USB_DEVICES_DIR, device)
+            vendor = read_sys_file(os.path.join(device_dir, 'idVendor'))
+            if vendor == RTL2838_USB_ID[0] and read_sys_file(os.path.join(device_dir, 'idProduct')) == RTL2838_USB_ID[1]:
+                return True
+        return False
+
     cmd_lines = os.popen("lsusb")
     for line in cmd_lines:
         if re.match(r'^.+RTL2838.+$', line):
@@ -72,7 +58,12 @@ def is_kraken_sdr_connected() -> bool:
 
 
 def is_kraken_service_running() -> bool:
-    cmd_lines = os.popen("sudo systemctl is-active krakensdr.service")
+    # A running systemd service has a non-empty cgroup, which can be checked without forking systemctl
+    for cgroup_dir in SYSTEMD_CGROUP_DIRS:
+        if os.path.isdir(cgroup_dir):
+            return bool(read_sys_file(os.path.join(cgroup_dir, KRAKEN_SERVICE, 'cgroup.procs')))
+
+    cmd_lines = os.popen(f"sudo systemctl is-active {KRAKEN_SERVICE}")
     for line in cmd_lines:
         if line.strip() == 'active':
             return True
@@ -80,11 +71,11 @@ def is_kraken_service_running() -> bool:
 
 
 def start_kraken_service():
-    os.popen("sudo systemctl start krakensdr.service")
+    os.popen(f"sudo systemctl start {KRAKEN_SERVICE}")
 
 
 def stop_kraken_service():
-    os.popen("sudo systemctl stop krakensdr.service")
+    os.popen(f"sudo systemctl stop {KRAKEN_SERVICE}")
 
 
 def system_reboot():
@@ -92,8 +83,7 @@ def system_reboot():
 
 
 def get_cpu_temperature():
-    cmd_lines = os.popen("cat /sys/class/thermal/thermal_zone0/temp")
-    for line in cmd_lines:
-        if line.strip().isnumeric():
-            return round(float(line.strip()) / 1000, 1)
+    value = read_sys_file(CPU_TEMPERATURE_FILE)
+    if value and value.isnumeric():
+        return round(float(value) / 1000, 1)
     return None
@@ -5,6 +5,7 @@ import time
 from typing import Optional
 
 from src.config import DOA_FILE, KRAKEN_SETTINGS_FILE, WEB_UI_FILE_NEW, WEB_UI_FILE_OLD, WEB_UI_VARIABLES_FILE
+from src.kraken_settings import settings_for, writer_for
 
 config_cache = dict()
 
@@ -27,14 +28,7 @@ def is_valid_angle(angle: float) -> bool:
 
 
 def update_config(path: str, data: dict):
-    settings = {}
-    if os.path.exists(path):
-        with open(path) as file:
-            settings = json.loads(file.read())
-    for key in data:
-        settings[key] = data[key]
-    with open(path, 'w') as file:
-        file.write(json.dumps(settings, indent=2))
+    writer_for(path).update(data)
 
 
 def read_config(path: str):
@@ -55,6 +49,9 @@ def get_config_value(path: str, key: str):
 
 
 def get_cached_config_value(path: str, key: str, ttl_ms=1000):
+    if settings_for(path):
+        return settings_for(path).get(key)
+
     value, set_at = 0, 1
     now = int(time.time() * 1000)
     if (path, key) in config_cache and abs(now - config_cache[(path, key)][set_at]) < ttl_ms:
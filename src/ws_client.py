@@ -1,37 +1,105 @@
+import json
 import threading
+import time
+import traceback
+from typing import Callable
 
 import websocket
 
-WEB_UI_WS_URL = 'ws://127.0.0.1:8080/_push'
-# WEB_UI_WS_URL = 'ws://100.96.1.2:8080/_push'
-RESTART_ATTEMPTS = 5
+from src import metrics
+from src.config import KRAKEN_PUSH_URL, PUSH_MIN_BACKOFF_MS, PUSH_MAX_BACKOFF_MS
+from src.doa_parser import MIN_FIELDS
 
 
-class ClientSocket:
-    def __init__(self, url):
-        self.ws = websocket.WebSocketApp(url, on_close=self.on_close)
-        self.restarts = 0
-        self.ws.run_forever()
+def is_doa_line(value: str) -> bool:
+    return value.count(', ') >= MIN_FIELDS - 1
 
-    def on_close(self, ws, close_status_code, close_msg):
-        if self.restarts <= RESTART_ATTEMPTS:
-            print('Connection closed, reinstating')
-            self.restarts += 1
-            self.ws.run_forever()
-        else:
-            print('Connection closed, restart attempts exceeded')
 
+def decode_doa_lines(message) -> list[str]:
+    """
+    Extracts DOA lines, in the DOA_value.html format, from a push message: either plain text lines or JSON with the
+    lines anywhere among its string values. Everything else the web interface pushes is ignored.
+    Kraken does not document what it pushes, so this is a guess that accepts any message carrying such lines. When the
+    feed carries none, the DOA file stays the source of the records.
+    """
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', errors='replace')
+    try:
+        decoded = json.loads(message)
+    except ValueError:
+        return [line for line in message.splitlines() if is_doa_line(line)]
 
-def run():
-    return ClientSocket(WEB_UI_WS_URL)
+    lines = []
+    stack = [decoded]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            lines.extend(line for line in value.splitlines() if is_doa_line(line))
+        elif isinstance(value, dict):
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+    return lines
 
 
-def run_in_thread():
-    thread = threading.Thread(target=run, args=())
-    thread.daemon = True
-    thread.start()
+class PushClient:
+    """
+    Consumes Kraken's _push WebSocket and passes the DOA lines it carries to on_lines.
+    Reconnects forever, waiting between attempts with an exponential backoff that is reset once a connection opens.
+    """
+
+    def __init__(self, url: str, on_lines: Callable[[list[str]], None], min_backoff_ms: int, max_backoff_ms: int,
+                 logger=None):
+        self.url = url
+        self.on_lines = on_lines
+        self.min_backoff_ms = min_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.logger = logger
+        self.connected = False
+        self._backoff_ms = min_backoff_ms
+
+    def on_open(self, ws):
+        self.connected = True
+        self._backoff_ms = self.min_backoff_ms
+        if self.logger:
+            self.logger.info(f'Connected to {self.url}')
+
+    def on_message(self, ws, message):
+        metrics.push_messages.inc()
+        try:
+            lines = decode_doa_lines(message)
+            if lines:
+                self.on_lines(lines)
+        except:
+            if self.logger:
+                self.logger.error(traceback.format_exc())
+
+    def on_error(self, ws, error):
+        if self.logger:
+            self.logger.debug(f'{self.url}: {error}')
+
+    def run(self):
+        while True:
+            ws = websocket.WebSocketApp(self.url, on_open=self.on_open, on_message=self.on_message,
+                                        on_error=self.on_error)
+            ws.run_forever()
+            if self.connected and self.logger:
+                self.logger.warning(f'Connection to {self.url} closed, reconnecting')
+            self.connected = False
+            metrics.push_reconnects.inc()
+            time.sleep(self._backoff_ms / 1000.0)
+            self._backoff_ms = min(self.max_backoff_ms, self._backoff_ms * 2)
+
+    def run_in_thread(self):
+        threading.Thread(target=self.run, name='push-client', daemon=True).start()
+
+
+def run_in_thread(on_lines: Callable[[list[str]], None], logger=None) -> PushClient:
+    client = PushClient(KRAKEN_PUSH_URL, on_lines, PUSH_MIN_BACKOFF_MS, PUSH_MAX_BACKOFF_MS, logger)
+    client.run_in_thread()
+    return client
 
 
 if __name__ == '__main__':
     print('Starting WS client')
-    ClientSocket(WEB_UI_WS_URL)
+    PushClient(KRAKEN_PUSH_URL, print, PUSH_MIN_BACKOFF_MS, PUSH_MAX_BACKOFF_MS).run()
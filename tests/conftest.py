@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+from benchmarks.synthetic import create_kraken_dir
+
+# The configuration is read at import time, so the stand-in Kraken directory has to exist before src is imported
+os.environ['DOA_PATH'] = tempfile.mkdtemp(prefix='geo-proxy-tests-')
+os.environ['HISTORY_ENABLED'] = 'false'
+os.environ['CAPTURE_FILE'] = ''
+create_kraken_dir(os.environ['DOA_PATH'])
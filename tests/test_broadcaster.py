@@ -0,0 +1,25 @@
+from src.broadcaster import Broadcaster
+from tests.test_doa_cache import record
+
+
+def test_skips_records_already_replayed():
+    broadcaster = Broadcaster(max_subscribers=1, queue_size=4, disconnect_slow=False)
+    subscription = broadcaster.subscribe()
+    broadcaster.publish([record(100), record(101)], [7, 8])
+    broadcaster.publish([record(102)], [9])
+    subscription.skip_through = 7
+    assert [r.timestamp for r in subscription.get(timeout=0)] == [101]
+    assert [r.timestamp for r in subscription.get(timeout=0)] == [102]
+    assert subscription.get(timeout=0) == []
+    assert broadcaster.subscribe() is None
+
+
+def test_reservations_share_the_subscriber_budget():
+    broadcaster = Broadcaster(max_subscribers=2, queue_size=4, disconnect_slow=False)
+    assert broadcaster.reserve()
+    subscription = broadcaster.subscribe()
+    assert subscription is not None
+    assert not broadcaster.reserve()
+    broadcaster.release()
+    assert broadcaster.subscribe() is not None
+    assert len(broadcaster) == 2
@@ -0,0 +1,44 @@
+from benchmarks import replay
+from benchmarks.replay import retime
+from src.capture import CaptureWriter, read_capture, read_header, DOA, SETTINGS
+
+
+def test_records_are_written_by_flush(tmp_path):
+    path = str(tmp_path / 'capture.jsonl.gz')
+    writer = CaptureWriter(path, flush_ms=1000)
+    settings = {'center_freq': 433.0, 'station_id': 'A'}
+    writer.record(['a', 'b'], settings, '1.7')
+    writer.record(['c'], settings, '1.7')
+    writer.record(['d'], {**settings, 'center_freq': 446.0}, '1.7')
+    assert not (tmp_path / 'capture.jsonl.gz').exists()
+
+    writer.flush()
+    assert read_header(path)['kraken_version'] == '1.7'
+    events = [(kind, value) for _, kind, value in read_capture(path)]
+    assert events == [(SETTINGS, settings), (DOA, ['a', 'b']), (DOA, ['c']), (SETTINGS, {'center_freq': 446.0}),
+                      (DOA, ['d'])]
+
+    writer.record(['e'], {**settings, 'center_freq': 446.0}, '1.7')
+    writer.close()
+    assert [value for _, kind, value in read_capture(path) if kind == DOA][-1] == ['e']
+
+
+def test_retime_follows_the_line_timestamps():
+    first = '1700000000000, 10.0, 1'
+    assert retime(first, anchor_ms=5_000, first_timestamp_ms=1700000000000, speed=1) == '5000, 10.0, 1'
+    assert retime('1700000000500, 10.0, 1', 5_000, 1700000000000, speed=10) == '5050, 10.0, 1'
+    assert retime('1700000000500, 10.0, 1', 5_000, 1700000000000, speed=0) == '5500, 10.0, 1'
+    assert retime('not a line', 5_000, 1700000000000, speed=1) == 'not a line'
+
+
+def test_replay_file_only_grows_without_rotation(tmp_path, monkeypatch):
+    monkeypatch.setattr(replay, 'DOA_FILE_ROTATE_BYTES', 4)
+    path = tmp_path / 'DOA_value.html'
+    path.write_text('')
+    writer = replay.DoaFileWriter(str(path), rotate=False)
+    writer.write(['a', 'b'])
+    writer.write(['c'])
+    assert path.read_text() == 'a\nb\nc\n'
+    rotating = replay.DoaFileWriter(str(path), rotate=True)
+    rotating.write(['d'])
+    assert path.read_text() == 'd\n'
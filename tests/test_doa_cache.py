@@ -0,0 +1,90 @@
+from src.dataclasses import CacheRecord, DoaBatch
+from src.doa_cache import DoaCache
+
+
+def record(timestamp: int, frequency_hz: int = 433_000_000) -> CacheRecord:
+    return CacheRecord(timestamp=timestamp, doa=float(timestamp % 360), confidence=1.0, rssi=-50.0,
+                       frequency_hz=frequency_hz, ant_arrangement='UCA')
+
+
+def filled_cache(timestamps: range, capacity: int = 16, **kwargs) -> DoaCache:
+    cache = DoaCache(capacity)
+    for timestamp in timestamps:
+        cache.append(record(timestamp, **kwargs))
+    return cache
+
+
+def test_oldest_timestamp_within_window():
+    cache = filled_cache(range(100, 110))
+    assert cache.oldest_timestamp() == 100
+    assert cache.oldest_timestamp(105) == 105
+    assert cache.oldest_timestamp(110) is None
+    assert [row[0] for row in cache.query(newer_than=105)] == [109, 108, 107, 106, 105]
+
+
+def test_extend_and_records_since_return_sequences():
+    cache = filled_cache(range(100, 105))
+    cursor = cache.generation
+    batch = DoaBatch(timestamps=[104, 105, 106], doas=[4.0, 5.0, 6.0], confidences=[1.0] * 3, rssis=[-50.0] * 3,
+                     frequencies=[433_000_000] * 3, arrangements=['UCA'] * 3)
+    added, sequences = cache.extend(batch)
+    assert added == [0, 1, 2]
+    assert sequences == [cursor + 1, cursor + 2, cursor + 3]
+
+    generation, records, since = cache.records_since(cursor + 1)
+    assert generation == cursor + 3
+    assert [record.timestamp for record in records] == [105, 106]
+    assert since == sequences[1:]
+
+
+def test_columns_of_some_frequencies():
+    cache = DoaCache(16)
+    for timestamp in range(100, 110):
+        cache.append(record(timestamp, frequency_hz=433_000_000 if timestamp % 2 else 446_000_000))
+    _, columns = cache.columns(newer_than=104, frequencies={433_000_000})
+    assert list(columns['timestamps']) == [105, 107, 109]
+    assert set(columns['frequencies']) == {433_000_000}
+    _, columns = cache.columns(newer_than=104)
+    assert list(columns['timestamps']) == [104, 105, 106, 107, 108, 109]
+
+
+def pages(cache: DoaCache, ascending: bool, limit: int, **filters) -> list[list[int]]:
+    """Follows the next cursors the way a client of /cache would, returning the timestamps of every page"""
+    result = []
+    cursor = None
+    while True:
+        bound = {'since_cursor' if ascending else 'before_cursor': cursor} if cursor is not None else {}
+        rows, cursor = cache.page(ascending=ascending, limit=limit, fields=('timestamp',), **filters, **bound)
+        result.append([row[0] for row in rows])
+        if cursor is None:
+            return result
+
+
+def test_pages_newest_first():
+    cache = filled_cache(range(100, 120))
+    assert pages(cache, ascending=False, limit=4, newer_than=110) == [[119, 118, 117, 116], [115, 114, 113, 112],
+                                                                      [111, 110]]
+
+
+def test_pages_oldest_first_across_the_ring_wrap():
+    cache = filled_cache(range(100, 120), capacity=8)
+    assert pages(cache, ascending=True, limit=3) == [[112, 113, 114], [115, 116, 117], [118, 119]]
+
+
+def test_pages_of_some_frequencies():
+    cache = DoaCache(32)
+    for timestamp in range(100, 120):
+        cache.append(record(timestamp, frequency_hz=(433_000_000, 446_000_000, 868_000_000)[timestamp % 3]))
+    frequencies = {433_000_000, 446_000_000}
+    expected = [timestamp for timestamp in range(119, 99, -1) if timestamp % 3 != 2]
+    assert sum(pages(cache, ascending=False, limit=5, frequencies=frequencies), []) == expected
+
+
+def test_offset_and_exact_last_page():
+    cache = filled_cache(range(100, 110))
+    rows, cursor = cache.page(offset=2, limit=3, fields=('timestamp', 'doa'))
+    assert rows == [[107, 107.0], [106, 106.0], [105, 105.0]]
+    assert cursor is not None
+    rows, cursor = cache.page(ascending=True, limit=10)
+    assert len(rows) == 10
+    assert cursor is None
@@ -0,0 +1,49 @@
+import logging
+
+import pytest
+
+from src import doa_parser
+from src.config import NUMPY_MIN_BATCH
+from src.doa_parser import DoaParser, parser_for_version
+
+
+def line(timestamp: int, doa: str, arrangement: str = 'UCA', confidence: str = '7.123', rssi: str = '-40.456') -> str:
+    return f'{timestamp}, {doa}, {confidence}, {rssi}, 433000000, {arrangement}, 0, TEST, 50.45, 30.52, 0, 0, None'
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def lines_count(request, monkeypatch) -> int:
+    if request.param == 'numpy':
+        if doa_parser.np is None:
+            pytest.skip('NumPy is not installed')
+        return NUMPY_MIN_BATCH
+    monkeypatch.setattr(doa_parser, 'np', None)
+    return 1
+
+
+def test_flips_uca_and_applies_array_angle(lines_count):
+    lines = [line(1000 + i, '90.5') for i in range(lines_count)] + [line(2000, '90.5', 'ULA')]
+    batch, rejected = DoaParser(use_receive_time=False).parse(lines, array_angle=300)
+    assert rejected == 0
+    assert batch.doas[0] == 209.5
+    assert batch.doas[-1] == 30.5
+    assert batch.timestamps[-1] == 2000
+    assert batch.confidences[0] == 7.12
+    assert batch.rssis[0] == -40.46
+    assert batch.arrangements[-1] == 'ULA'
+
+
+def test_skips_malformed_rows(lines_count):
+    lines = [line(1000 + i, '10') for i in range(lines_count)] + ['', 'a, b', line(3000, 'north'), line(3001, '10')]
+    batch, rejected = DoaParser(use_receive_time=False).parse(lines, array_angle=None)
+    assert rejected == 2
+    assert batch.timestamps[-1] == 3001
+    assert batch.doas[-1] == 350.0
+
+
+def test_kraken_1_6_uses_receive_time(caplog):
+    assert parser_for_version('1.6', logging.getLogger('tests')).use_receive_time
+    assert not parser_for_version('1.7').use_receive_time
+    with caplog.at_level(logging.WARNING):
+        assert not parser_for_version('not a version', logging.getLogger('tests')).use_receive_time
+    assert 'Unknown Kraken version format' in caplog.text
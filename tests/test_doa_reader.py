@@ -0,0 +1,64 @@
+import os
+
+from src import doa_reader
+from src.doa_reader import DoaFileReader
+
+
+def append(path: str, data: str):
+    with open(path, 'a') as f:
+        f.write(data)
+
+
+def test_returns_appended_lines_once(tmp_path):
+    path = str(tmp_path / 'DOA_value.html')
+    append(path, 'a\nb\n')
+    reader = DoaFileReader(path)
+    assert reader.read_lines() == ['a', 'b']
+    assert reader.read_lines() is None
+    append(path, 'c\n')
+    assert reader.read_lines() == ['c']
+
+
+def test_holds_a_tail_that_is_being_written(tmp_path, monkeypatch):
+    path = str(tmp_path / 'DOA_value.html')
+    append(path, 'a\n1700000000000, 329.4')
+    reader = DoaFileReader(path)
+    # The writer finishes the line while the reader waits for the file to settle
+    monkeypatch.setattr(doa_reader.time, 'sleep', lambda seconds: append(path, '325, 1\n'))
+    assert reader.read_lines() == ['a']
+    assert reader.read_lines() == ['1700000000000, 329.4325, 1']
+
+
+def test_returns_an_unterminated_line_once_settled(tmp_path):
+    path = str(tmp_path / 'DOA_value.html')
+    append(path, '1700000000000, 329.4325, 1')
+    reader = DoaFileReader(path)
+    assert reader.read_lines() == ['1700000000000, 329.4325, 1']
+    assert reader.read_lines() is None
+    # Terminating it later does not return it again
+    append(path, '\n')
+    assert reader.read_lines() == []
+    append(path, 'next\n')
+    assert reader.read_lines() == ['next']
+
+
+def test_starts_over_when_rewritten(tmp_path):
+    path = str(tmp_path / 'DOA_value.html')
+    append(path, 'first line\n')
+    reader = DoaFileReader(path)
+    assert reader.read_lines() == ['first line']
+    temp_path = path + '.tmp'
+    append(temp_path, 'other\n')
+    os.replace(temp_path, path)
+    assert reader.read_lines() == ['other']
+
+
+def test_skip_moves_past_the_contents(tmp_path):
+    path = str(tmp_path / 'DOA_value.html')
+    append(path, 'a\nb\n')
+    reader = DoaFileReader(path)
+    reader.skip()
+    assert reader.mtime_ns == os.stat(path).st_mtime_ns
+    assert reader.read_lines() is None
+    append(path, 'c\n')
+    assert reader.read_lines() == ['c']
@@ -0,0 +1,40 @@
+import json
+from array import array
+
+from src import encoders
+from tests.test_doa_cache import filled_cache
+
+
+def decode_columnar(body: bytes) -> tuple[dict, dict[str, list]]:
+    assert body[:4] == encoders.COLUMNAR_MAGIC
+    length, = encoders.COLUMNAR_HEADER_LENGTH.unpack(body[4:8])
+    header = json.loads(body[8:8 + length])
+    data = body[8 + length:]
+    columns = {}
+    for name, typecode, offset in header['columns']:
+        values = array(typecode)
+        values.frombytes(data[offset:offset + values.itemsize * header['rows']])
+        columns[name] = values.tolist()
+    return header, columns
+
+
+def test_columnar_matches_rows():
+    cache = filled_cache(range(100, 110))
+    query = {'newer_than': 102, 'ascending': True, 'offset': 1, 'limit': 4, 'fields': ('timestamp', 'doa')}
+    rows, last = cache.page(**query)
+    columns, columns_last = cache.page_columns(**query)
+    assert columns_last == last
+
+    header, decoded = decode_columnar(encoders.encode_columnar({'cursor': cache.generation, 'data': columns}))
+    assert header['rows'] == 4
+    assert header['cursor'] == cache.generation
+    assert [name for name, _, _ in header['columns']] == ['timestamp', 'doa']
+    assert list(zip(*decoded.values())) == [tuple(row) for row in rows]
+
+
+def test_columnar_empty_page():
+    cache = filled_cache(range(100, 110))
+    columns, _ = cache.page_columns(newer_than=200)
+    header, decoded = decode_columnar(encoders.encode_columnar({'data': columns}))
+    assert header['rows'] == 0
+    assert list(decoded) == ['timestamp', 'doa', 'confidence', 'rssi', 'frequency_hz']
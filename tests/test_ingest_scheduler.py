@@ -0,0 +1,73 @@
+import bisect
+
+from src.ingest_scheduler import IngestionScheduler, missed_run
+
+START_MS = 1_700_000_000_000
+
+
+def simulate(writes_ms: list[int], until_ms: int, initial_mtime_ms: int = None):
+    """
+    Runs a scheduler against a DOA file written at writes_ms, with a simulated clock. Returns the scheduler and, for
+    every write that a poll saw, the time from the write to that poll.
+    """
+    scheduler = IngestionScheduler(lambda: None, lambda: None, dict, initial_ms=100, min_ms=20, max_ms=1000,
+                                   stale_factor=3, thermal_c=75, thermal_factor=2)
+    latencies = {}
+    now_ms = START_MS
+    while now_ms < until_ms:
+        written = bisect.bisect_right(writes_ms, now_ms)
+        mtime_ms = writes_ms[written - 1] if written else initial_mtime_ms
+        if written and mtime_ms not in latencies:
+            latencies[mtime_ms] = now_ms - mtime_ms
+        scheduler.observe(int(mtime_ms * 1e6) if mtime_ms is not None else None)
+        now_ms += scheduler.next_delay_ms(int(now_ms * 1e6))
+    return scheduler, latencies
+
+
+def cadence(start_ms: int, end_ms: int, interval_ms: int) -> list[int]:
+    return list(range(start_ms, end_ms, interval_ms))
+
+
+def recent(latencies: dict, since_ms: int) -> list[float]:
+    return [latency for written_at, latency in latencies.items() if written_at >= since_ms]
+
+
+def test_learns_1_hz_when_stale_at_startup():
+    writes = cadence(START_MS + 5_000, START_MS + 60_000, 1000)
+    scheduler, latencies = simulate(writes, START_MS + 60_000, initial_mtime_ms=START_MS - 3_600_000)
+    assert abs(scheduler.interval_ms - 1000) < 50
+    assert scheduler.state == 'active'
+    late = [written_at for written_at in writes if written_at >= START_MS + 30_000]
+    assert all(written_at in latencies for written_at in late[:-1])
+    assert max(recent(latencies, START_MS + 30_000)) < 100
+
+
+def test_learns_10_hz():
+    writes = cadence(START_MS, START_MS + 30_000, 100)
+    scheduler, latencies = simulate(writes, START_MS + 30_000)
+    assert abs(scheduler.interval_ms - 100) < 5
+    seen = recent(latencies, START_MS + 10_000)
+    assert len(seen) >= len(cadence(START_MS + 10_000, START_MS + 30_000, 100)) - 1
+    assert max(seen) < 30
+
+
+def test_follows_a_slower_cadence():
+    writes = cadence(START_MS, START_MS + 20_000, 100) + cadence(START_MS + 20_000, START_MS + 80_000, 1000)
+    scheduler, latencies = simulate(writes, START_MS + 80_000)
+    assert abs(scheduler.interval_ms - 1000) < 50
+    assert max(recent(latencies, START_MS + 50_000)) < 100
+
+
+def test_follows_a_faster_cadence():
+    writes = cadence(START_MS, START_MS + 20_000, 1000) + cadence(START_MS + 20_000, START_MS + 50_000, 100)
+    scheduler, latencies = simulate(writes, START_MS + 50_000)
+    assert abs(scheduler.interval_ms - 100) < 5
+    seen = recent(latencies, START_MS + 30_000)
+    assert len(seen) >= len(cadence(START_MS + 30_000, START_MS + 50_000, 100)) - 1
+    assert max(seen) < 30
+
+
+def test_missed_runs():
+    assert not missed_run(late_ms=1, duration_ms=30, delay_ms=100)
+    assert missed_run(late_ms=150, duration_ms=30, delay_ms=100)
+    assert missed_run(late_ms=1, duration_ms=120, delay_ms=100)
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+from src import kraken_settings
+from src.kraken_settings import SettingsFile, SettingsWriter
+
+
+def write_json(path: str, settings: dict):
+    with open(path, 'w') as f:
+        f.write(json.dumps(settings))
+
+
+def read_json(path: str) -> dict:
+    with open(path) as f:
+        return json.loads(f.read())
+
+
+def counted_writes(writer: SettingsWriter) -> list[dict]:
+    writes = []
+    write = writer._write
+    writer._write = lambda updates: (writes.append(dict(updates)), write(updates))
+    return writes
+
+
+def test_merges_debounced_updates_into_one_write(tmp_path, monkeypatch):
+    path = str(tmp_path / 'settings.json')
+    write_json(path, {'center_freq': 433.0, 'station_id': 'A'})
+    os.chmod(path, 0o640)
+    writer = SettingsWriter(path, debounce_ms=50, fsync='none')
+    writes = counted_writes(writer)
+    settings = SettingsFile(path, stat_interval_ms=0)
+    monkeypatch.setitem(kraken_settings._writers, path, writer)
+
+    writer.update({'center_freq': 446.0})
+    writer.update({'station_id': 'B'})
+    # Pending updates are seen at once in this process, before they are written
+    assert settings.snapshot()['center_freq'] == 446.0
+    assert read_json(path)['center_freq'] == 433.0
+
+    deadline = time.monotonic() + 2
+    while writer.pending() is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writes == [{'center_freq': 446.0, 'station_id': 'B'}]
+    assert read_json(path) == {'center_freq': 446.0, 'station_id': 'B'}
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert settings.snapshot()['station_id'] == 'B'
+
+
+def test_leaves_the_file_alone_when_nothing_changes(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    write_json(path, {'latitude': 50.45})
+    inode = os.stat(path).st_ino
+    writer = SettingsWriter(path, debounce_ms=0, fsync='none')
+    writer.update({'latitude': 50.45})
+    assert os.stat(path).st_ino == inode
+    writer.update({'latitude': 50.5})
+    assert os.stat(path).st_ino != inode
+    assert read_json(path) == {'latitude': 50.5}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_notifies_listeners_of_changed_keys(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    write_json(path, {'center_freq': 433.0, 'station_id': 'A'})
+    settings = SettingsFile(path, stat_interval_ms=0)
+    changes = []
+    settings.subscribe('center_freq', lambda key, old, new: changes.append((key, old, new)))
+    settings.refresh()
+    SettingsWriter(path, debounce_ms=0, fsync='none').update({'center_freq': 446.0, 'station_id': 'B'})
+    settings.refresh()
+    assert changes == [('center_freq', 433.0, 446.0)]
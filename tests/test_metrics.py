@@ -0,0 +1,21 @@
+from src.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_registry_labels_every_series():
+    registry = Registry()
+    requests = registry.register(Counter('requests_total', 'Requests', labels=('endpoint',)))
+    registry.register(Gauge('subscribers', 'Subscribers', callback=lambda: 2))
+    latency = registry.register(Histogram('latency_seconds', 'Latency', buckets=(0.1,)))
+    requests.inc(1, '/cache')
+    latency.observe(0.05)
+
+    registry.labels['worker'] = '42'
+    lines = [line for line in registry.render().splitlines() if not line.startswith('#')]
+    assert lines == [
+        'requests_total{endpoint="/cache",worker="42"} 1',
+        'subscribers{worker="42"} 2',
+        'latency_seconds_bucket{worker="42",le="0.1"} 1',
+        'latency_seconds_bucket{worker="42",le="+Inf"} 1',
+        'latency_seconds_sum{worker="42"} 0.05',
+        'latency_seconds_count{worker="42"} 1',
+    ]
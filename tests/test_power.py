@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from src import power
+from src.power import PowerJobs, FakePowerBackend, PowerJob, SUCCEEDED, FAILED, QUEUED
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch) -> PowerJobs:
+    monkeypatch.setattr(power, 'SETTLE_S', 0)
+    return PowerJobs(FakePowerBackend(0.05, 0.05), 10, str(tmp_path / 'power.lock'), str(tmp_path / 'jobs.json'))
+
+
+def finished(jobs: PowerJobs, job_id: str, timeout_s: float = 5) -> dict:
+    deadline = time.monotonic() + timeout_s
+    job = jobs.get(job_id)
+    while job['state'] not in (SUCCEEDED, FAILED) and time.monotonic() < deadline:
+        job = jobs.wait(job_id, job, 0.1)
+    return job
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_submitting_the_pending_transition_again_returns_its_job(jobs):
+    off = jobs.submit(False)
+    assert jobs.submit(False) is off
+    assert finished(jobs, off.id)['state'] == SUCCEEDED
+    assert jobs.submit(False).id != off.id
+
+
+def test_runs_off_then_on_in_order(jobs):
+    off = jobs.submit(False)
+    on = jobs.submit(True)
+    assert finished(jobs, on.id)['state'] == SUCCEEDED
+    off_json = jobs.get(off.id)
+    assert off_json['state'] == SUCCEEDED
+    assert off_json['finished_at'] <= jobs.get(on.id)['started_at']
+    assert jobs.backend.relay and jobs.backend.connected and jobs.backend.running
+    assert [job['id'] for job in jobs.jobs()] == [off.id, on.id]
+
+
+def test_step_timeout_fails_the_job(jobs, monkeypatch):
+    monkeypatch.setattr(power, 'SDR_CONNECT_TIMEOUT_S', 0.1)
+    jobs.backend.relay = jobs.backend.connected = jobs.backend.running = False
+    jobs.backend.device_delay_s = 1
+    job = finished(jobs, jobs.submit(True).id)
+    assert job['state'] == FAILED
+    assert job['error'] == 'Kraken SDR have not connected in time'
+    assert job['steps_done'] == 1
+
+
+def write_jobs_file(jobs: PowerJobs, *others: dict):
+    with open(jobs.jobs_file, 'w') as f:
+        json.dump(list(others), f)
+
+
+def other_job(power_on: bool, pid: int) -> dict:
+    job = PowerJob(power_on, 4).to_json()
+    job['pid'] = pid
+    return job
+
+
+def test_jobs_of_exited_processes_are_failed(jobs):
+    write_jobs_file(jobs, other_job(True, dead_pid()), other_job(False, os.getppid()))
+    dead, alive = jobs.jobs()
+    assert dead['state'] == FAILED
+    assert dead['error'] == 'The process running the job exited'
+    assert alive['state'] == QUEUED
+
+
+def test_submitting_the_pending_transition_of_another_process_returns_its_job(jobs):
+    pending = other_job(False, os.getppid())
+    write_jobs_file(jobs, pending)
+    job = jobs.submit(False)
+    assert job.id == pending['id']
+    assert job.pid == os.getppid()
+    assert jobs._jobs == {}
+    assert jobs.submit(True).id != pending['id']
@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+
+from benchmarks.synthetic import doa_line
+from src.app_data import AppData
+from src.config import DOA_FILE, DOA_PUSH_STALE_MS
+from src.utils import now
+from src.ws_client import decode_doa_lines
+
+logger = logging.getLogger('tests')
+
+
+def test_decode_plain_text():
+    line = doa_line(1700000000000)
+    assert decode_doa_lines(f'{line}\nnot, a, doa\n') == [line]
+    assert decode_doa_lines(line.encode()) == [line]
+
+
+def test_decode_json_anywhere_in_order():
+    first, second = doa_line(1700000000000), doa_line(1700000000100)
+    message = json.dumps({'type': 'doa', 'payload': [{'text': first}, {'nested': {'text': second}}], 'spectrum': [1]})
+    assert decode_doa_lines(message) == [first, second]
+
+
+def test_decode_ignores_other_messages():
+    assert decode_doa_lines(json.dumps({'spectrum': [1.0, 2.0], 'label': 'a, b'})) == []
+    assert decode_doa_lines('') == []
+
+
+def write_doa_file(lines: list[str]):
+    with open(DOA_FILE, 'w') as f:
+        f.writelines(line + '\n' for line in lines)
+
+
+def test_lookalike_lines_do_not_switch_file_ingestion_off():
+    app_data = AppData()
+    app_data.ingest_pushed(['a, b, c, d, e, f, g, h, i, j, k, l, m'], logger)
+    assert not app_data.push_active()
+
+    write_doa_file([doa_line(now())])
+    app_data.update_cache(logger)
+    assert len(app_data.cache) == 1
+
+
+def test_handover_between_push_and_file():
+    app_data = AppData()
+    pushed_at = now()
+    app_data.ingest_pushed([doa_line(pushed_at)], logger)
+    assert app_data.push_active()
+    assert len(app_data.cache) == 1
+
+    # The file is not ingested while the feed delivers records, but its writes are still followed
+    write_doa_file([doa_line(pushed_at + 10)])
+    app_data.update_cache(logger)
+    assert len(app_data.cache) == 1
+    assert app_data.doa_reader.mtime_ns == os.stat(DOA_FILE).st_mtime_ns
+
+    # Once the feed goes quiet, the file takes over again
+    app_data.pushed_at = now() - DOA_PUSH_STALE_MS
+    assert not app_data.push_active()
+    write_doa_file([doa_line(pushed_at + 20)])
+    app_data.update_cache(logger)
+    assert len(app_data.cache) == 2
@@ -0,0 +1,38 @@
+import threading
+
+from src import shm_cache
+from src.dataclasses import DoaBatch
+from src.shm_cache import SharedDoaCache
+from tests.test_doa_cache import record
+
+
+def test_reader_sees_writer_records(tmp_path):
+    path = str(tmp_path / 'cache.shm')
+    writer = SharedDoaCache.create(path, 8)
+    reader = SharedDoaCache.open(path)
+    for timestamp in range(100, 110):
+        writer.append(record(timestamp))
+    assert len(reader) == 8
+    assert [row[0] for row in reader.query(newer_than=105)] == [109, 108, 107, 106, 105]
+    assert reader.generation == writer.generation
+    assert reader.updated_at == 0
+
+    writer.extend(DoaBatch(timestamps=[110], doas=[1.0], confidences=[1.0], rssis=[-50.0],
+                           frequencies=[433_000_000], arrangements=['UCA']))
+    assert reader.updated_at > 0
+
+
+def test_reader_waits_for_the_writer_after_retries(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cache.shm')
+    writer = SharedDoaCache.create(path, 8)
+    reader = SharedDoaCache.open(path)
+    monkeypatch.setattr(shm_cache, 'READ_ATTEMPTS', 1)
+    sizes = []
+    with writer._lock:
+        thread = threading.Thread(target=lambda: sizes.append(len(reader)))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        writer._append((100, 1.0, 1.0, -50.0, 433_000_000, 'UCA'))
+    thread.join(1)
+    assert sizes == [1]